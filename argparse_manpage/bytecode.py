@@ -0,0 +1,113 @@
+"""
+Bytecode cache for the --pyfile scripts.
+
+The runpy.run_path() function compiles the script from source on every call,
+and the standard __pycache__ machinery ignores files without the '.py'
+suffix (typical for the bin/ scripts).  Here, the compiled code objects are
+cached in the given cache directory (only used with --cache-dir, nothing is
+written outside the user-specified directories), keyed by the hash of the
+source (and the script path, and the Python bytecode version).  Following
+Python, nothing is written if sys.dont_write_bytecode is set
+(PYTHONDONTWRITEBYTECODE).
+"""
+
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import types
+from importlib.util import MAGIC_NUMBER
+
+from argparse_manpage.cache import evict_lru
+
+DEFAULT_BYTECODE_CACHE_SIZE = 32 * 1024 * 1024
+
+_SUFFIX = ".pyc"
+
+# The run_path() module name
+_RUN_NAME = "<run_path>"
+
+
+def _store(directory, path, code):
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmpname = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as stream:
+                stream.write(MAGIC_NUMBER)
+                stream.write(marshal.dumps(code))
+            os.replace(tmpname, path)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+        evict_lru(directory, _SUFFIX, DEFAULT_BYTECODE_CACHE_SIZE)
+    except OSError:
+        # the cache is just an optimization
+        pass
+
+
+def compile_file(filename, cache_dir):
+    """
+    Compile the Python FILENAME source into a code object, or load it from
+    the CACHE_DIR if it was compiled before.
+    """
+    with open(filename, "rb") as fd:
+        source = fd.read()
+
+    digest = hashlib.sha256(MAGIC_NUMBER)
+    digest.update(os.fsencode(filename) + b"\0")
+    digest.update(source)
+    path = os.path.join(cache_dir, digest.hexdigest() + _SUFFIX)
+
+    try:
+        with open(path, "rb") as fd:
+            data = fd.read()
+        if data[:len(MAGIC_NUMBER)] == MAGIC_NUMBER:
+            code = marshal.loads(data[len(MAGIC_NUMBER):])
+            # mark the entry as recently used
+            os.utime(path, None)
+            return code
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    code = compile(source, filename, "exec", dont_inherit=True)
+    if not sys.dont_write_bytecode:
+        _store(cache_dir, path, code)
+    return code
+
+
+def run_path(filename, cache_dir):
+    """
+    Drop-in replacement for runpy.run_path(FILENAME) for Python scripts, but
+    the compiled script is cached in CACHE_DIR (see compile_file()).  Return the resulting
+    module globals dictionary.
+    """
+    code = compile_file(filename, cache_dir)
+
+    # Mimic runpy; temporary sys.modules entry, and sys.argv[0].
+    module = types.ModuleType(_RUN_NAME)
+    module.__dict__.update({
+        "__file__": filename,
+        "__cached__": None,
+        "__doc__": None,
+        "__loader__": None,
+        "__package__": "",
+        "__spec__": None,
+    })
+    saved_module = sys.modules.get(_RUN_NAME)
+    saved_argv0 = sys.argv[0] if sys.argv else None
+    sys.modules[_RUN_NAME] = module
+    if sys.argv:
+        sys.argv[0] = filename
+    try:
+        exec(code, module.__dict__)  # pylint: disable=exec-used
+    finally:
+        if sys.argv:
+            sys.argv[0] = saved_argv0
+        if saved_module is None:
+            sys.modules.pop(_RUN_NAME, None)
+        else:
+            sys.modules[_RUN_NAME] = saved_module
+    return module.__dict__.copy()
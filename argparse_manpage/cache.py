@@ -0,0 +1,128 @@
+"""
+Persistent on-disk cache of parser snapshots.
+
+Each cache entry is a pickled ParserSnapshot together with the list of source
+files (and their stamps, see argparse_manpage.stamps) the parser was loaded
+from.  The entry is only used if none of those files changed.  The least
+recently used entries are dropped once the cache directory grows over the
+configured size.
+"""
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+from argparse_manpage import __version__
+from argparse_manpage.stamps import source_changed, source_stamp
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+_SUFFIX = ".snapshot"
+
+
+def evict_lru(directory, suffix, max_size):
+    """
+    Remove the least recently used (the oldest mtime) files with SUFFIX from
+    DIRECTORY, so they don't take more than MAX_SIZE bytes.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+
+
+class SnapshotCache(object):
+    """
+    Cache of ParserSnapshot objects in DIRECTORY, limited to MAX_SIZE bytes.
+    """
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(*parts):
+        """
+        Calculate the cache key from the PARTS describing the parser location
+        (module/file name, object name, etc.).
+        """
+        identity = repr((__version__, sys.version_info[:2]) + parts)
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, key):
+        """
+        Return the cached (snapshot, sources) pair, or None if there's no
+        (valid) entry
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fd:
+                entry = pickle.load(fd)
+        except (OSError, IOError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError, IndexError, TypeError):
+            return None
+
+        for stamp in entry["sources"]:
+            if source_changed(stamp):
+                return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry["snapshot"], [stamp[0] for stamp in entry["sources"]]
+
+    def put(self, key, snapshot, sources):
+        """
+        Store the SNAPSHOT loaded from the list of SOURCES files
+        """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+
+        entry = {
+            "sources": [source_stamp(source) for source in sources],
+            "snapshot": snapshot,
+        }
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as stream:
+                pickle.dump(entry, stream, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, self._path(key))
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries, so the cache doesn't take more
+        than the configured max_size bytes.
+        """
+        evict_lru(self.directory, _SUFFIX, self.max_size)
@@ -5,10 +5,36 @@
 # unfortunate file naming.
 from __future__ import absolute_import
 
+# The modules needed only by some options (--serve, --connect, --watch,
+# --cache-dir, profiling) are imported on demand, to keep the startup fast.
+# pylint: disable=import-outside-toplevel
+
 import argparse
+import contextlib
+import os
+import sys
+
+from argparse_manpage.compat import get_reproducible_date
+from argparse_manpage.tooling import (
+    COMPRESSION_SUFFIXES,
+    EXTRACT_METHODS,
+    get_compression,
+    get_page_outputs,
+    read_manpages_spec,
+    write_depfile,
+    write_manpage_from_spec,
+    write_to_filename,
+)
+from argparse_manpage.manpage import (
+    MANPAGE_DATA_ATTRS,
+    SHARED_OPTIONS_METHODS,
+)
+from argparse_manpage.snapshot import SYNOPSIS_METHODS, WRAP_METHODS
+from argparse_manpage.timings import collect_timings
 
-from argparse_manpage.tooling import get_parser, write_to_filename
-from argparse_manpage.manpage import MANPAGE_DATA_ATTRS, Manpage
+# The default --cache-size, in megabytes (see argparse_manpage.cache, not
+# imported unless --cache-dir is used)
+DEFAULT_CACHE_SIZE_MB = 64
 
 
 description = """
@@ -20,7 +46,8 @@ ap = argparse.ArgumentParser(
     description=description,
 )
 
-src_group = ap.add_mutually_exclusive_group(required=True)
+# One of the groups is required, unless --batch is used
+src_group = ap.add_mutually_exclusive_group()
 src_group.add_argument(
     "--module",
     help="search the OBJECT/FUNCTION in MODULE"
@@ -31,7 +58,7 @@ src_group.add_argument(
     help="search the OBJECT/FUNCTION in FILE"
 )
 
-obj_group = ap.add_mutually_exclusive_group(required=True)
+obj_group = ap.add_mutually_exclusive_group()
 obj_group.add_argument(
     "--function",
     help="call FUNCTION from MODULE/FILE to obtain ArgumentParser object",
@@ -42,6 +69,20 @@ obj_group.add_argument(
 )
 
 
+ap.add_argument("--extract", choices=EXTRACT_METHODS, help=(
+    "How to obtain the ArgumentParser object.  The 'import' method (default) "
+    "imports the MODULE/FILE.  The 'static' method extracts the parser from "
+    "the MODULE/FILE source code without executing it, so the program "
+    "dependencies needn't be installed; if the parser is built dynamically, "
+    "it falls back to 'import'."))
+ap.add_argument("--stub-imports", metavar="PACKAGES", help=(
+    "Comma separated list of packages whose imports are replaced by "
+    "placeholder modules while loading the MODULE/FILE; e.g. heavy "
+    "dependencies not needed to build the ArgumentParser.  The '*' item "
+    "stubs any package that is not installed, '!PACKAGE' never stubs "
+    "PACKAGE."))
+
+
 ap.add_argument("--project-name", help="Name of the project the documented program is part of.")
 ap.add_argument("--prog", help="Substitutes %%prog in ArgumentParser's usage.")
 ap.add_argument("--version", help=(
@@ -58,8 +99,41 @@ ap.add_argument("--author-email", action="append", dest="authors",
 ap.add_argument("--url", help="Link to project's homepage")
 ap.add_argument("--format", default="pretty", choices=("pretty", "single-commands-section"),
                 help="Format of the generated man page. Defaults to 'pretty'.")
+ap.add_argument("--synopsis", choices=SYNOPSIS_METHODS, help=(
+    "How to build the usage synopsis.  The 'argparse' method (default) "
+    "uses the ArgumentParser usage, as printed by the program.  The 'native' "
+    "method builds the synopsis directly from the arguments, with bold "
+    "options and italic values; it is much faster for parsers with many "
+    "options or sub-commands."))
+ap.add_argument("--width", metavar="COLUMNS", type=int, help=(
+    "Wrap the help texts (as formatted by the ArgumentParser) to COLUMNS, "
+    "by default 78.  The terminal width is never used, so the output is "
+    "reproducible."))
+ap.add_argument("--wrap", choices=WRAP_METHODS, help=(
+    "How to wrap the help texts.  The 'argparse' method (default) wraps them "
+    "by the ArgumentParser formatter.  With 'none', the texts are not "
+    "wrapped (groff fills the paragraphs), which is faster; the texts "
+    "pre-formatted by Raw*HelpFormatter are kept as they are."))
+ap.add_argument("--shared-options", choices=SHARED_OPTIONS_METHODS, help=(
+    "How to document the options shared by several sub-commands (e.g. "
+    "through ArgumentParser(parents=[...])).  By default ('inline') they are "
+    "documented by each sub-command.  With 'common', they are documented "
+    "only once, in the COMMON OPTIONS section, and the sub-commands just "
+    "list them."))
 ap.add_argument("--output", dest='outfile', default='-',
                 help="Output file. Defaults to stdout.")
+ap.add_argument("--compress", choices=tuple(COMPRESSION_SUFFIXES) + ("none",),
+                help=(
+                    "Compress the generated manual page.  By default, the "
+                    "compression method is detected from the --output file "
+                    "name suffix (.gz, .xz or .zst).  The appropriate suffix "
+                    "is appended to the --output file name if missing."))
+ap.add_argument("--split-subcommands", metavar="DIR", help=(
+    "Split the manual page git-style, one page per sub-command: the "
+    "top-level page (the --output file, by default DIR/PROG.SECTION) only "
+    "lists the commands, and each command is documented by its own "
+    "PROG-COMMAND page (PROG-COMMAND-SUBCOMMAND, etc.) written into DIR.  "
+    "The pages refer to each other in the SEE ALSO section."))
 ap.add_argument("--manual-section", help=(
     "Section of the manual, by default 1.  See man (7) man-pages for more "
     "info about existing sections."))
@@ -70,6 +144,55 @@ ap.add_argument("--include", metavar="FILE", help=(
     "File that contains extra material for the man page."))
 ap.add_argument("--manfile", metavar="FILE", help=(
     "File containing a complete man page."))
+ap.add_argument("--cache-dir", metavar="DIR", help=(
+    "Cache the loaded ArgumentParser objects in DIR, and don't import the "
+    "MODULE/FILE again until some of its source files change."))
+ap.add_argument("--cache-size", metavar="MB", type=int,
+                default=DEFAULT_CACHE_SIZE_MB, help=(
+                    "Maximum size of the --cache-dir in megabytes, the least "
+                    "recently used entries are removed first.  Defaults to "
+                    "%(default)s."))
+ap.add_argument("--batch", metavar="SPEC", help=(
+    "Generate all the manual pages specified in the SPEC file, in one "
+    "process.  SPEC is either a pyproject.toml file (with the "
+    "[tool.build_manpages] table), setup.cfg file (with the [build_manpages] "
+    "section), or a file with one 'file.1:option=value:...' specification "
+    "per line.  The other options given on command-line are used as defaults "
+    "for all the pages."))
+ap.add_argument("--depfile", metavar="FILE", help=(
+    "Write a Makefile-syntax dependency file listing the generated manual "
+    "page(s), and all the Python source files and --include/--manfile files "
+    "it was generated from.  Useful for Make, Ninja or Meson."))
+ap.add_argument("--serve", metavar="SOCKET", help=(
+    "Run a server on the SOCKET (UNIX socket) rendering the manual pages on "
+    "request, see --connect.  The loaded ArgumentParser objects are kept in "
+    "memory, and re-loaded only when their source files change."))
+ap.add_argument("--connect", metavar="SOCKET", help=(
+    "Don't load the MODULE/FILE, but let the --serve server listening on "
+    "SOCKET render the manual page."))
+ap.add_argument("--watch", action="store_true", help=(
+    "After generating the manual page(s), keep watching the files they were "
+    "generated from (Python modules, --include and --manfile files), and "
+    "re-generate the affected pages when those change.  Requires --output "
+    "or --batch."))
+ap.add_argument("--timings", nargs="?", const="text", choices=("text", "json"),
+                metavar="FORMAT", help=(
+                    "Report the time spent in the individual stages of the "
+                    "manual page generation (importing the MODULE/FILE, "
+                    "calling the FUNCTION, formatting the usage strings and "
+                    "argument groups, rendering, writing), and per "
+                    "sub-command, to stderr.  FORMAT is 'text' (default) or "
+                    "'json'."))
+ap.add_argument("--profile-output", metavar="FILE", help=(
+    "Run the whole manual page generation under cProfile, and save the "
+    "statistics into FILE (readable by the 'pstats' module)."))
+ap.add_argument("--memory-profile", action="store_true", help=(
+    "Trace the memory allocations (tracemalloc) while loading the parser and "
+    "rendering the manual page, and report the top allocation sites to "
+    "stderr."))
+
+# Options that make no sense as defaults for all --batch pages
+BATCH_IGNORED_ATTRS = ("prog", "manfile")
 
 
 def args_to_manpage_data(args):
@@ -80,8 +203,167 @@ def args_to_manpage_data(args):
     return data
 
 
+def batch(args):
+    """
+    Generate all the manual pages specified in the args.batch file
+    """
+    try:
+        manpages_data = read_manpages_spec(args.batch)
+    except (OSError, IOError, ValueError) as err:
+        ap.error(str(err))
+
+    defaults = {}
+    for attr, value in args_to_manpage_data(args).items():
+        if value is not None and attr not in BATCH_IGNORED_ATTRS:
+            defaults[attr] = value
+    # All the pages are generated at the same time
+    defaults["date"] = get_reproducible_date()
+
+    cache = _get_cache(args)
+
+    dependencies = []
+    pages = {}
+    for page, page_data in manpages_data.items():
+        if page_data.get("manfile"):
+            # pre-written manual page, nothing to generate
+            continue
+        data = dict(defaults)
+        data.update(page_data)
+        if data.get("format", "pretty") not in ("pretty", "single-commands-section"):
+            ap.error("{0}: unsupported format {1}".format(page, data["format"]))
+        for option in ("compress", "extract", "stub_imports",
+                       "split_subcommands"):
+            if getattr(args, option) and option not in data:
+                data[option] = getattr(args, option)
+        try:
+            page, _ = get_compression(page, data.get("compress"))
+        except ValueError as err:
+            ap.error("{0}: {1}".format(page, err))
+        inputs = write_manpage_from_spec(page, data, cache=cache)
+        dependencies.append((page, inputs))
+        pages[page] = data
+
+    if args.depfile:
+        _write_depfile(args.depfile, dependencies, pages)
+    if args.watch:
+        _watch(args, dependencies,
+               lambda page: write_manpage_from_spec(page, pages[page], cache=cache),
+               pages)
+
+
+def _get_cache(args):
+    """
+    Return the SnapshotCache for the args.cache_dir, or None
+    """
+    if not args.cache_dir:
+        return None
+    from argparse_manpage.cache import SnapshotCache
+    return SnapshotCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+
+def _write_depfile(filename, dependencies, pages):
+    """
+    Write the (page, inputs) DEPENDENCIES into the FILENAME depfile, all the
+    files written for the page are the targets (e.g. the split sub-command
+    pages, see get_page_outputs()); PAGES is the {page: data} dict
+    """
+    write_depfile(filename, [(get_page_outputs(page, pages[page]), inputs)
+                             for page, inputs in dependencies])
+
+
+def _watch(args, dependencies, build, pages):
+    """
+    Watch the (page, inputs) DEPENDENCIES, and re-generate pages by BUILD,
+    PAGES is the {page: data} dict
+    """
+    from argparse_manpage.watch import watch
+    after = None
+    if args.depfile:
+        after = lambda inputs: _write_depfile(args.depfile,
+                                              list(inputs.items()), pages)
+    watch(dict(dependencies), build, after=after)
+
+
+def connect(args, import_type, import_from, obj_type, obj_name):
+    """
+    Let the server listening on args.connect socket render the manual page,
+    return the (manpage, inputs) pair.
+    """
+    from argparse_manpage.server import request_render
+    request = args_to_manpage_data(args)
+    request.update({
+        import_type: import_from,
+        obj_type: obj_name,
+        "extract": args.extract,
+        "stub_imports": args.stub_imports,
+        "date": get_reproducible_date(),
+        "cwd": os.getcwd(),
+    })
+    try:
+        response = request_render(args.connect, request)
+    except (OSError, IOError, RuntimeError) as err:
+        ap.error("can not connect {0}: {1}".format(args.connect, err))
+    if response.get("status") != "ok":
+        sys.stderr.write("argparse-manpage: {0}\n".format(response.get("error")))
+        sys.exit(1)
+    return response["manpage"], response["inputs"]
+
+
 def main():
     args = ap.parse_args()
+    timings = memory = None
+    with contextlib.ExitStack() as stack:
+        if args.timings:
+            timings = stack.enter_context(collect_timings())
+        if args.memory_profile:
+            from argparse_manpage.profiling import memory_profile
+            memory = stack.enter_context(memory_profile())
+        if args.profile_output:
+            from argparse_manpage.profiling import cpu_profile
+            stack.enter_context(cpu_profile(args.profile_output))
+        run(args)
+    if timings:
+        sys.stderr.write(timings.format(args.timings))
+    if memory:
+        sys.stderr.write(memory.format())
+
+
+def run(args):
+    """
+    Generate the manual page(s) according to the parsed ARGS
+    """
+    if args.width is not None and args.width <= 0:
+        ap.error("--width must be a positive number")
+    if args.serve:
+        if args.module or args.pyfile or args.batch or args.connect:
+            ap.error("--serve can not be combined with --module, --pyfile, "
+                     "--batch or --connect")
+        from argparse_manpage.server import serve
+        serve(args.serve)
+        return
+
+    if args.batch:
+        if args.module or args.pyfile or args.function or args.object:
+            ap.error("--batch can not be combined with --module, --pyfile, "
+                     "--function or --object")
+        batch(args)
+        return
+
+    if not args.module and not args.pyfile:
+        ap.error("one of the arguments --module --pyfile is required")
+    if not args.function and not args.object:
+        ap.error("one of the arguments --function --object is required")
+    if args.depfile and args.outfile == '-':
+        ap.error("--depfile requires --output")
+    if args.watch and (args.outfile == '-' or args.connect):
+        ap.error("--watch requires --output, and can not be combined with "
+                 "--connect")
+    if args.split_subcommands and args.connect:
+        ap.error("--split-subcommands can not be combined with --connect")
+    try:
+        outfile, compress = get_compression(args.outfile, args.compress)
+    except ValueError as err:
+        ap.error(str(err))
 
     import_type = 'pyfile'
     import_from = args.pyfile
@@ -95,7 +377,33 @@ def main():
         obj_type = 'function'
         obj_name = args.function
 
-    parser = get_parser(import_type, import_from, obj_name, obj_type, prog=args.prog)
+    if args.connect:
+        text, inputs = connect(args, import_type, import_from, obj_type, obj_name)
+        write_to_filename(text, outfile, compress)
+        if args.depfile:
+            write_depfile(args.depfile, [(outfile, inputs)])
+        return
+
+    cache = _get_cache(args)
+
     data = args_to_manpage_data(args)
-    manpage = Manpage(parser, format=args.format, _data=data)
-    write_to_filename(str(manpage), args.outfile)
+    data.update({
+        'import_type': import_type,
+        'import_from': import_from,
+        'objtype': obj_type,
+        'objname': obj_name,
+        'extract': args.extract or 'import',
+        'stub_imports': args.stub_imports,
+        'compress': args.compress,
+        'split_subcommands': args.split_subcommands,
+    })
+    if args.split_subcommands and outfile == '-':
+        # the top-level page goes to the DIR, too
+        outfile = None
+    inputs = write_manpage_from_spec(outfile, data, cache=cache)
+    if args.depfile:
+        _write_depfile(args.depfile, [(outfile, inputs)], {outfile: data})
+    if args.watch:
+        _watch(args, [(outfile, inputs)],
+               lambda page: write_manpage_from_spec(page, data, cache=cache),
+               {outfile: data})
@@ -0,0 +1,91 @@
+"""
+The options shared by several (sub)parsers, see '--shared-options common'.
+
+The actions shared through ArgumentParser(parents=[..]) map to the same
+ActionSnapshot, so the shared options are found by the snapshot identity.
+They are documented only once, in the COMMON OPTIONS section; the options
+shared by different sets of (sub)parsers are documented in separate
+sub-sections, named by the (sub)commands sharing them.
+"""
+
+from collections import OrderedDict
+
+
+def iter_parsers(parser, name):
+    """
+    Generate the (command name, parser) pairs for the PARSER snapshot (named
+    NAME) and all its sub-parsers, in the page order
+    """
+    yield name, parser
+    for group in parser.groups:
+        if group.subparsers is None:
+            continue
+        for command in group.subparsers.commands:
+            for pair in iter_parsers(command.parser,
+                                     "{} {}".format(name, command.name)):
+                yield pair
+
+
+def _iter_actions(parser):
+    for group in parser.groups:
+        if group.subparsers is None:
+            for action in group.actions:
+                yield action
+
+
+class CommonOptions(object):
+    """
+    The actions documented in more than one (sub)parser of the PARSER
+    snapshot tree (named PROG).  Without PARSER, there are no common options.
+    """
+    def __init__(self, parser=None, prog=None):
+        seen = OrderedDict()
+        for name, subparser in iter_parsers(parser, prog) if parser else ():
+            for action in _iter_actions(subparser):
+                seen.setdefault(id(action), (action, []))[1].append(name)
+
+        # the [(command names, [action, ..]), ..] list, in the order of
+        # appearance
+        sets = OrderedDict()
+        for action, names in seen.values():
+            if len(names) > 1:
+                sets.setdefault(tuple(names), []).append(action)
+        self.sets = list(sets.items())
+        self._actions = set(id(action) for _, actions in self.sets
+                            for action in actions)
+
+    def __len__(self):
+        return len(self._actions)
+
+    def __contains__(self, action):
+        return id(action) in self._actions
+
+    def names(self, parser):
+        """
+        Return the list of the common option names (or positional argument
+        metavars) of the PARSER snapshot
+        """
+        names = []
+        for action in _iter_actions(parser):
+            if action in self:
+                names.extend(action.option_strings or [action.args])
+        return names
+
+    def format_section(self, format_action, markup):
+        """
+        Return the lines of the COMMON OPTIONS section content, the actions
+        are formatted by FORMAT_ACTION(action), and the command names by
+        MARKUP(name)
+        """
+        lines = []
+        for set_index, (names, actions) in enumerate(self.sets):
+            if len(self.sets) > 1:
+                # tell the same-named options of different sets apart
+                if set_index:
+                    lines.append("")
+                lines.append(".SS " + ", ".join(map(markup, names)))
+            for index, action in enumerate(actions):
+                if index:
+                    lines.append("")
+                lines.extend(format_action(action))
+        return lines
@@ -14,20 +14,52 @@ except ImportError:
     _TZ_ARGS = []
 
 
-# Drop once Python 2.7 is dropped
-# pylint: disable=unused-import
-try:
-    from configparser import ConfigParser, NoSectionError
-except ImportError:
-    from ConfigParser import SafeConfigParser as ConfigParser, NoSectionError  # type: ignore
+# ConfigParser and NoSectionError are imported on first access (PEP 562), only
+# the 'setup.py install' command needs them.
+# pylint: disable=unused-import,import-outside-toplevel
+def _import_config_parser():
+    # Drop once Python 2.7 is dropped
+    try:
+        from configparser import ConfigParser, NoSectionError
+    except ImportError:
+        from ConfigParser import SafeConfigParser as ConfigParser, NoSectionError  # type: ignore
+    return {"ConfigParser": ConfigParser, "NoSectionError": NoSectionError}
+
+
+if sys.version_info < (3, 7):
+    globals().update(_import_config_parser())
+
+
+def __getattr__(name):
+    if name in ("ConfigParser", "NoSectionError"):
+        names = _import_config_parser()
+        globals().update(names)
+        return names[name]
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(
+        __name__, name))
+
 
 if sys.version_info < (3, 0):
     import imp  # pylint: disable=deprecated-module
-    def load_py_file(filename):
+    def load_py_file(filename, bytecode_cache=None):
         """ Small wrapper having the same call arg list as runpy.run_path() """
+        # pylint: disable=unused-argument
         return imp.load_source("argparse_manpage_loaded_file", filename)
 else:
-    from runpy import run_path as load_py_file
+    def load_py_file(filename, bytecode_cache=None):
+        """
+        Same as runpy.run_path(), but if the BYTECODE_CACHE directory is
+        specified, the compiled bytecode of the script is cached there (see
+        argparse_manpage.bytecode).  Directories and zip archives are left to
+        runpy.
+        """
+        if bytecode_cache:
+            import zipfile
+            if os.path.isfile(filename) and not zipfile.is_zipfile(filename):
+                from argparse_manpage.bytecode import run_path as run_cached
+                return run_cached(filename, bytecode_cache)
+        from runpy import run_path
+        return run_path(filename)
 
 def get_module_object(module_or_dict, objname, objtype):
     """
@@ -44,7 +76,7 @@ def get_module_object(module_or_dict, objname, objtype):
     return obj
 
 
-def load_file_as_module(filename):
+def load_file_as_module(filename, bytecode_cache=None):
     """
     Load a given python filename as a dict (runpy on Python 3) or as a module
     (imp module, Python 2).  Note that 'runpy.run_path()' doesn't work correctly
@@ -55,7 +87,42 @@ def load_file_as_module(filename):
     # We used to call 'runpy.run_path()' here, but that did not work correctly
     # with Python 2.7 where the imported object did not see it's own
     # globals/imported modules (including the 'argparse' module).
-    return load_py_file(filename)
+    return load_py_file(filename, bytecode_cache)
+
+
+def load_toml(filename):
+    """
+    Parse the given TOML file, return None if the file is not a valid TOML.
+    The TOML parser is imported on demand.
+    """
+    # pylint: disable=import-outside-toplevel
+    try:
+        import tomllib
+        from tomllib import TOMLDecodeError
+    except ImportError:
+        try:
+            import tomli as tomllib
+            from tomli import TOMLDecodeError
+        except ImportError:
+            import toml as tomllib
+            from toml import TomlDecodeError as TOMLDecodeError
+
+    try:
+        with open(filename, mode="r") as fp:
+            return tomllib.loads(fp.read())
+    except TOMLDecodeError:
+        return None
+
+
+def get_source_date_epoch(default=None):
+    """
+    Return the SOURCE_DATE_EPOCH environment variable value (int), or DEFAULT
+    if not specified.
+    """
+    value = os.environ.get('SOURCE_DATE_EPOCH')
+    if value is None:
+        return default
+    return int(value)
 
 
 def get_reproducible_date():
@@ -64,5 +131,5 @@ def get_reproducible_date():
     variable if specified.
     """
     return datetime.datetime.fromtimestamp(
-        int(os.environ.get('SOURCE_DATE_EPOCH', time.time())),
+        get_source_date_epoch(int(time.time())),
         *_TZ_ARGS).strftime('%Y-%m-%d')
@@ -0,0 +1,74 @@
+"""
+Fixed-width help formatters.
+
+The argparse HelpFormatter probes the terminal size (the COLUMNS variable,
+and the terminal ioctl) whenever it is created without an explicit width, so
+the wrapped help texts depend on the terminal the manual page is generated
+in.  The formatters here are created with a fixed width, and shared among
+all the (sub)parsers and pages with the same formatter class and prog.
+"""
+
+from argparse import ArgumentParser
+
+# The width argparse uses when the output is not a terminal (80 columns)
+DEFAULT_WIDTH = 78
+
+# The shared pools, by width
+_POOLS = {}
+
+
+class FormatterPool(object):
+    """
+    Fixed-WIDTH formatters.  The shared ones (see get()) are only used for the
+    stateless formatter methods, like _format_text(); format_usage() uses
+    a new formatter each time, as argparse does.
+    """
+    def __init__(self, width=DEFAULT_WIDTH):
+        self.width = width
+        self._formatters = {}
+
+    def new(self, formatter_class, prog):
+        """ Create a new FORMATTER_CLASS instance for PROG """
+        try:
+            formatter = formatter_class(prog=prog, width=self.width)
+        except TypeError:
+            # custom formatter class without the width argument
+            formatter = formatter_class(prog=prog)
+        if hasattr(formatter, "_set_color"):
+            # Python 3.14+, no ANSI colors in the manual page
+            formatter._set_color(False)
+        return formatter
+
+    def get(self, formatter_class, prog):
+        """ Return the shared FORMATTER_CLASS instance for PROG """
+        key = (formatter_class, prog)
+        formatter = self._formatters.get(key)
+        if formatter is None:
+            formatter = self._formatters[key] = self.new(formatter_class, prog)
+        return formatter
+
+    def get_for_parser(self, parser):
+        """ Return the shared formatter for the argparse PARSER """
+        return self.get(parser.formatter_class, parser.prog)
+
+    def format_usage(self, parser):
+        """ Same as PARSER.format_usage(), but with the fixed width """
+        if type(parser).format_usage is not ArgumentParser.format_usage:
+            # overridden, respect it
+            return parser.format_usage()
+        formatter = self.new(parser.formatter_class, parser.prog)
+        formatter.add_usage(parser.usage, parser._actions,
+                            parser._mutually_exclusive_groups)
+        return formatter.format_help()
+
+
+def get_formatter_pool(width=None):
+    """
+    Return the shared FormatterPool for WIDTH (DEFAULT_WIDTH if None)
+    """
+    if width is None:
+        width = DEFAULT_WIDTH
+    pool = _POOLS.get(width)
+    if pool is None:
+        pool = _POOLS[width] = FormatterPool(width)
+    return pool
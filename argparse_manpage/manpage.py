@@ -1,8 +1,17 @@
-from argparse import SUPPRESS, HelpFormatter, _SubParsersAction, _HelpAction
-from collections import OrderedDict
+from argparse import HelpFormatter, _HelpAction
+import copy
+import io
 import re
 
+from argparse_manpage.common_options import CommonOptions
 from argparse_manpage.compat import get_reproducible_date
+from argparse_manpage.formatters import get_formatter_pool
+from argparse_manpage.snapshot import (
+    GroupSnapshot,
+    ParserSnapshot,
+    SubparsersSnapshot,
+)
+from argparse_manpage.timings import count, get_timings, timed, timed_iter
 
 DEFAULT_GROUP_NAMES = {
     # We replace ArgumentGroup title (value) with alias (key).
@@ -42,8 +51,16 @@ MANPAGE_DATA_ATTRS = (
     "manual_title",
     "include",
     "manfile",
+    "synopsis",
+    "width",
+    "wrap",
+    "shared_options",
 )
 
+# How to document the options shared by several (sub)parsers, see
+# _ManpageFormatter
+SHARED_OPTIONS_METHODS = ("inline", "common")
+
 # manpage sections that are handled specially, so need special treatment
 # when --include'ing extra material; see Manpage.add_section.
 SPECIAL_MANPAGE_SECTIONS = (
@@ -139,25 +156,118 @@ def get_footer(data):
     return "\n".join(_get_footer_lines(data)) + "\n"
 
 
+class _IncludeMatcher(object):
+    """
+    Match the rendered manual page lines against the /regex/ blocks from the
+    --include file.  The patterns are compiled only once, and (the typically
+    failing) match attempts are done by a single combined regular expression
+    per line, so the cost doesn't grow with lines × patterns.
+    """
+    def __init__(self):
+        self._patterns = []
+        self._combined = None
+        self._separate = []
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def add(self, pattern, content):
+        """
+        Insert CONTENT after each line matching PATTERN
+        """
+        self._patterns.append((re.compile(pattern), content))
+        self._combined = None
+
+    def _compile(self):
+        # Patterns with groups (back-references would be re-numbered) or with
+        # global flags can not be safely merged, those are matched one by one.
+        plain_flags = re.compile("").flags
+        combined = []
+        self._separate = []
+        for regex, _ in self._patterns:
+            if regex.groups or regex.flags != plain_flags:
+                self._separate.append(regex)
+            else:
+                combined.append("(?:{0})".format(regex.pattern))
+        self._combined = re.compile("|".join(combined)) if combined else False
+
+    def matches(self, line):
+        """
+        Generate the contents of all the blocks matching the LINE, in the
+        order they were added.
+        """
+        if not self._patterns:
+            return
+        if self._combined is None:
+            self._compile()
+        if not (self._combined and self._combined.search(line)) \
+                and not any(regex.search(line) for regex in self._separate):
+            return
+        for regex, content in self._patterns:
+            if regex.search(line):
+                yield content
+
+
+class ActionCache(object):
+    """
+    The rendered action fragments (the '.TP' blocks), by the ActionSnapshot
+    identity.  The actions shared among sub-commands by
+    ArgumentParser(parents=[..]) are shared in the snapshot, too, so each of
+    them is rendered only once.  By default, the cache lasts for one Manpage,
+    but it can be shared by the pages rendered from the same snapshot (e.g.
+    the split pages, see iter_split_manpages()); the cached fragments of other
+    snapshots would never be hit.  The HITS is
+    the number of the duplicate actions that were not rendered again.
+    """
+    def __init__(self):
+        self.hits = 0
+        self._fragments = {}
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def get(self, action, render):
+        """
+        Return the fragment (list of lines) for ACTION, render it by
+        RENDER(ACTION) if not cached yet
+        """
+        entry = self._fragments.get(id(action))
+        if entry is not None:
+            self.hits += 1
+            count("duplicate actions")
+            return entry[1]
+        fragment = render(action)
+        # keep the action reference, so the id() isn't re-used
+        self._fragments[id(action)] = (action, fragment)
+        return fragment
+
+
 # This is already considered an API, and seems like a valid scenario:
 # https://github.com/pypa/pipx/blob/fd6650bcaeca3088/scripts/generate_man.py
 
 class Manpage(object):
     # pylint: disable=too-many-instance-attributes
-    def __init__(self, parser, _data=None, format='pretty'):
+    def __init__(self, parser, _data=None, format='pretty', action_cache=None):
         """
         Manual page abstraction.  Generates, with the help of formater, a manual
         page by __str__() method.  Please avoid using the private _data
         argument (see https://github.com/praiskup/argparse-manpage/issues/7),
         instead override the `self.<ATTRIBUTE>` when needed.
+
+        The PARSER is either an ArgumentParser, or its ParserSnapshot.  The
+        ACTION_CACHE (ActionCache) can be shared among several pages rendered
+        from the same snapshot.
         """
-        self.prog = parser.prog
+        snapshot = None
+        if isinstance(parser, ParserSnapshot):
+            snapshot = parser
+            parser = None
+
+        self.prog = (snapshot or parser).prog
         self.parser = parser
         self.format = format
         self._data = _data or {}
-        self._match_texts = []
-        if not getattr(parser, '_manpage', None):
-            self.parser._manpage = []
+        self._include_matcher = _IncludeMatcher()
 
         self.manfile = self._data.get("manfile")
         if self.manfile:
@@ -165,9 +275,29 @@ class Manpage(object):
                 raise ValueError("manfile set, so no other key is allowed")
             return
 
-        self.formatter = self.parser._get_formatter()
-        self.mf = _ManpageFormatter(self.prog, self.formatter, format=self.format)
-        self.synopsis = self.parser.format_usage().split(':', 1)[-1].split()
+        pool = get_formatter_pool(self._data.get("width"))
+        if parser:
+            self.formatter = pool.get_for_parser(parser)
+            snapshot = ParserSnapshot.from_parser(
+                parser, self.formatter,
+                synopsis=self._data.get("synopsis") or "argparse",
+                width=pool.width,
+                wrap=self._data.get("wrap") or "argparse")
+        else:
+            self.formatter = pool.get(HelpFormatter, self.prog)
+        self.snapshot = snapshot
+        # the --include'd sections must not leak into the (shared) snapshot
+        self._sections = [dict(section) for section in snapshot.sections]
+
+        shared_options = self._data.get("shared_options") or "inline"
+        if shared_options not in SHARED_OPTIONS_METHODS:
+            raise ValueError("Unknown shared options method: {0}".format(
+                shared_options))
+        self.mf = _ManpageFormatter(self.prog, self.formatter, format=self.format,
+                                    text_format=snapshot.text_format,
+                                    action_cache=action_cache,
+                                    common_options=shared_options == "common")
+        self.synopsis = snapshot.usage.split(':', 1)[-1].split()
 
         self.date = self._data.get("date")
         if not self.date:
@@ -199,89 +329,138 @@ class Manpage(object):
         # Wrap by parser formatter and convert to manpage format
         return self.mf.format_text(self.formatter._format_text(text)).strip('\n')
 
-    def __str__(self):
+    def iter_lines(self):
+        """
+        Generate the manual page line by line (lines are yielded without the
+        trailing newline, and some of them, e.g. --include'd sections, may
+        span multiple lines).  Nothing is accumulated in memory, so even
+        manual pages for huge parser trees are rendered in bounded memory.
+        """
         if self.manfile:
             with open(self.manfile) as fd:
-                return fd.read()
-
-        lines = []
+                for line in fd:
+                    yield line.rstrip("\n")
+            return
 
+        timings = get_timings() if len(self._include_matcher) else None
+        for line in self._iter_page_lines():
+            yield line
+            # Add --include sections that match text in the page
+            matches = self._include_matcher.matches(line)
+            if timings is not None:
+                matches = timed_iter("include matching", matches)
+            for content in matches:
+                yield content
+
+    def _iter_page_lines(self):
         # Header
         # per man (7) man-pages: .TH title section date source manual
         header = '.TH {title} "{section}" "{date}" "{source}" "{manual}"'
-        lines.append(header.format(
+        yield header.format(
             title=_markup(self.prog.upper()),
             section=self.section,
             date=_markup(self.date),
             source=_markup(self.source),
             manual=_markup(self.manual),
-        ))
+        )
 
         # Name
-        lines.append('.SH NAME')
+        yield '.SH NAME'
         line = self.prog
 
         description = None
-        if getattr(self.parser, 'man_short_description', None):
+        if self.snapshot.short_description:
             # Let's keep this undocumented.  There's a way to specify this in
             # setup.cfg: 'description'
-            description = self.parser.man_short_description
+            description = self.snapshot.short_description
         if self.description:
             description = self.description
         if description:
             line += " - " + description
-        lines.append(_markup(line))
+        yield _markup(line)
 
         # Synopsis
         synopsis_section = self.get_extra_section("synopsis")
         if self.synopsis or synopsis_section:
-            lines.append('.SH SYNOPSIS')
+            yield '.SH SYNOPSIS'
             if synopsis_section:
-                lines.append(synopsis_section["content"])
+                yield synopsis_section["content"]
+            elif self.snapshot.synopsis is not None:
+                for line in self.mf.format_synopsis(self.snapshot):
+                    yield line
             else:
-                lines.append('.B {}'.format(_markup(self.synopsis[0])))
-                lines.append(' '.join(self.synopsis[1:]))
+                yield '.B {}'.format(_markup(self.synopsis[0]))
+                yield ' '.join(self.synopsis[1:])
 
         extra_description = None
         description_section = self.get_extra_section("description")
         if description_section:
             extra_description = description_section["content"]
-        lines.extend(self.mf.format_parser(self.parser, extra_description=extra_description))
+        for line in self.mf.iter_parser(self.snapshot, extra_description=extra_description):
+            yield line
 
         comments_section = self.get_extra_section("comments")
-        if self.parser.epilog or comments_section:
-            lines.append("")
-            lines.append('.SH COMMENTS')
+        if self.snapshot.epilog or comments_section:
+            yield ""
+            yield '.SH COMMENTS'
             if comments_section:
-                lines.append(comments_section["content"])
+                yield comments_section["content"]
             else:
-                lines.append(self.format_text(self.parser.epilog))
+                # already wrapped by the parser formatter
+                yield self.mf.format_block(self.snapshot.epilog_text,
+                                           "description").strip('\n')
 
         # Additional sections
-        for section in self.parser._manpage: # pylint: disable=protected-access
+        for section in self._sections:
             if section["heading"] not in SPECIAL_MANPAGE_SECTIONS:
-                lines.append('.SH {}'.format(section['heading'].upper()))
-                lines.append(section['content'])
+                yield '.SH {}'.format(section['heading'].upper())
+                yield section['content']
 
-        lines.append("")
-        lines.extend(self.mf.format_footer(self._data))
+        yield ""
+        for line in self.mf.format_footer(self._data):
+            yield line
 
-        # Finally add --include sections that match text in the page
-        final_lines = []
-        for line in lines:
-            final_lines.append(line)
-            for match in self._match_texts:
-                if re.search(match['match_text'], line):
-                    final_lines.append(match['content'])
+    def write(self, stream):
+        """
+        Write the manual page into a (text) STREAM, line by line.  Leading and
+        trailing empty lines are dropped, and the output is terminated by
+        exactly one newline.
+        """
+        if self.manfile:
+            with open(self.manfile) as fd:
+                for line in fd:
+                    stream.write(line)
+            return
 
-        return "\n".join(final_lines).strip("\n") + "\n"
+        started = False
+        pending = ""
+        for line in timed_iter("render", self.iter_lines()):
+            chunk = pending + line
+            if started:
+                chunk = "\n" + chunk
+            else:
+                chunk = chunk.lstrip("\n")
+                if not chunk:
+                    continue
+                started = True
+            # Postpone the trailing newlines, we don't know yet if they
+            # terminate the page.
+            text = chunk.rstrip("\n")
+            pending = chunk[len(text):]
+            stream.write(text)
+        stream.write("\n")
+
+    def __str__(self):
+        stream = io.StringIO()
+        self.write(stream)
+        return stream.getvalue()
 
     def get_extra_section(self, heading):
         """
         Return supplementary section for the `Manpage` (created with
         `--include`), or `None`
         """
-        for section in self.parser._manpage: # pylint: disable=protected-access
+        for section in self._sections:
             if section["heading"] == heading:
                 return section
         return None
@@ -300,7 +479,7 @@ class Manpage(object):
         section = self.get_extra_section(heading)
         if section is None:
             section = {"heading": heading, "content": ""}
-            self.parser._manpage.append(section) # pylint: disable=protected-access
+            self._sections.append(section)
         if position == '<':
             section["content"] = content + section["content"]
         elif position == '=':
@@ -329,7 +508,7 @@ class Manpage(object):
                 if m:
                     match_text = m.group(1)
                     i, section_lines = get_section(lines, i + 1)
-                    self._match_texts.append({"match_text": match_text, "content": "".join(section_lines).strip()})
+                    self._include_matcher.add(match_text, "".join(section_lines).strip())
                 else:
                     m = re.match(r"\[([<=>])?([^\]]+)\]$", lines[i])
                     if m:
@@ -343,6 +522,89 @@ class Manpage(object):
                         raise ValueError("Invalid or missing section header in include file %s:\n%s" % (file, lines[i]))
 
 
+def _split_parser(parser, short_description=None):
+    """
+    Return a copy of the PARSER snapshot without the sub-command parsers,
+    only the list of the sub-commands is kept
+    """
+    groups = []
+    for group in parser.groups:
+        if group.subparsers is not None:
+            group = GroupSnapshot(group.title, group.description, [],
+                                  SubparsersSnapshot(group.subparsers.choices,
+                                                     []))
+        groups.append(group)
+    split = copy.copy(parser)
+    split.groups = groups
+    split.short_description = parser.short_description or short_description
+    return split
+
+
+def _iter_split_parsers(parser, names, help=None):
+    # pylint: disable=redefined-builtin
+    commands = []
+    for group in parser.groups:
+        if group.subparsers is not None:
+            commands.extend(group.subparsers.commands)
+    yield names, _split_parser(parser, help), [names + [command.name]
+                                              for command in commands]
+    for command in commands:
+        for item in _iter_split_parsers(command.parser,
+                                        names + [command.name], command.help):
+            yield item
+
+
+def iter_split_manpages(parser, _data=None, format='pretty', name=None,
+                        action_cache=None):
+    """
+    Split the manual page of the PARSER (ArgumentParser or ParserSnapshot)
+    git-style, into one page per (sub-)command.  The top-level page (named
+    NAME, by default the parser's prog) only lists the commands, each command
+    is documented by its own 'NAME-command' page, its sub-commands by the
+    'NAME-command-subcommand' pages, and so on.  The pages refer to the
+    parent and sub-command pages in the SEE ALSO section.  Generate the
+    (page name, Manpage) pairs, the top-level page first.  The pages share
+    the ACTION_CACHE (ActionCache), by default a new one.
+    """
+    # pylint: disable=too-many-locals
+    data = _data or {}
+    if action_cache is None:
+        action_cache = ActionCache()
+    if not isinstance(parser, ParserSnapshot):
+        parser = ParserSnapshot.from_parser(
+            parser, width=data.get("width"),
+            synopsis=data.get("synopsis") or "argparse",
+            wrap=data.get("wrap") or "argparse")
+    section = data.get("manual_section") or 1
+    name = name or parser.prog
+    for names, snapshot, children in _iter_split_parsers(parser, [name]):
+        page_data = dict(data)
+        if len(names) > 1:
+            # the project description and the --include'd sections belong
+            # to the top-level page
+            for attr in ("description", "include"):
+                page_data.pop(attr, None)
+            if not page_data.get("project_name"):
+                page_data["project_name"] = name
+        manpage = Manpage(snapshot, _data=page_data, format=format,
+                          action_cache=action_cache)
+        manpage.prog = "-".join(names)
+
+        related = ["-".join(names[:-1])] if len(names) > 1 else []
+        related.extend("-".join(child) for child in children)
+        if related:
+            links = []
+            for index, page in enumerate(related):
+                comma = "," if index < len(related) - 1 else ""
+                links.append(".BR {0} ({1}){2}".format(_markup(page), section,
+                                                      comma))
+            content = "\n".join(links)
+            if manpage.get_extra_section("see also"):
+                content = "\n" + content
+            manpage.add_section("see also", ">", content)
+        yield manpage.prog, manpage
+
+
 def underline(text):
     """
     Wrap text with \fI for underlined text
@@ -361,12 +623,29 @@ def quoted(text):
 
 
 class _ManpageFormatter(HelpFormatter):
-    def __init__(self, prog, old_formatter, format):
+    """
+    Format the parser (snapshot) tree into the manual page lines.  With
+    COMMON_OPTIONS set, the options shared by several (sub)parsers (e.g.
+    through ArgumentParser(parents=[..])) are documented only once, in the
+    COMMON OPTIONS section, and each (sub)parser just lists them (see
+    argparse_manpage.common_options).
+    """
+    def __init__(self, prog, old_formatter, format, text_format=None,
+                 action_cache=None, common_options=False):
+        # pylint: disable=too-many-arguments
         super(HelpFormatter, self).__init__()
         self._prog = prog
         self.of = old_formatter
         assert format in ("pretty", "single-commands-section")
         self.format = format
+        # see ParserSnapshot
+        self.text_format = text_format
+        if action_cache is None:
+            action_cache = ActionCache()
+        self.action_cache = action_cache
+        self.common_options = common_options
+        # the shared actions of the formatted tree
+        self._common = CommonOptions()
 
     @staticmethod
     def _get_aliases_str(aliases):
@@ -376,24 +655,21 @@ class _ManpageFormatter(HelpFormatter):
 
     def _format_action_invocation(self, action):
         if not action.option_strings:
-            metavar, = self._metavar_formatter(action, action.dest)(1)
-            return bold(metavar)
+            return bold(action.args)
 
         parts = []
 
         # if the Optional doesn't take a value, format is:
         #    -s, --long
-        if action.nargs == 0:
+        if action.args is None:
             parts.extend(map(bold, action.option_strings))
 
         # if the Optional takes a value, format is:
         #    -s ARGS, --long ARGS
         else:
-            default = action.dest.upper()
-            args_string = self._format_args(action, default)
             for option_string in action.option_strings:
                 parts.append('{} {}'.format(bold(option_string),
-                                            underline(args_string)))
+                                            underline(action.args)))
         return ', '.join(parts)
 
     def _format_parser(self, parser, subcommand=None, aliases=None, help=None, extra_description=None):
@@ -404,11 +680,13 @@ class _ManpageFormatter(HelpFormatter):
         # Action -> Option
         # Action -> Subparsers
         # Subparser -> [Parser, Parser, ..] So called "choices".
+        #
+        # This is a generator, the lines are yielded while walking the tree
+        # (the ParserSnapshot of the tree).
 
-        lines = []
         if subcommand:
             if self.format == "pretty":
-                lines.append("")
+                yield ""
                 # start a new section for each command
                 first_line = ".SH COMMAND"
                 first_line += " " + underline(quoted(subcommand))
@@ -416,7 +694,7 @@ class _ManpageFormatter(HelpFormatter):
                 # do not start a new section, start subsection of COMMANDS instead
                 first_line = ".SS"
                 first_line += " " + bold(subcommand + self._get_aliases_str(aliases))
-            lines.append(first_line)
+            yield first_line
 
             if help:
                 if self.format == "pretty":
@@ -424,41 +702,103 @@ class _ManpageFormatter(HelpFormatter):
                     pass
                 elif self.format == "single-commands-section":
                     # print help
-                    lines.append(help)
-                    lines.append("")
+                    yield help
+                    yield ""
 
-            lines.append(self.format_text(parser.format_usage()))
+            if parser.synopsis is not None:
+                for line in self.format_synopsis(parser):
+                    yield line
+            else:
+                yield self.format_text(parser.usage)
 
         if parser.description or extra_description:
             if subcommand:
-                lines.append("")
+                yield ""
             else:
-                lines.append(".SH DESCRIPTION")
+                yield ".SH DESCRIPTION"
 
             if extra_description:
-                lines.append(extra_description)
+                yield extra_description
             if parser.description:
-                lines.append(self.format_text(parser.description))
+                yield self.format_block(parser.description, "description")
 
+        # the reference to COMMON OPTIONS (and the section itself) goes
+        # before the sub-commands
+        common_lines = self._format_common_reference(parser, subcommand)
         is_subsequent_ag = True
-        for group in parser._action_groups:
-            ag_lines = self._format_action_group(group, subcommand)
-            if not ag_lines:
+        for group in parser.groups:
+            if group.subparsers is not None and common_lines:
+                for line in common_lines:
+                    yield line
+                common_lines = []
+            ag_lines = iter(self._format_action_group(group, subcommand))
+            first_line = next(ag_lines, None)
+            if first_line is None:
                 continue
             if is_subsequent_ag:
-                lines.append("")
-            lines.extend(ag_lines)
+                yield ""
+            yield first_line
+            for line in ag_lines:
+                yield line
             is_subsequent_ag = True
-
-        return lines
+        for line in common_lines:
+            yield line
 
     def format_parser(self, parser, extra_description=None):
         """
-        Return lines Groff formatted text for given parser
+        Return lines Groff formatted text for given parser (ArgumentParser or
+        ParserSnapshot)
+        """
+        return list(self.iter_parser(parser, extra_description=extra_description))
+
+    def iter_parser(self, parser, extra_description=None):
+        """
+        Same as format_parser(), but generate the lines one by one
         """
+        if not isinstance(parser, ParserSnapshot):
+            parser = ParserSnapshot.from_parser(parser, self.of, prog=self._prog)
+        self.text_format = parser.text_format
+        self._common = CommonOptions()
+        if self.common_options:
+            self._common = CommonOptions(parser, self._prog)
         return self._format_parser(parser, extra_description=extra_description)
 
+    def _format_common_reference(self, parser, subcommand=None):
+        """
+        Return the lines listing the common options of the PARSER, followed
+        by the COMMON OPTIONS section for the top-level parser
+        """
+        if not self._common:
+            return []
+        names = [bold(name) for name in self._common.names(parser)]
+        lines = []
+        if names:
+            line = "Common options: {0} (see {1}).".format(
+                ", ".join(names), bold("COMMON OPTIONS"))
+            if subcommand and self.format == "single-commands-section":
+                lines.extend([".RS 7", line, ".RE", ""])
+            else:
+                lines.extend(["", ".PP", line])
+        if not subcommand:
+            lines.extend(["", ".SH COMMON OPTIONS"])
+            lines.extend(self._common.format_section(self._format_action, bold))
+        return lines
+
+    @staticmethod
+    def format_synopsis(parser):
+        """
+        Generate lines of the natively built synopsis of the PARSER snapshot,
+        one usage element per line
+        """
+        yield ".B " + _markup(parser.prog)
+        fonts = {"B": bold, "I": underline, "": _markup}
+        for element in parser.synopsis:
+            yield "".join(fonts[font](text) for text, font in element)
+
     def _format_action(self, action):
+        return self.action_cache.get(action, self._render_action)
+
+    def _render_action(self, action):
         parts = []
         parts.append('.TP')
 
@@ -466,79 +806,54 @@ class _ManpageFormatter(HelpFormatter):
         parts.append(action_header)
 
         # if there was help for the action, add lines of help text
-        if action.help:
-            help_text = self.of._format_text(self._expand_help(action)).strip('\n')
-            parts.append(self.format_text(help_text))
+        if action.help is not None:
+            parts.append(self.format_block(action.help_text, "help"))
 
         return parts
 
-    def _format_ag_subcommands(self, actions, prog):
+    def _format_ag_subcommands(self, choices, prog):
         lines = []
 
-        for action in actions:
-            if getattr(action, 'help', None) == SUPPRESS:
-                continue
+        for name, help in choices:
             lines.append('.TP')
-            lines.append(bold(prog) + ' ' + underline(action.dest))
-            if hasattr(action, 'help'):
-                lines.append(self.format_text(action.help))
+            lines.append(bold(prog) + ' ' + underline(name))
+            lines.append(self.format_text(help))
 
         return '\n'.join(lines)
 
-    def _format_subparsers(self, action_group, action, subcommand=None):
-        lines = []
-
+    def _format_subparsers(self, action_group, subparsers, subcommand=None):
         if subcommand:
             if self.format == "pretty":
                 # start a new section for each command
-                lines.append('.SH')
+                yield '.SH'
                 title = action_group.title.upper()
                 title += " " + underline(quoted(subcommand))
-                lines.append(title)
+                yield title
             elif self.format == "single-commands-section":
                 # do not start a new section, append subsections to the COMMANDS section
                 pass
         else:
             # start a new section on top-level
-            lines.append('.SH')
+            yield '.SH'
             title = action_group.title.upper()
-            lines.append(title)
-
-        if self.format == "pretty":
-            # print list of subcommands
-            lines.append(self._format_ag_subcommands(action._choices_actions,
-                         subcommand or self._prog))
+            yield title
+
+        if self.format == "pretty" or (subparsers.choices
+                                       and not subparsers.commands):
+            # print list of subcommands (documented on separate pages, if
+            # there are no commands, see iter_split_manpages())
+            yield self._format_ag_subcommands(subparsers.choices,
+                                              subcommand or self._prog)
         elif self.format == "single-commands-section":
             # skip printing list of subcommands
             pass
 
-        # gather (sub-)command aliases
-        command_aliases = {}
-        command_aliases_names = set()
-        for name, command in action._name_parser_map.items():
-            if command not in command_aliases:
-                command_aliases[command] = []
-            else:
-                command_aliases[command].append(name)
-                command_aliases_names.add(name)
-
-        command_help = {}
-        for i in action._choices_actions:
-            command_help[i.dest] = i.help
-
-        for name, choice in action.choices.items():
-            if name in command_aliases_names:
-                # don't print aliased commands multiple times
-                continue
-            new_subcommand = "{} {}".format(subcommand or self._prog, name)
-            aliases = command_aliases[choice]
-            help = command_help.get(name, None)
-            if help == SUPPRESS:
-                # don't print hidden commands
-                continue
-            lines.extend(self._format_parser(choice, new_subcommand, aliases, help))
-
-        return lines
+        for command in subparsers.commands:
+            new_subcommand = "{} {}".format(subcommand or self._prog, command.name)
+            lines = self._format_parser(command.parser, new_subcommand,
+                                        command.aliases, command.help)
+            for line in timed_iter(new_subcommand, lines, "subcommands"):
+                yield line
 
     def _format_action_group(self, action_group, subcommand=None):
         # Parser consists of these action_groups:
@@ -549,20 +864,23 @@ class _ManpageFormatter(HelpFormatter):
         # - ...
         # - subparsers
 
-        content = []
-        some_action = False
-        for action in action_group._group_actions:
-            if action.help == SUPPRESS:
-                continue
+        if action_group.subparsers is not None:
+            return self._format_subparsers(action_group,
+                                           action_group.subparsers,
+                                           subcommand)
 
-            if isinstance(action, _SubParsersAction):
-                return self._format_subparsers(action_group, action,
-                                               subcommand)
+        with timed("action groups"):
+            return self._format_actions(action_group, subcommand)
 
-            if '--help' in action.option_strings:
-                # TODO: put out some man page comment ..
+    def _format_actions(self, action_group, subcommand=None):
+        # Note that the suppressed actions, and the --help action (TODO: put
+        # out some man page comment ..) are not in the snapshot.
+        content = []
+        some_action = False
+        for action in action_group.actions:
+            if action in self._common:
+                # see _format_common_reference()
                 continue
-
             if some_action:
                 # Separate actions
                 content.append("")
@@ -601,7 +919,8 @@ class _ManpageFormatter(HelpFormatter):
 
         description = []
         if action_group.description:
-            description.append(self.format_text(action_group.description))
+            description.append(self.format_block(action_group.description,
+                                                 "description"))
             description.append("")
 
         if subcommand:
@@ -622,6 +941,22 @@ class _ManpageFormatter(HelpFormatter):
         """
         return _markup(text.strip('\n'))
 
+    def format_block(self, text, kind):
+        """
+        Same as format_text(), but the pre-formatted TEXT (of KIND, see
+        ParserSnapshot.text_format) is kept in a no-fill (.nf) block
+        """
+        if self.text_format is None or self.text_format[kind] != "raw":
+            return self.format_text(text)
+        lines = [".nf"]
+        for line in self.format_text(text).split("\n"):
+            if line.startswith((".", "'")):
+                # not a request
+                line = "\\&" + line
+            lines.append(line)
+        lines.append(".fi")
+        return "\n".join(lines)
+
     @staticmethod
     def format_footer(data):
         """
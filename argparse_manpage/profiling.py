@@ -0,0 +1,129 @@
+"""
+Profiling of the manual page generation (--profile-output, --memory-profile).
+
+The cpu_profile() context runs the code under cProfile, and saves the
+statistics into a file readable by the 'pstats' module (or by tools like
+snakeviz).  Within the memory_profile() context, the tracemalloc snapshots
+are taken before and after the instrumented stages (see memory_stage()), and
+the top allocation sites of each stage are reported.
+
+The instrumented code (memory_stage()) is always imported, so cProfile and
+tracemalloc are only imported once the profiling is enabled.
+"""
+
+# pylint: disable=import-outside-toplevel
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Number of the allocation sites reported per stage by default
+DEFAULT_MEMORY_LIMIT = 10
+
+# The collecting MemoryProfile, see memory_profile()
+_MEMORY_PROFILE = None
+
+
+@contextmanager
+def cpu_profile(filename):
+    """
+    Profile the code within the context by cProfile, and save the statistics
+    into FILENAME (.pstats)
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(filename)
+
+
+def _format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024 or unit == "MiB":
+            break
+        size /= 1024.0
+    if unit == "B":
+        return "{0} {1}".format(size, unit)
+    return "{0:.1f} {1}".format(size, unit)
+
+
+class MemoryProfile(object):
+    """
+    The memory allocated in the stages, each stage keeps the list of the
+    tracemalloc.StatisticDiff objects
+    """
+    def __init__(self, limit=DEFAULT_MEMORY_LIMIT):
+        self.limit = limit
+        self.stages = OrderedDict()
+        # the peak of the traced memory, set by memory_profile()
+        self.peak = None
+
+    @contextmanager
+    def measure(self, name):
+        """ Compare the tracemalloc snapshots before and after the context """
+        import tracemalloc
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            # ignore the snapshots themselves
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            diff = after.filter_traces(filters).compare_to(
+                before.filter_traces(filters), "lineno")
+            self.stages.setdefault(name, []).extend(diff)
+
+    def format(self):
+        """ Return the text report of the top allocation sites per stage """
+        lines = []
+        for name, stats in self.stages.items():
+            stats = sorted(stats, key=lambda stat: stat.size_diff,
+                           reverse=True)
+            total = sum(stat.size_diff for stat in stats)
+            lines.append("{0}: {1} allocated".format(name, _format_size(total)))
+            for stat in stats[:self.limit]:
+                frame = stat.traceback[0]
+                lines.append("  {0:>10}  {1:>8} blocks  {2}:{3}".format(
+                    _format_size(stat.size_diff), stat.count_diff,
+                    frame.filename, frame.lineno))
+        if self.peak is not None:
+            lines.append("peak: " + _format_size(self.peak))
+        return "".join(line + "\n" for line in lines)
+
+
+@contextmanager
+def memory_profile(limit=DEFAULT_MEMORY_LIMIT):
+    """
+    Trace the memory allocations within the context, and collect the
+    memory_stage() measurements into the returned MemoryProfile
+    """
+    # pylint: disable=global-statement
+    global _MEMORY_PROFILE
+    import tracemalloc
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    previous = _MEMORY_PROFILE
+    profile = _MEMORY_PROFILE = MemoryProfile(limit)
+    try:
+        yield profile
+    finally:
+        _MEMORY_PROFILE = previous
+        profile.peak = tracemalloc.get_traced_memory()[1]
+        if started:
+            tracemalloc.stop()
+
+
+@contextmanager
+def memory_stage(name):
+    """
+    Measure the memory allocated within the context as the NAME stage, if
+    the memory_profile() is active
+    """
+    if _MEMORY_PROFILE is None:
+        yield
+        return
+    with _MEMORY_PROFILE.measure(name):
+        yield
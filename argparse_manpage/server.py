@@ -0,0 +1,204 @@
+"""
+Warm render daemon (argparse-manpage --serve SOCKET), and its client.
+
+The server listens on a UNIX socket, and keeps the loaded parser snapshots in
+memory.  A target is re-imported only when some of its source files change.
+The protocol is JSON lines; each request is a JSON object with the target
+specification ('module' or 'pyfile', 'function' or 'object', and optionally
+'format', 'extract' and 'stub_imports'), the MANPAGE_DATA_ATTRS overrides,
+'date', and the client's working directory 'cwd'.  Each response is a JSON
+object, either {"status": "ok", "manpage": "...", "inputs": [...]}, or
+{"status": "error", "error": "..."}.
+"""
+
+import json
+import os
+import socket
+import socketserver
+
+from argparse_manpage.cache import SnapshotCache
+from argparse_manpage.manpage import MANPAGE_DATA_ATTRS, Manpage
+from argparse_manpage.stamps import source_changed, source_stamp
+from argparse_manpage.tooling import (
+    get_page_inputs,
+    get_parser_snapshot,
+    unload_changed_modules,
+)
+
+# Request items besides MANPAGE_DATA_ATTRS
+REQUEST_ATTRS = ("module", "pyfile", "function", "object", "extract",
+                 "stub_imports", "date", "cwd")
+
+
+class WarmCache(object):
+    """
+    In-memory alternative to SnapshotCache.  When some of the entry source
+    files change, the modules are unloaded (see unload_changed_modules()), so
+    they are re-imported when the parser is loaded again.
+    """
+    get_key = staticmethod(SnapshotCache.get_key)
+    # nothing is stored on disk (e.g. the bytecode), see get_parser_snapshot()
+    directory = None
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        """ Return the (snapshot, sources) pair, or None """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        snapshot, stamps = entry
+        changed = [stamp[0] for stamp in stamps if source_changed(stamp)]
+        if not changed:
+            return snapshot, [stamp[0] for stamp in stamps]
+
+        del self.entries[key]
+        unload_changed_modules([stamp[0] for stamp in stamps], changed)
+        return None
+
+    def put(self, key, snapshot, sources):
+        """ Store the SNAPSHOT loaded from SOURCES """
+        self.entries[key] = (snapshot, [source_stamp(source)
+                                        for source in sources])
+
+
+def render(request, cache):
+    """
+    Render the manual page according to the REQUEST (dict), loading the
+    parser through CACHE.  Return the {"manpage": ..., "inputs": ...} dict.
+    The relative paths are relative to the current working directory.
+    """
+    unknown = set(request) - set(REQUEST_ATTRS) - set(MANPAGE_DATA_ATTRS)
+    if unknown:
+        raise ValueError("unknown request items: {0}".format(
+            ", ".join(sorted(unknown))))
+
+    import_type = "module" if request.get("module") else "pyfile"
+    objtype = "function" if request.get("function") else "object"
+    if not request.get(import_type) or not request.get(objtype):
+        raise ValueError("module/pyfile and function/object are required")
+
+    data = dict((attr, request.get(attr)) for attr in MANPAGE_DATA_ATTRS)
+    data["date"] = request.get("date")
+    if data.get("manfile"):
+        # pre-written manual page, the parser is not loaded at all
+        with open(data["manfile"]) as fd:
+            return {
+                "manpage": fd.read(),
+                "inputs": get_page_inputs(data, []),
+            }
+
+    parser, sources = get_parser_snapshot(
+        import_type, request[import_type], request[objtype], objtype,
+        prog=data["prog"], cache=cache,
+        extract=request.get("extract") or "import",
+        synopsis=data["synopsis"] or "argparse",
+        width=data["width"],
+        wrap=data["wrap"] or "argparse",
+        stub_imports=request.get("stub_imports"))
+    manpage = Manpage(parser, format=data["format"] or "pretty", _data=data)
+    return {
+        "manpage": str(manpage),
+        "inputs": get_page_inputs(data, sources),
+    }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.process(line)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class RenderServer(socketserver.UnixStreamServer):
+    """
+    The requests are processed serially, loading the parsers modifies the
+    global interpreter state (sys.modules, sys.argv, working directory).
+    Anyone who can connect the socket can make the server run arbitrary
+    Python code, so the socket is only accessible by its owner.
+    """
+    def __init__(self, path):
+        self.cache = WarmCache()
+        socketserver.UnixStreamServer.__init__(self, path, _RequestHandler)
+
+    def server_bind(self):
+        # Create the socket file with 0600 permissions right away, chmod()
+        # after bind() would leave a window for the other users.
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+
+    def process(self, line):
+        """ Process one JSON request LINE, return the response dict """
+        cwd = os.getcwd()
+        try:
+            request = json.loads(line.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            if request.get("cwd"):
+                os.chdir(request["cwd"])
+            response = render(request, self.cache)
+            response["status"] = "ok"
+        except Exception as err:  # pylint: disable=broad-except
+            response = {
+                "status": "error",
+                "error": "{0}: {1}".format(type(err).__name__, err),
+            }
+        finally:
+            os.chdir(cwd)
+        return response
+
+
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except (OSError, IOError):
+        # nobody listens there
+        os.unlink(path)
+        return
+    finally:
+        client.close()
+    raise RuntimeError("{0} is used by a running server".format(path))
+
+
+def serve(path):
+    """
+    Serve the render requests on the PATH UNIX socket, until interrupted
+    """
+    _remove_stale_socket(path)
+    server = RenderServer(path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def request_render(path, request):
+    """
+    Send the REQUEST (dict) to the server listening on the PATH socket, and
+    return the response dict.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        with client.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode("utf-8") + b"\n")
+            stream.flush()
+            line = stream.readline()
+    finally:
+        client.close()
+    if not line:
+        raise RuntimeError("no response from {0}".format(path))
+    return json.loads(line.decode("utf-8"))
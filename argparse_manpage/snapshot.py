@@ -0,0 +1,362 @@
+"""
+Compact snapshot of the ArgumentParser tree.
+
+The manual page is rendered from these objects, not from the live argparse
+parser.  The snapshot is built by walking the (partly private) argparse
+structures only once, and all the usage and help strings are pre-computed in
+the process.  The snapshot only consists of plain Python types, so it can be
+e.g. pickled.
+"""
+
+import re
+from argparse import SUPPRESS, HelpFormatter, _SubParsersAction
+
+from argparse_manpage.formatters import get_formatter_pool
+from argparse_manpage.timings import timed
+
+# Methods of building the usage synopsis, see ParserSnapshot.from_parser()
+SYNOPSIS_METHODS = ("argparse", "native")
+
+# Methods of wrapping the help texts, see ParserSnapshot.from_parser()
+WRAP_METHODS = ("argparse", "none")
+
+_WHITESPACE = re.compile(r'\s+', re.ASCII)
+
+
+class _ActionFormatter(HelpFormatter):
+    """
+    Only the HelpFormatter methods that don't depend on the terminal width
+    are used, so the HelpFormatter.__init__() method is intentionally skipped.
+    """
+    # pylint: disable=super-init-not-called,bad-super-call
+    def __init__(self, prog):
+        super(HelpFormatter, self).__init__()
+        self._prog = prog
+
+
+class ActionSnapshot(object):
+    """
+    Positional or optional argument.  The ARGS is the formatted argument
+    metavar (None if the option doesn't take any value), HELP is the help
+    string with the %(...)s placeholders expanded, and HELP_TEXT is the same
+    help, wrapped by the parser's formatter.
+    """
+    __slots__ = ("option_strings", "dest", "args", "help", "help_text")
+
+    def __init__(self, option_strings, dest, args, help, help_text):
+        # pylint: disable=redefined-builtin
+        self.option_strings = option_strings
+        self.dest = dest
+        self.args = args
+        self.help = help
+        self.help_text = help_text
+
+
+class GroupSnapshot(object):
+    """
+    Argument group.  Either it contains a list of ACTIONS, or it is
+    a group of SUBPARSERS (SubparsersSnapshot), and the ACTIONS are empty.
+    """
+    __slots__ = ("title", "description", "actions", "subparsers")
+
+    def __init__(self, title, description, actions, subparsers=None):
+        self.title = title
+        self.description = description
+        self.actions = actions
+        self.subparsers = subparsers
+
+
+class SubparsersSnapshot(object):
+    """
+    The subparsers action.  CHOICES is the list of (name, help) pairs
+    documented in the list of commands, COMMANDS is the list of
+    CommandSnapshot objects.
+    """
+    __slots__ = ("choices", "commands")
+
+    def __init__(self, choices, commands):
+        self.choices = choices
+        self.commands = commands
+
+
+class CommandSnapshot(object):
+    """
+    One sub-command (with its ALIASES) and its PARSER (ParserSnapshot).
+    """
+    __slots__ = ("name", "aliases", "help", "parser")
+
+    def __init__(self, name, aliases, help, parser):
+        # pylint: disable=redefined-builtin
+        self.name = name
+        self.aliases = aliases
+        self.help = help
+        self.parser = parser
+
+
+class ParserSnapshot(object):
+    """
+    The (sub)parser.  Use ParserSnapshot.from_parser() to create one.  The
+    SYNOPSIS is the natively built usage; a list of the usage elements (e.g.
+    '[--option VALUE]'), each a list of (text, font) pairs, where font is 'B'
+    (bold), 'I' (italic) or '' (regular).  It is None if the USAGE was
+    formatted by argparse.
+
+    The TEXT_FORMAT is None if the help texts (and epilog) were wrapped by the
+    parser's formatter.  Otherwise, the texts were not wrapped, and it is
+    a {"description": ..., "help": ...} dict; 'raw' if the description (and
+    epilog) or the argument help texts are pre-formatted (e.g. by
+    RawTextHelpFormatter), or 'fill' if their whitespace was just normalized.
+    """
+    __slots__ = ("prog", "usage", "description", "epilog", "epilog_text",
+                 "groups", "sections", "short_description", "synopsis",
+                 "text_format")
+
+    def __init__(self, prog, usage, description, groups, epilog=None,
+                 epilog_text=None, sections=None, short_description=None,
+                 synopsis=None, text_format=None):
+        # pylint: disable=too-many-arguments
+        self.prog = prog
+        self.usage = usage
+        self.synopsis = synopsis
+        self.text_format = text_format
+        self.description = description
+        self.groups = groups
+        self.epilog = epilog
+        self.epilog_text = epilog_text
+        self.sections = sections or []
+        self.short_description = short_description
+
+    @classmethod
+    def from_parser(cls, parser, formatter=None, prog=None,
+                    synopsis="argparse", width=None, wrap="argparse"):
+        """
+        Walk the argparse.ArgumentParser PARSER and return its snapshot.  The
+        help texts are wrapped by FORMATTER (by default the PARSER's
+        formatter class), the %(prog)s placeholders in help strings are
+        expanded to PROG (by default the PARSER's prog).  With SYNOPSIS set to
+        'native', the usage synopsis is built directly from the parser
+        actions, instead of the (slow, for large parsers) argparse usage
+        formatting; except for parsers with custom usage.  The texts are
+        wrapped to WIDTH columns (see argparse_manpage.formatters), not to
+        the terminal width.  With WRAP set to 'none', the help texts are not
+        wrapped at all, groff fills the paragraphs itself (see TEXT_FORMAT).
+        """
+        pool = get_formatter_pool(width)
+        if formatter is None:
+            formatter = pool.get_for_parser(parser)
+        if synopsis not in SYNOPSIS_METHODS:
+            raise ValueError("Unknown synopsis method: {0}".format(synopsis))
+        if wrap not in WRAP_METHODS:
+            raise ValueError("Unknown wrap method: {0}".format(wrap))
+        builder = _SnapshotBuilder(formatter, prog or parser.prog, pool,
+                                   native_synopsis=synopsis == "native",
+                                   wrap=wrap == "argparse")
+        with timed("snapshot"):
+            return builder.parser(parser)
+
+
+class _SnapshotBuilder(object):
+    def __init__(self, formatter, prog, pool, native_synopsis=False,
+                 wrap=True):
+        # pylint: disable=too-many-arguments
+        self.formatter = formatter
+        self.action_formatter = _ActionFormatter(prog)
+        self.pool = pool
+        self.native_synopsis = native_synopsis
+        self.text_format = None
+        if not wrap:
+            # Raw*HelpFormatter keep the line breaks, so do we
+            formatter_class = type(formatter)
+            self.text_format = {
+                "description": "raw" if formatter_class._fill_text
+                               is not HelpFormatter._fill_text else "fill",
+                "help": "raw" if formatter_class._split_lines
+                        is not HelpFormatter._split_lines else "fill",
+            }
+        # Actions are shared among parsers with ArgumentParser(parents=[..]),
+        # keep them shared in the snapshot, too.  Keep the action reference
+        # so the id() isn't re-used.
+        self.actions = {}
+
+    def text(self, text, kind):
+        """
+        Format the TEXT; wrap it by the parser's formatter, or (see
+        TEXT_FORMAT) normalize its whitespace like the formatter would, or
+        keep it as is for the 'raw' KIND of texts.
+        """
+        if self.text_format is None:
+            return self.formatter._format_text(text)
+        if '%(prog)' in text:
+            text = text % dict(prog=self.formatter._prog)
+        if self.text_format[kind] == "raw":
+            return text.strip('\n')
+        return _WHITESPACE.sub(' ', text).strip()
+
+    def parser(self, parser):
+        """ Snapshot ArgumentParser """
+        epilog_text = None
+        if parser.epilog:
+            epilog_text = self.text(parser.epilog, "description")
+        synopsis = None
+        if self.native_synopsis and parser.usage is None:
+            with timed("synopsis"):
+                synopsis = self.synopsis(parser)
+            usage = "usage: {0}\n".format(" ".join(
+                [parser.prog] + ["".join(text for text, _ in element)
+                                 for element in synopsis]))
+        else:
+            with timed("usage"):
+                usage = self.pool.format_usage(parser)
+        return ParserSnapshot(
+            prog=parser.prog,
+            usage=usage,
+            synopsis=synopsis,
+            text_format=self.text_format,
+            description=parser.description,
+            groups=[self.group(group) for group in parser._action_groups],
+            epilog=parser.epilog,
+            epilog_text=epilog_text,
+            sections=[dict(section) for section in
+                      getattr(parser, "_manpage", None) or []],
+            short_description=getattr(parser, "man_short_description", None),
+        )
+
+    def synopsis(self, parser):
+        """
+        Build the usage synopsis of the PARSER (see ParserSnapshot), the
+        options first, then the positional arguments.  The options from
+        a mutually exclusive group are listed together, at the position of
+        the first one.
+        """
+        exclusive = {}
+        for group in parser._mutually_exclusive_groups:
+            for action in group._group_actions:
+                exclusive.setdefault(id(action), group)
+
+        elements = []
+        seen_groups = set()
+        optionals = [action for action in parser._actions
+                     if action.option_strings]
+        positionals = [action for action in parser._actions
+                       if not action.option_strings]
+        for action in optionals + positionals:
+            if action.help == SUPPRESS:
+                continue
+            group = exclusive.get(id(action))
+            if group is None:
+                elements.append(self.synopsis_action(action, True))
+                continue
+            if id(group) in seen_groups:
+                continue
+            seen_groups.add(id(group))
+
+            members = [self.synopsis_action(member, False)
+                       for member in group._group_actions
+                       if member.help != SUPPRESS]
+            if len(members) == 1 and group.required:
+                elements.append(members[0])
+                continue
+            element = [("(", "") if group.required else ("[", "")]
+            for index, member in enumerate(members):
+                if index:
+                    element.append((" | ", ""))
+                element.extend(member)
+            element.append((")", "") if group.required else ("]", ""))
+            elements.append(element)
+        return elements
+
+    def synopsis_action(self, action, brackets):
+        """
+        Return the usage element for ACTION, the optional options are
+        enclosed in [brackets] if BRACKETS is set
+        """
+        fmt = self.action_formatter
+        if not action.option_strings:
+            default = fmt._get_default_metavar_for_positional(action)
+            return [(fmt._format_args(action, default), "I")]
+
+        element = [(action.option_strings[0], "B")]
+        if action.nargs != 0:
+            default = fmt._get_default_metavar_for_optional(action)
+            element.extend([(" ", ""), (fmt._format_args(action, default), "I")])
+        if brackets and not action.required:
+            element = [("[", "")] + element + [("]", "")]
+        return element
+
+    def group(self, action_group):
+        """ Snapshot argument group """
+        actions = []
+        for action in action_group._group_actions:
+            if action.help == SUPPRESS:
+                continue
+
+            if isinstance(action, _SubParsersAction):
+                return GroupSnapshot(action_group.title,
+                                     action_group.description, [],
+                                     self.subparsers(action))
+
+            if '--help' in action.option_strings:
+                continue
+
+            actions.append(self.action(action))
+
+        return GroupSnapshot(action_group.title, action_group.description,
+                             actions)
+
+    def action(self, action):
+        """ Snapshot argument (action), re-use the already seen ones """
+        key = id(action)
+        if key in self.actions:
+            return self.actions[key][1]
+
+        fmt = self.action_formatter
+        if not action.option_strings:
+            args, = fmt._metavar_formatter(action, action.dest)(1)
+        elif action.nargs == 0:
+            args = None
+        else:
+            args = fmt._format_args(action, action.dest.upper())
+
+        help_string = help_text = None
+        if action.help:
+            help_string = fmt._expand_help(action)
+            help_text = self.text(help_string, "help").strip('\n')
+
+        snapshot = ActionSnapshot(tuple(action.option_strings), action.dest,
+                                  args, help_string, help_text)
+        self.actions[key] = (action, snapshot)
+        return snapshot
+
+    def subparsers(self, action):
+        """ Snapshot the _SubParsersAction, recursively """
+        choices = []
+        command_help = {}
+        for choice in action._choices_actions:
+            command_help[choice.dest] = choice.help
+            if getattr(choice, 'help', None) == SUPPRESS:
+                continue
+            choices.append((choice.dest, choice.help))
+
+        # gather (sub-)command aliases
+        command_aliases = {}
+        command_aliases_names = set()
+        for name, command in action._name_parser_map.items():
+            if command not in command_aliases:
+                command_aliases[command] = []
+            else:
+                command_aliases[command].append(name)
+                command_aliases_names.add(name)
+
+        commands = []
+        for name, choice in action.choices.items():
+            if name in command_aliases_names:
+                # don't print aliased commands multiple times
+                continue
+            help_string = command_help.get(name, None)
+            if help_string == SUPPRESS:
+                # don't print hidden commands
+                continue
+            commands.append(CommandSnapshot(name, command_aliases[choice],
+                                            help_string, self.parser(choice)))
+
+        return SubparsersSnapshot(choices, commands)
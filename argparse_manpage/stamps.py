@@ -0,0 +1,130 @@
+"""
+Tracking of the files the manual pages are generated from.
+
+A "stamp" of a file is the [filename, size, mtime, sha256] list.  The file is
+considered changed if its size differs, or if the mtime differs and the
+content hash differs as well (so e.g. a fresh git checkout doesn't trigger
+re-generation).
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from argparse_manpage import __version__
+from argparse_manpage.compat import get_reproducible_date, get_source_date_epoch
+
+
+def file_digest(filename):
+    """
+    Return sha256 hex-digest of the FILENAME contents
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_stamp(filename):
+    """
+    Return the stamp of the existing FILENAME
+    """
+    stat = os.stat(filename)
+    return [filename, stat.st_size, stat.st_mtime_ns, file_digest(filename)]
+
+
+def source_changed(stamp):
+    """
+    Check if the file described by STAMP changed (or was removed)
+    """
+    filename, size, mtime, digest = stamp
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return True
+    if stat.st_size != size:
+        return True
+    if stat.st_mtime_ns == mtime:
+        return False
+    return file_digest(filename) != digest
+
+
+def data_digest(data):
+    """
+    Return sha256 hex-digest of the manual page specification DATA (one item
+    returned by parse_manpages_spec()).  The 'date' is ignored (the pages are
+    not re-generated every day), unless SOURCE_DATE_EPOCH is set; reproducible
+    builds change the date on purpose.
+    """
+    data = dict(data)
+    date = data.pop("date", None)
+    if get_source_date_epoch() is not None:
+        data["date"] = date or get_reproducible_date()
+    dumped = json.dumps([__version__, data], sort_keys=True, default=str)
+    return hashlib.sha256(dumped.encode("utf-8")).hexdigest()
+
+
+class PageStamps(object):
+    """
+    Database (a JSON file) of generated manual pages, with the stamps of all
+    the files they were generated from.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.pages = {}
+        try:
+            with open(filename) as fd:
+                self.pages = json.load(fd)
+        except (OSError, IOError, ValueError):
+            pass
+
+    def is_up_to_date(self, page, data):
+        """
+        Check if the manual PAGE generated according to DATA doesn't need to
+        be re-generated.
+        """
+        entry = self.pages.get(page)
+        if not entry or entry["spec"] != data_digest(data):
+            return False
+        if "outputs" not in entry:
+            # recorded by an older version
+            return False
+        for stamp in entry["outputs"] + entry["sources"]:
+            if source_changed(stamp):
+                return False
+        return True
+
+    def update(self, page, data, sources, output=None):
+        """
+        Record that the PAGE was generated according to DATA, from the list of
+        SOURCES files.  The OUTPUT is the generated file name, if it differs
+        from PAGE (e.g. a compressed page), or the list of the generated files
+        (e.g. the page split by sub-commands).
+        """
+        outputs = output or page
+        if not isinstance(outputs, list):
+            outputs = [outputs]
+        self.pages[page] = {
+            "spec": data_digest(data),
+            "outputs": [source_stamp(filename) for filename in outputs],
+            "sources": [source_stamp(source) for source in sources
+                        if os.path.exists(source)],
+        }
+
+    def save(self):
+        """
+        Atomically store the database
+        """
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmpname = tempfile.mkstemp(dir=dirname or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as stream:
+                json.dump(self.pages, stream, indent=1, sort_keys=True)
+            os.replace(tmpname, self.filename)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
@@ -0,0 +1,657 @@
+"""
+Static (AST-based) extraction of the ArgumentParser object.
+
+The target FILE/MODULE source is parsed by the 'ast' module, and only
+a restricted subset of Python is interpreted to build the parser: literals,
+simple expressions, the argparse (and textwrap) API calls, and calls to other
+functions defined in the same file.  Nothing is imported, so the third-party
+dependencies of the program don't need to be installed.
+
+The module top-level is processed leniently; whatever can not be evaluated
+(e.g. imports of third-party modules) is marked as unknown; so are all the
+argparse objects, if the failed statement could have modified some.  The
+parser-building code is interpreted strictly; once an unknown value or an
+unsupported construct is met, StaticExtractionError is raised, and the caller
+is expected to fall back to importing the FILE/MODULE.
+"""
+
+import argparse
+import ast
+import builtins
+import inspect
+import operator
+import os
+import sys
+import textwrap
+
+
+class StaticExtractionError(Exception):
+    """
+    The parser can not be extracted statically.
+    """
+
+
+class _Unknown(object):
+    """ Value which could not be evaluated statically """
+    def __repr__(self):
+        return "<unknown>"
+
+
+_UNKNOWN = _Unknown()
+
+# Modules that are "imported" by the interpreter
+_SAFE_MODULES = {
+    "argparse": argparse,
+    "textwrap": textwrap,
+}
+
+_SAFE_BUILTINS = dict((name, getattr(builtins, name)) for name in (
+    "abs", "all", "any", "bool", "bytes", "dict", "enumerate", "float",
+    "frozenset", "int", "len", "list", "max", "min", "range", "repr",
+    "reversed", "set", "sorted", "str", "sum", "tuple", "zip",
+))
+
+_PLAIN_TYPES = (str, bytes, int, float, complex, bool, type(None), tuple,
+                list, dict, set, frozenset, range, enumerate, zip,
+                type(reversed([])), type({}.keys()), type({}.values()),
+                type({}.items()))
+
+_PLAIN_METHODS = frozenset([
+    # str
+    "capitalize", "center", "endswith", "format", "join", "ljust", "lower",
+    "lstrip", "replace", "rjust", "rstrip", "split", "splitlines",
+    "startswith", "strip", "title", "upper",
+    # containers
+    "copy", "count", "get", "index", "items", "keys", "values",
+])
+
+_ARGPARSE_TYPES = (argparse._ActionsContainer, argparse.Action)
+
+_ARGPARSE_METHODS = frozenset([
+    "add_argument", "add_argument_group", "add_mutually_exclusive_group",
+    "add_parser", "add_subparsers", "set_defaults",
+])
+
+# Keyword arguments not affecting the manual page, unknown values are ignored
+_IGNORED_KEYWORDS = {
+    "add_argument": {"version": ""},
+}
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+    ast.Not: operator.not_,
+}
+
+_COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+# Pre-3.8 Python versions use specialized constant nodes (deprecated since
+# 3.8, and removed in 3.14)
+if sys.version_info >= (3, 8):
+    _CONSTANT_NODES = (ast.Constant,)
+else:
+    _CONSTANT_NODES = tuple(getattr(ast, name) for name in (
+        "Constant", "Str", "Num", "Bytes", "NameConstant", "Ellipsis")
+                            if hasattr(ast, name))
+
+_MAX_CALL_DEPTH = 32
+
+
+def _fail(node, message="unsupported construct"):
+    raise StaticExtractionError("line {0}: {1}".format(
+        getattr(node, "lineno", "?"), message))
+
+
+def _constant_value(node):
+    for attr in ("value", "s", "n"):
+        if hasattr(node, attr):
+            return getattr(node, attr)
+    return Ellipsis
+
+
+def _assigned_names(node):
+    """
+    Return the set of names (possibly) bound by the NODE statement
+    """
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+            names.add(child.id)
+        elif isinstance(child, (ast.FunctionDef, ast.ClassDef)):
+            names.add(child.name)
+        elif isinstance(child, (ast.Import, ast.ImportFrom)):
+            for alias in child.names:
+                names.add((alias.asname or alias.name).split(".")[0])
+    names.discard("*")
+    return names
+
+
+def _loaded_names(node):
+    return set(child.id for child in ast.walk(node)
+               if isinstance(child, ast.Name)
+               and isinstance(child.ctx, ast.Load))
+
+
+def _has_argparse_object(value, depth=0):
+    """
+    Return True if VALUE is an argparse object, or a container with some
+    """
+    if isinstance(value, _ARGPARSE_TYPES):
+        return True
+    if depth > 4:
+        return False
+    if isinstance(value, dict):
+        value = list(value.keys()) + list(value.values())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return any(_has_argparse_object(item, depth + 1) for item in value)
+    return False
+
+
+class _StaticFunction(object):
+    """
+    Function defined in the interpreted source.  The argument defaults are
+    evaluated at the definition time, as in Python.
+    """
+    def __init__(self, interpreter, node, defaults, kw_defaults):
+        self.interpreter = interpreter
+        self.node = node
+        self.defaults = defaults
+        self.kw_defaults = kw_defaults
+        self.__name__ = node.name
+
+    def __call__(self, *args, **kwargs):
+        # Only the interpreter can call the function, but argparse needs
+        # callable 'type=' arguments.
+        raise StaticExtractionError("{0}() can not be called".format(
+            self.__name__))
+
+    def bind(self, args, kwargs):
+        """ Return the local namespace for a call with ARGS and KWARGS """
+        spec = self.node.args
+        positional = list(getattr(spec, "posonlyargs", [])) + list(spec.args)
+        local = {}
+        if len(args) > len(positional) and not spec.vararg:
+            _fail(self.node, "too many arguments for " + self.__name__)
+        for arg, value in zip(positional, args):
+            local[arg.arg] = value
+        if spec.vararg:
+            local[spec.vararg.arg] = tuple(args[len(positional):])
+
+        extra = {}
+        kwonly = [arg.arg for arg in spec.kwonlyargs]
+        for name, value in kwargs.items():
+            if name in local:
+                _fail(self.node, "multiple values for " + name)
+            if name in kwonly or name in [arg.arg for arg in spec.args]:
+                local[name] = value
+            elif spec.kwarg:
+                extra[name] = value
+            else:
+                _fail(self.node, "unexpected argument " + name)
+        if spec.kwarg:
+            local[spec.kwarg.arg] = extra
+
+        first_default = len(positional) - len(self.defaults)
+        for index, arg in enumerate(positional):
+            if arg.arg in local:
+                continue
+            if index < first_default:
+                _fail(self.node, "missing argument " + arg.arg)
+            local[arg.arg] = self.defaults[index - first_default]
+        for arg, default in zip(spec.kwonlyargs, self.kw_defaults):
+            if arg.arg not in local:
+                if default is None:
+                    _fail(self.node, "missing argument " + arg.arg)
+                local[arg.arg] = default[0]
+        return local
+
+
+class _Return(Exception):
+    def __init__(self, value):
+        super(_Return, self).__init__()
+        self.value = value
+
+
+class _Interpreter(object):
+    """
+    Interpreter of one module source.
+    """
+    def __init__(self, tree, name, filename):
+        self.globals = {
+            "__name__": name,
+            "__file__": filename,
+            "__doc__": ast.get_docstring(tree, clean=False),
+        }
+        self.tree = tree
+        self.depth = 0
+        # the number of the argparse method calls and attribute assignments
+        self.argparse_changes = 0
+
+    # Module level
+
+    def run_module(self):
+        """ Leniently process the module top-level statements """
+        self._run_lenient(self.tree.body)
+
+    def _run_lenient(self, statements):
+        for stmt in statements:
+            changes = self.argparse_changes
+            try:
+                self._module_statement(stmt)
+            except StaticExtractionError:
+                # Whatever the statement binds is unknown now.
+                names = _assigned_names(stmt)
+                touched = changes != self.argparse_changes or any(
+                    _has_argparse_object(self.globals.get(name))
+                    for name in _loaded_names(stmt))
+                if touched:
+                    # The statement could have modified (or was about to
+                    # modify) some argparse object.  The parsers are linked
+                    # with each other (subparsers, parents, argument groups),
+                    # so none of them is known now.
+                    names.update(name for name, value in self.globals.items()
+                                 if _has_argparse_object(value))
+                for name in names:
+                    self.globals[name] = _UNKNOWN
+
+    def _module_statement(self, stmt):
+        if isinstance(stmt, ast.FunctionDef):
+            if stmt.decorator_list:
+                _fail(stmt, "decorated function")
+            self.globals[stmt.name] = self._define(stmt, self.globals)
+        elif isinstance(stmt, ast.Import):
+            for alias in stmt.names:
+                module = _SAFE_MODULES.get(alias.name, _UNKNOWN)
+                if alias.asname:
+                    self.globals[alias.asname] = module
+                else:
+                    top = alias.name.split(".")[0]
+                    self.globals[top] = module if top == alias.name else _UNKNOWN
+        elif isinstance(stmt, ast.ImportFrom):
+            if stmt.module == "__future__":
+                return
+            module = None
+            if not stmt.level:
+                module = _SAFE_MODULES.get(stmt.module)
+            for alias in stmt.names:
+                if alias.name == "*":
+                    if module is None:
+                        continue
+                    for name in getattr(module, "__all__", []):
+                        self.globals[name] = getattr(module, name)
+                    continue
+                value = _UNKNOWN
+                if module is not None:
+                    value = getattr(module, alias.name, _UNKNOWN)
+                self.globals[alias.asname or alias.name] = value
+        elif isinstance(stmt, ast.Try):
+            # Assume the imports in the 'try' block succeeded; but the names
+            # bound only by the exception handlers are unknown.
+            self._run_lenient(stmt.body)
+            for handler in stmt.handlers:
+                for name in _assigned_names(handler):
+                    self.globals.setdefault(name, _UNKNOWN)
+            self._run_lenient(stmt.orelse)
+            self._run_lenient(stmt.finalbody)
+        elif isinstance(stmt, ast.If):
+            test = self.evaluate(stmt.test, self.globals)
+            self._run_lenient(stmt.body if test else stmt.orelse)
+        else:
+            self.execute([stmt], self.globals)
+
+    def _define(self, node, scope):
+        defaults = []
+        for default in node.args.defaults:
+            defaults.append(self._evaluate_lenient(default, scope))
+        kw_defaults = []
+        for default in node.args.kw_defaults:
+            if default is None:
+                kw_defaults.append(None)
+            else:
+                kw_defaults.append((self._evaluate_lenient(default, scope),))
+        return _StaticFunction(self, node, defaults, kw_defaults)
+
+    def _evaluate_lenient(self, node, scope):
+        try:
+            return self.evaluate(node, scope)
+        except StaticExtractionError:
+            return _UNKNOWN
+
+    # Statements
+
+    def call_function(self, function, args, kwargs):
+        """ Interpret the _StaticFunction call """
+        if self.depth >= _MAX_CALL_DEPTH:
+            _fail(function.node, "too deep recursion")
+        scope = function.bind(args, kwargs)
+        self.depth += 1
+        try:
+            self.execute(function.node.body, scope)
+        except _Return as ret:
+            return ret.value
+        finally:
+            self.depth -= 1
+        return None
+
+    def execute(self, statements, scope):
+        """ Strictly execute the list of STATEMENTS in SCOPE """
+        # pylint: disable=too-many-branches
+        for stmt in statements:
+            if isinstance(stmt, ast.Expr):
+                self.evaluate(stmt.value, scope)
+            elif isinstance(stmt, ast.Assign):
+                value = self.evaluate(stmt.value, scope)
+                for target in stmt.targets:
+                    self._assign(target, value, scope)
+            elif isinstance(stmt, getattr(ast, "AnnAssign", ())):
+                if stmt.value is not None:
+                    self._assign(stmt.target, self.evaluate(stmt.value, scope),
+                                 scope)
+            elif isinstance(stmt, ast.AugAssign):
+                if not isinstance(stmt.target, ast.Name):
+                    _fail(stmt)
+                value = self._binary(stmt, stmt.op,
+                                     self._lookup(stmt.target, scope),
+                                     self.evaluate(stmt.value, scope))
+                scope[stmt.target.id] = value
+            elif isinstance(stmt, ast.Return):
+                value = None
+                if stmt.value is not None:
+                    value = self.evaluate(stmt.value, scope)
+                raise _Return(value)
+            elif isinstance(stmt, ast.If):
+                if self.evaluate(stmt.test, scope):
+                    self.execute(stmt.body, scope)
+                else:
+                    self.execute(stmt.orelse, scope)
+            elif isinstance(stmt, ast.For):
+                if stmt.orelse:
+                    _fail(stmt)
+                for item in self._plain(stmt.iter, self.evaluate(stmt.iter, scope)):
+                    self._assign(stmt.target, item, scope)
+                    self.execute(stmt.body, scope)
+            elif isinstance(stmt, ast.Import) and scope is not self.globals:
+                for alias in stmt.names:
+                    if alias.name not in _SAFE_MODULES:
+                        _fail(stmt, "import of " + alias.name)
+                    scope[alias.asname or alias.name] = _SAFE_MODULES[alias.name]
+            elif isinstance(stmt, ast.Pass):
+                pass
+            else:
+                _fail(stmt)
+
+    def _assign(self, target, value, scope):
+        if isinstance(target, ast.Name):
+            scope[target.id] = value
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            values = list(self._plain(target, value))
+            if len(values) != len(target.elts):
+                _fail(target, "can not unpack")
+            for element, item in zip(target.elts, values):
+                self._assign(element, item, scope)
+        elif isinstance(target, ast.Attribute):
+            obj = self.evaluate(target.value, scope)
+            if not isinstance(obj, _ARGPARSE_TYPES):
+                _fail(target, "attribute assignment")
+            if target.attr.startswith("__"):
+                _fail(target, "private attribute")
+            self.argparse_changes += 1
+            setattr(obj, target.attr, value)
+        else:
+            _fail(target)
+
+    # Expressions
+
+    def _lookup(self, node, scope):
+        for namespace in (scope, self.globals, _SAFE_BUILTINS):
+            if node.id in namespace:
+                value = namespace[node.id]
+                if value is _UNKNOWN:
+                    _fail(node, "unknown value of " + node.id)
+                return value
+        _fail(node, "undefined name " + node.id)
+        return None
+
+    @staticmethod
+    def _plain(node, value):
+        if not isinstance(value, _PLAIN_TYPES):
+            _fail(node, "unsupported operand")
+        return value
+
+    def _binary(self, node, op, left, right):
+        if type(op) not in _BINARY_OPERATORS:
+            _fail(node, "unsupported operator")
+        try:
+            return _BINARY_OPERATORS[type(op)](self._plain(node, left),
+                                               self._plain(node, right))
+        except (TypeError, ValueError, KeyError, ZeroDivisionError) as err:
+            _fail(node, str(err))
+        return None
+
+    def evaluate(self, node, scope):
+        """ Strictly evaluate the expression NODE in SCOPE """
+        # pylint: disable=too-many-return-statements,too-many-branches
+        if isinstance(node, _CONSTANT_NODES):
+            return _constant_value(node)
+        if isinstance(node, ast.Name):
+            return self._lookup(node, scope)
+        if isinstance(node, ast.Attribute):
+            return self._attribute(node, self.evaluate(node.value, scope))
+        if isinstance(node, ast.Call):
+            return self._call(node, scope)
+        if isinstance(node, ast.BinOp):
+            return self._binary(node, node.op, self.evaluate(node.left, scope),
+                                self.evaluate(node.right, scope))
+        if isinstance(node, ast.UnaryOp):
+            if type(node.op) not in _UNARY_OPERATORS:
+                _fail(node, "unsupported operator")
+            operand = self._plain(node, self.evaluate(node.operand, scope))
+            return _UNARY_OPERATORS[type(node.op)](operand)
+        if isinstance(node, ast.BoolOp):
+            value = None
+            for operand in node.values:
+                value = self.evaluate(operand, scope)
+                if isinstance(node.op, ast.And) != bool(value):
+                    break
+            return value
+        if isinstance(node, ast.Compare):
+            left = self.evaluate(node.left, scope)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.evaluate(comparator, scope)
+                try:
+                    if not _COMPARE_OPERATORS[type(op)](left, right):
+                        return False
+                except TypeError as err:
+                    _fail(node, str(err))
+                left = right
+            return True
+        if isinstance(node, ast.IfExp):
+            if self.evaluate(node.test, scope):
+                return self.evaluate(node.body, scope)
+            return self.evaluate(node.orelse, scope)
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            items = []
+            for element in node.elts:
+                if isinstance(element, getattr(ast, "Starred", ())):
+                    items.extend(self._plain(element, self.evaluate(element.value, scope)))
+                else:
+                    items.append(self.evaluate(element, scope))
+            return {ast.List: list, ast.Tuple: tuple, ast.Set: set}[type(node)](items)
+        if isinstance(node, ast.Dict):
+            result = {}
+            for key, value in zip(node.keys, node.values):
+                if key is None:
+                    result.update(self._plain(value, self.evaluate(value, scope)))
+                else:
+                    result[self.evaluate(key, scope)] = self.evaluate(value, scope)
+            return result
+        if isinstance(node, ast.Subscript):
+            value = self._plain(node, self.evaluate(node.value, scope))
+            try:
+                return value[self._subscript(node.slice, scope)]
+            except (TypeError, IndexError, KeyError) as err:
+                _fail(node, str(err))
+        if isinstance(node, getattr(ast, "JoinedStr", ())):
+            return "".join(self._formatted(value, scope) for value in node.values)
+        _fail(node)
+        return None
+
+    def _subscript(self, node, scope):
+        if isinstance(node, ast.Slice):
+            parts = [None if part is None else self.evaluate(part, scope)
+                     for part in (node.lower, node.upper, node.step)]
+            return slice(*parts)
+        if isinstance(node, getattr(ast, "Index", ())):
+            return self.evaluate(node.value, scope)
+        return self.evaluate(node, scope)
+
+    def _formatted(self, node, scope):
+        if not isinstance(node, ast.FormattedValue):
+            return self.evaluate(node, scope)
+        value = self._plain(node, self.evaluate(node.value, scope))
+        conversion = {ord("r"): repr, ord("s"): str, ord("a"): ascii}
+        if node.conversion in conversion:
+            value = conversion[node.conversion](value)
+        spec = ""
+        if node.format_spec is not None:
+            spec = self.evaluate(node.format_spec, scope)
+        return format(value, spec)
+
+    def _attribute(self, node, value):
+        if node.attr.startswith("__"):
+            _fail(node, "private attribute")
+        if inspect.ismodule(value):
+            if value not in _SAFE_MODULES.values():
+                _fail(node)
+        elif isinstance(value, _PLAIN_TYPES):
+            if node.attr not in _PLAIN_METHODS:
+                _fail(node, "unsupported method " + node.attr)
+        elif isinstance(value, _ARGPARSE_TYPES):
+            attr = getattr(value, node.attr, None)
+            if inspect.ismethod(attr) and node.attr not in _ARGPARSE_METHODS:
+                _fail(node, "unsupported method " + node.attr)
+        else:
+            _fail(node)
+        try:
+            return getattr(value, node.attr)
+        except AttributeError as err:
+            _fail(node, str(err))
+        return None
+
+    def _callable_allowed(self, function):
+        if isinstance(function, _StaticFunction):
+            return function.interpreter is self
+        if any(function is builtin for builtin in _SAFE_BUILTINS.values()):
+            return True
+        if inspect.isclass(function) or inspect.isfunction(function):
+            return getattr(function, "__module__", None) in _SAFE_MODULES
+        owner = getattr(function, "__self__", None)
+        name = getattr(function, "__name__", None)
+        if isinstance(owner, _ARGPARSE_TYPES):
+            return name in _ARGPARSE_METHODS
+        if isinstance(owner, _PLAIN_TYPES):
+            return name in _PLAIN_METHODS
+        return False
+
+    def _call(self, node, scope):
+        function = self.evaluate(node.func, scope)
+        if not self._callable_allowed(function):
+            _fail(node, "call of {0!r}".format(function))
+
+        name = getattr(function, "__name__", None)
+        lenient = {}
+        if isinstance(getattr(function, "__self__", None), _ARGPARSE_TYPES):
+            lenient = _IGNORED_KEYWORDS.get(name, {})
+
+        args = []
+        for arg in node.args:
+            if isinstance(arg, getattr(ast, "Starred", ())):
+                args.extend(self._plain(arg, self.evaluate(arg.value, scope)))
+            else:
+                args.append(self.evaluate(arg, scope))
+        kwargs = {}
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                kwargs.update(self._plain(keyword, self.evaluate(keyword.value, scope)))
+            elif name == "set_defaults" or keyword.arg in lenient:
+                # values not affecting the manual page
+                value = self._evaluate_lenient(keyword.value, scope)
+                if value is _UNKNOWN:
+                    value = lenient.get(keyword.arg)
+                kwargs[keyword.arg] = value
+            else:
+                kwargs[keyword.arg] = self.evaluate(keyword.value, scope)
+
+        if isinstance(function, _StaticFunction):
+            return self.call_function(function, args, kwargs)
+        if isinstance(getattr(function, "__self__", None), _ARGPARSE_TYPES):
+            self.argparse_changes += 1
+        try:
+            return function(*args, **kwargs)
+        except StaticExtractionError:
+            raise
+        except Exception as err:  # pylint: disable=broad-except
+            _fail(node, "{0}: {1}".format(type(err).__name__, err))
+        return None
+
+
+def find_module_source(module):
+    """
+    Find the source file of the (dotted) MODULE name on sys.path, without
+    importing the module or its parent packages.  Return None if not found.
+    """
+    parts = module.split(".")
+    for path in sys.path:
+        base = os.path.join(path or os.curdir, *parts)
+        for candidate in (base + ".py", os.path.join(base, "__init__.py")):
+            if os.path.isfile(candidate):
+                return candidate
+    return None
+
+
+def get_parser_from_source(filename, objname, objtype='object', name=None):
+    """
+    Statically extract the OBJNAME ArgumentParser object (or call the OBJNAME
+    function if OBJTYPE is 'function') from the Python source FILENAME.  The
+    NAME is the module name.  Raise StaticExtractionError if not possible.
+    """
+    try:
+        with open(filename, "rb") as fd:
+            tree = ast.parse(fd.read(), filename)
+    except (IOError, OSError, SyntaxError, ValueError) as err:
+        raise StaticExtractionError(str(err)) from err
+
+    interpreter = _Interpreter(tree, name or "<run_path>", filename)
+    interpreter.run_module()
+
+    obj = interpreter.globals.get(objname, _UNKNOWN)
+    if objtype != 'object':
+        if not isinstance(obj, _StaticFunction):
+            raise StaticExtractionError(
+                "function {0} can not be extracted".format(objname))
+        obj = interpreter.call_function(obj, [], {})
+
+    if not isinstance(obj, argparse.ArgumentParser):
+        raise StaticExtractionError(
+            "{0} is not an ArgumentParser object".format(objname))
+    return obj
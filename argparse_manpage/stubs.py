@@ -0,0 +1,156 @@
+"""
+Placeholder (stub) modules for the imports not needed to build the parser.
+
+Programs often import heavy (or not installed) packages at the module
+top-level, while only 'argparse' is needed to construct the parser.  Within
+the stubbed_imports() context, such imports are satisfied by placeholder
+modules; any attribute of a placeholder module is a placeholder object, which
+can be called, subclassed, used as a decorator, etc.
+
+The list of stubbed packages is specified as a comma separated string, e.g.
+'requests,numpy'.  The '*' item stubs any package that can not be found, and
+the '!name' item never stubs the 'name' package (even if it is missing).
+"""
+
+import sys
+from contextlib import contextmanager
+from importlib.abc import Loader, MetaPathFinder
+from importlib.machinery import ModuleSpec
+from types import ModuleType
+
+
+class _Stub(object):
+    """
+    Placeholder for any object from the stubbed module
+    """
+    def __new__(cls, name=None, bases=None, namespace=None):
+        if bases is None:
+            return super(_Stub, cls).__new__(cls)
+        # Python < 3.7 (no __mro_entries__) calls the type of the stub base as
+        # the metaclass, class Foo(stubbed.Base): ... gives a plain class
+        bases = tuple(base for base in bases
+                      if not isinstance(base, _Stub)) or (object,)
+        return type(name, bases, dict(namespace))
+
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __repr__(self):
+        return "<stub {0}>".format(self.__name__)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _Stub(self.__name__ + "." + name)
+
+    def __call__(self, *args, **kwargs):
+        if len(args) == 1 and not kwargs and callable(args[0]) \
+                and not isinstance(args[0], _Stub):
+            # used as a decorator, keep the decorated function
+            return args[0]
+        return _Stub(self.__name__ + "()")
+
+    def __getitem__(self, key):
+        return self
+
+    def __iter__(self):
+        return iter(())
+
+    def __or__(self, other):
+        return self
+
+    __ror__ = __or__
+
+    def __mro_entries__(self, bases):
+        # class Foo(stubbed.Base): ...
+        return (type(self.__name__.split(".")[-1], (object,), {}),)
+
+
+class _StubModule(ModuleType):
+    """
+    Placeholder module, all the (non-dunder) attributes are _Stub objects
+    """
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _Stub(self.__name__ + "." + name)
+
+
+class _StubLoader(Loader):
+    def create_module(self, spec):
+        return _StubModule(spec.name)
+
+    def exec_module(self, module):
+        pass
+
+
+class _StubFinder(MetaPathFinder):
+    """
+    Stub the NAMES packages (all their sub-modules), or any package which
+    wasn't found if NAMES is None, but never the DENIED packages
+    """
+    def __init__(self, names, denied):
+        self.names = names
+        self.denied = denied
+        self.loader = _StubLoader()
+        self.stubbed = []
+
+    def find_spec(self, fullname, path=None, target=None):
+        """ See importlib.abc.MetaPathFinder """
+        # pylint: disable=unused-argument
+        top = fullname.split(".")[0]
+        if top in self.denied:
+            return None
+        if self.names is not None and top not in self.names:
+            return None
+        self.stubbed.append(fullname)
+        return ModuleSpec(fullname, self.loader, is_package=True)
+
+
+def parse_stub_imports(value):
+    """
+    Parse the comma separated list of stubbed packages (see the module
+    docstring) into the (names, missing, denied) triple
+    """
+    names = set()
+    denied = set()
+    missing = False
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item == "*":
+            missing = True
+        elif item.startswith("!"):
+            denied.add(item[1:])
+        else:
+            names.add(item)
+    return names, missing, denied
+
+
+@contextmanager
+def stubbed_imports(value):
+    """
+    Within the context, satisfy the imports of packages specified by VALUE
+    (see parse_stub_imports()) with placeholder modules.  The placeholder
+    modules are removed from sys.modules when leaving the context.  Nothing is
+    done if VALUE is empty.
+    """
+    names, missing, denied = parse_stub_imports(value)
+    finders = []
+    if names:
+        # consulted first, so even the installed packages are stubbed
+        finders.append(_StubFinder(names, denied))
+        sys.meta_path.insert(0, finders[-1])
+    if missing:
+        # consulted last, only if no other finder found the module
+        finders.append(_StubFinder(None, denied))
+        sys.meta_path.append(finders[-1])
+    try:
+        yield
+    finally:
+        for finder in finders:
+            sys.meta_path.remove(finder)
+            for name in finder.stubbed:
+                if isinstance(sys.modules.get(name), _StubModule):
+                    del sys.modules[name]
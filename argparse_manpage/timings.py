@@ -0,0 +1,168 @@
+"""
+Wall-time instrumentation of the manual page generation (--timings).
+
+The instrumented code reports the time spent in its stages by the timed()
+context manager (or by timed_iter() for the lazily generated parts, e.g. the
+rendered lines).  The times are only collected within the collect_timings()
+context, otherwise the instrumentation does nothing.
+
+The stages are nested (e.g. 'usage' is a part of 'snapshot', and 'render' is
+a part of 'write'), so the reported times are inclusive.  The same holds for
+the sub-commands, the time of a sub-command includes its own sub-commands.
+Besides the times, plain event counters (e.g. the number of the duplicate
+actions rendered from the cache) are collected by count().
+"""
+
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# The registry collecting the times, see collect_timings()
+_TIMINGS = None
+
+
+class Timings(object):
+    """
+    Registry of the (wall) time spent in the named stages and sub-commands,
+    and the number of calls, and of the named COUNTERS
+    """
+    CATEGORIES = ("stages", "subcommands")
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.subcommands = OrderedDict()
+        self.counters = OrderedDict()
+
+    def start(self, name, category="stages"):
+        """
+        Register NAME, so the (nested) stages are reported in the order they
+        were started, not finished
+        """
+        getattr(self, category).setdefault(name, [0.0, 0])
+
+    def add(self, name, seconds, category="stages"):
+        """ Account SECONDS spent in one call of NAME """
+        entry = getattr(self, category).setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def count(self, name, number=1):
+        """ Increase the NAME counter by NUMBER """
+        self.counters[name] = self.counters.get(name, 0) + number
+
+    def as_dict(self):
+        """
+        Return {category: {name: {"seconds": ..., "calls": ...}}} dict, with
+        the {"counters": {name: number}} item
+        """
+        result = dict(
+            (category, OrderedDict(
+                (name, {"seconds": seconds, "calls": calls})
+                for name, (seconds, calls) in getattr(self, category).items()))
+            for category in self.CATEGORIES)
+        result["counters"] = OrderedDict(self.counters)
+        return result
+
+    def format(self, output_format="text"):
+        """ Return the report as OUTPUT_FORMAT ('text' or 'json') """
+        if output_format == "json":
+            return json.dumps(self.as_dict(), indent=2) + "\n"
+
+        lines = []
+        for category in self.CATEGORIES:
+            entries = getattr(self, category)
+            if not entries:
+                continue
+            if lines:
+                lines.append("")
+            width = max(len(name) for name in entries)
+            width = max(width, len(category))
+            lines.append("{0:{width}}  {1:>8}  {2:>10}".format(
+                category, "calls", "seconds", width=width))
+            for name, (seconds, calls) in entries.items():
+                lines.append("{0:{width}}  {1:>8}  {2:>10.4f}".format(
+                    name, calls, seconds, width=width))
+        if self.counters:
+            if lines:
+                lines.append("")
+            width = max(len(name) for name in self.counters)
+            width = max(width, len("counters"))
+            lines.append("{0:{width}}  {1:>8}".format("counters", "count",
+                                                      width=width))
+            for name, number in self.counters.items():
+                lines.append("{0:{width}}  {1:>8}".format(name, number,
+                                                          width=width))
+        return "".join(line + "\n" for line in lines)
+
+
+def get_timings():
+    """ Return the collecting Timings registry, or None """
+    return _TIMINGS
+
+
+@contextmanager
+def collect_timings(timings=None):
+    """
+    Collect the times into the TIMINGS registry (a new one by default) within
+    the context, the registry is returned by the context manager
+    """
+    # pylint: disable=global-statement
+    global _TIMINGS
+    if timings is None:
+        timings = Timings()
+    previous = _TIMINGS
+    _TIMINGS = timings
+    try:
+        yield timings
+    finally:
+        _TIMINGS = previous
+
+
+@contextmanager
+def timed(name, category="stages"):
+    """ Account the time spent in the context to NAME """
+    timings = _TIMINGS
+    if timings is None:
+        yield
+        return
+    timings.start(name, category)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start, category)
+
+
+def count(name, number=1):
+    """ Increase the NAME counter by NUMBER, if the times are collected """
+    if _TIMINGS is not None:
+        _TIMINGS.count(name, number)
+
+
+def timed_iter(name, iterable, category="stages"):
+    """
+    Return an iterator over ITERABLE; the time spent in generating the items
+    (not in consuming them) is accounted to NAME, as one call
+    """
+    if _TIMINGS is None:
+        return iterable
+    return _timed_iter(_TIMINGS, name, iterable, category)
+
+
+def _timed_iter(timings, name, iterable, category):
+    timings.start(name, category)
+    seconds = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+    except StopIteration:
+        return
+    finally:
+        timings.add(name, seconds, category)
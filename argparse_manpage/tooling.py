@@ -1,43 +1,100 @@
 """
 A tooling helpers for the argparse-manpage project.
+
+This module is imported by the argparse-manpage script at startup, so the
+modules needed only by some code paths (static extraction, import stubs,
+compressors, ...) are imported once they are actually used.
 """
 
+# pylint: disable=import-outside-toplevel
+
 import importlib
+import io
 import os
 import sys
+from contextlib import contextmanager
+
+from .compat import (
+    ConfigParser,
+    NoSectionError,
+    get_module_object,
+    get_source_date_epoch,
+    load_file_as_module,
+    load_toml,
+)
+from .manpage import (
+    MANPAGE_DATA_ATTRS,
+    SHARED_OPTIONS_METHODS,
+    Manpage,
+    iter_split_manpages,
+)
+from .snapshot import SYNOPSIS_METHODS, WRAP_METHODS, ParserSnapshot
+from .profiling import memory_stage
+from .timings import timed
+
+
+# The setup.cfg section and pyproject.toml [tool.*] table with the list of
+# manual pages.
+SPEC_SECTION = 'build_manpages'
 
-from .compat import get_module_object, load_file_as_module
+
+# Methods of loading the ArgumentParser object from the FILE/MODULE, see
+# get_parser()
+EXTRACT_METHODS = ('import', 'static')
+
+# Supported compression methods, and the corresponding file name suffixes
+COMPRESSION_SUFFIXES = {
+    'gzip': '.gz',
+    'xz': '.xz',
+    'zstd': '.zst',
+}
+
+# Modules imported before the first parser was loaded, see get_parser_sources()
+_PRELOADED_MODULES = None
 
 
 def _environ_hack():
     os.environ['BUILD_MANPAGES_RUNNING'] = 'TRUE'
 
 
-def get_parser_from_module(module, objname, objtype='object', prog=None):
+def get_parser_from_module(module, objname, objtype='object', prog=None,
+                           stub_imports=None):
     """
-    Read the given module and return the requested object from there.
+    Read the given module and return the requested object from there.  The
+    imports of STUB_IMPORTS packages are stubbed (see argparse_manpage.stubs).
     """
     _environ_hack()
     # We need to fix up argv[0] so argparse returns appropriate "usage"
     # strings.  Like "usage: argparse-manpage [-h] ...", instead of
     # "usage: setup.py ...".
+    from .stubs import stubbed_imports
+
     backup_argv = sys.argv
     if prog:
         sys.argv = [prog]
 
-    mod = importlib.import_module(module)
-    obj = get_module_object(mod, objname, objtype)
+    with stubbed_imports(stub_imports):
+        with timed("import"):
+            mod = importlib.import_module(module)
+        with timed("factory"):
+            obj = get_module_object(mod, objname, objtype)
 
     # Restore caller's argv
     sys.argv = backup_argv
     return obj
 
 
-def get_parser_from_file(filename, objname, objtype='object', prog=None):
+def get_parser_from_file(filename, objname, objtype='object', prog=None,
+                         stub_imports=None, bytecode_cache=None):
     """
     Load the given filename as a module and return the requested object from
-    there.
+    there.  The imports of STUB_IMPORTS packages are stubbed (see
+    argparse_manpage.stubs).  The compiled file is cached in the
+    BYTECODE_CACHE directory, if specified (see argparse_manpage.bytecode).
     """
+    # pylint: disable=too-many-arguments
+    from .stubs import stubbed_imports
+
     _environ_hack()
     # We need to fix up argv[0] so argparse returns appropriate "usage"
     # strings.  Like "usage: argparse-manpage [-h] ...", instead of
@@ -49,33 +106,714 @@ def get_parser_from_file(filename, objname, objtype='object', prog=None):
         sys.argv = [os.path.basename(filename)]
 
     # Get the ArgumentParser object
-    module_loaded = load_file_as_module(filename)
-    obj = get_module_object(module_loaded, objname, objtype)
+    with stubbed_imports(stub_imports):
+        with timed("import"):
+            module_loaded = load_file_as_module(filename, bytecode_cache)
+        with timed("factory"):
+            obj = get_module_object(module_loaded, objname, objtype)
 
     # Restore caller's argv
     sys.argv = backup_argv
     return obj
 
 
-def get_parser(import_type, import_from, objname, objtype, prog=None):
+def get_parser_static(import_type, import_from, objname, objtype, prog=None):
+    """
+    Statically extract the parser from the given file or module source,
+    without importing (executing) it, see argparse_manpage.static.  Return the
+    (parser, filename) pair, FILENAME is the parsed source file.  Raise
+    StaticExtractionError if the parser can not be extracted.
+    """
+    from .static import (
+        StaticExtractionError,
+        find_module_source,
+        get_parser_from_source,
+    )
+
+    name = None
+    filename = import_from
+    if import_type == 'module':
+        name = import_from
+        filename = find_module_source(import_from)
+        if filename is None:
+            raise StaticExtractionError(
+                "module {0} not found".format(import_from))
+
+    # The same argv[0] as get_parser_from_module() or get_parser_from_file()
+    backup_argv = sys.argv
+    if prog:
+        sys.argv = [prog]
+    elif import_type == 'pyfile':
+        sys.argv = [os.path.basename(filename)]
+    try:
+        with timed("static extraction"):
+            parser = get_parser_from_source(filename, objname, objtype,
+                                            name=name)
+    finally:
+        sys.argv = backup_argv
+    return parser, os.path.abspath(filename)
+
+
+def get_parser(import_type, import_from, objname, objtype, prog=None,
+               extract='import', stub_imports=None, bytecode_cache=None):
     """
-    Load a function or object from a given file or module.
+    Load a function or object from a given file or module.  With EXTRACT set
+    to 'static', the parser is extracted without importing the file or module
+    (see get_parser_static()), but if that's not possible, it is imported.
+    The imports of STUB_IMPORTS packages are stubbed while importing.  See
+    get_parser_from_file() for BYTECODE_CACHE.
     """
+    # pylint: disable=too-many-arguments
+    if extract == 'static':
+        from .static import StaticExtractionError
+        try:
+            return get_parser_static(import_type, import_from, objname,
+                                     objtype, prog=prog)[0]
+        except StaticExtractionError:
+            pass
     if import_type == 'pyfile':
-        return get_parser_from_file(import_from, objname, objtype, prog=prog)
-    return get_parser_from_module(import_from, objname, objtype, prog=prog)
+        return get_parser_from_file(import_from, objname, objtype, prog=prog,
+                                    stub_imports=stub_imports,
+                                    bytecode_cache=bytecode_cache)
+    return get_parser_from_module(import_from, objname, objtype, prog=prog,
+                                  stub_imports=stub_imports)
 
 
-def write_to_filename(text, filename):
+def get_parser_sources(import_type, import_from, objname, objtype, prog=None,
+                       extract='import', stub_imports=None,
+                       bytecode_cache=None):
     """
-    Write given text into a filename at once.  Pre-create the parent directory
-    if it doesn't exist yet.  Print to stdout if filename == '-'.
+    Same as get_parser(), but return a (parser, sources) pair.  The SOURCES is
+    a sorted list of Python files the parser was loaded from; the loaded FILE
+    or MODULE, and all the modules imported while loading the parser.
+    Modules imported by previously loaded parsers (in the same process) are
+    listed as well, since we can't tell if they are dependencies, too.  So are
+    all the project modules (neither in the standard library nor installed in
+    site-packages) imported before, e.g. by setup.py; the parser might use
+    them without importing them again.  Statically extracted parsers only
+    depend on the FILE or MODULE source.
     """
-    if filename == '-':
-        sys.stdout.write(text)
-    else:
-        dirname = os.path.dirname(filename)
-        if dirname and not os.path.exists(dirname):
+    # pylint: disable=global-statement,too-many-arguments
+    global _PRELOADED_MODULES
+    if _PRELOADED_MODULES is None:
+        _PRELOADED_MODULES = set(sys.modules)
+
+    if extract == 'static':
+        from .static import StaticExtractionError
+        try:
+            parser, filename = get_parser_static(import_type, import_from,
+                                                 objname, objtype, prog=prog)
+            return parser, [filename]
+        except StaticExtractionError:
+            pass
+
+    parser = get_parser(import_type, import_from, objname, objtype, prog=prog,
+                        stub_imports=stub_imports,
+                        bytecode_cache=bytecode_cache)
+
+    targets = set()
+    if import_type == 'module':
+        # the module (and its parents) might have been imported before
+        parts = import_from.split('.')
+        targets.update('.'.join(parts[:i + 1]) for i in range(len(parts)))
+
+    sources = set()
+    if import_type == 'pyfile':
+        sources.add(os.path.abspath(import_from))
+    for name, module in list(sys.modules.items()):
+        # Our own modules imported on demand (e.g. argparse_manpage.bytecode)
+        # are not the parser dependencies, neither is the running script.
+        if name == '__main__' or name.split('.')[0] in ('argparse_manpage',
+                                                        'build_manpages'):
+            continue
+        filename = getattr(module, '__file__', None)
+        if not filename or not os.path.isfile(filename):
+            continue
+        filename = os.path.abspath(filename)
+        if _is_stdlib_file(filename):
+            continue
+        if name in _PRELOADED_MODULES and name not in targets \
+                and _is_site_file(filename):
+            # e.g. setuptools imported by setup.py
+            continue
+        sources.add(filename)
+    return parser, sorted(sources)
+
+
+def _is_stdlib_file(filename):
+    """
+    Python standard library modules (e.g. those imported by runpy) only change
+    with Python, don't track them.
+    """
+    import sysconfig
+    paths = sysconfig.get_paths()
+    for site in (paths["purelib"], paths["platlib"]):
+        if filename.startswith(os.path.join(site, "")):
+            return False
+    for stdlib in (paths["stdlib"], paths["platstdlib"]):
+        if filename.startswith(os.path.join(stdlib, "")):
+            return True
+    return False
+
+
+def _is_site_file(filename):
+    import sysconfig
+    paths = sysconfig.get_paths()
+    return any(filename.startswith(os.path.join(paths[site], ""))
+               for site in ("purelib", "platlib"))
+
+
+def unload_changed_modules(sources, changed):
+    """
+    Remove the modules loaded from the CHANGED files from sys.modules, so they
+    are imported again (e.g. by get_parser()).  The modules loaded from other
+    SOURCES files are removed too, unless they are installed in
+    site-packages; the project modules may depend on the changed ones.
+    """
+    forget = set(os.path.abspath(filename) for filename in changed)
+    forget.update(os.path.abspath(filename) for filename in sources
+                  if not _is_site_file(os.path.abspath(filename)))
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, "__file__", None)
+        if filename and os.path.abspath(filename) in forget:
+            del sys.modules[name]
+
+
+def get_parser_snapshot(import_type, import_from, objname, objtype, prog=None,
+                        cache=None, extract='import', stub_imports=None,
+                        synopsis='argparse', width=None, wrap='argparse'):
+    """
+    Load the parser (see get_parser()) and return the (snapshot, sources)
+    pair, see get_parser_sources().  If CACHE (SnapshotCache) is specified,
+    the snapshot is loaded from there if none of the parser sources changed
+    (the parser is not imported at all), and stored there otherwise; the
+    compiled --pyfile bytecode is cached in its 'bytecode' sub-directory.  The
+    SYNOPSIS, WIDTH and WRAP are passed to ParserSnapshot.from_parser().
+    """
+    # pylint: disable=too-many-arguments
+    if cache is None:
+        parser, sources = get_parser_sources(import_type, import_from, objname,
+                                             objtype, prog=prog,
+                                             extract=extract,
+                                             stub_imports=stub_imports)
+        snapshot = ParserSnapshot.from_parser(parser, synopsis=synopsis,
+                                              width=width, wrap=wrap)
+        return snapshot, sources
+
+    location = import_from
+    if import_type == 'pyfile':
+        location = os.path.abspath(import_from)
+    key = cache.get_key(
+        import_type, location, objname, objtype, prog, extract, stub_imports,
+        synopsis, width, wrap,
+        os.path.basename(sys.argv[0]), os.getcwd(), list(sys.path),
+    )
+    with timed("cache lookup"):
+        cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    bytecode_cache = None
+    if cache.directory:
+        bytecode_cache = os.path.join(cache.directory, "bytecode")
+    parser, sources = get_parser_sources(
+        import_type, import_from, objname, objtype, prog=prog, extract=extract,
+        stub_imports=stub_imports, bytecode_cache=bytecode_cache)
+    snapshot = ParserSnapshot.from_parser(parser, synopsis=synopsis,
+                                          width=width, wrap=wrap)
+    cache.put(key, snapshot, sources)
+    return snapshot, sources
+
+
+def _same_content(new, old):
+    """
+    Check if the NEW and OLD files have the same content (size first)
+    """
+    try:
+        if os.path.getsize(new) != os.path.getsize(old):
+            return False
+    except OSError:
+        return False
+    from .stamps import file_digest
+    return file_digest(new) == file_digest(old)
+
+
+def _new_file_mode(filename):
+    """
+    Permissions for the (re-)created FILENAME, as if it was created by open()
+    """
+    try:
+        return os.stat(filename).st_mode & 0o7777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def get_compression(filename, compress=None):
+    """
+    Return the (filename, compression) pair.  If COMPRESS is not specified,
+    the compression method is detected from the FILENAME suffix, otherwise
+    the appropriate suffix is appended to FILENAME if missing.  The returned
+    compression is None for uncompressed output.
+    """
+    if compress in (None, "none"):
+        if compress is None and filename != '-':
+            for method, suffix in COMPRESSION_SUFFIXES.items():
+                if filename.endswith(suffix):
+                    return filename, method
+        return filename, None
+
+    if compress not in COMPRESSION_SUFFIXES:
+        raise ValueError("Unknown compression method: {0}".format(compress))
+    if compress == 'zstd' and not _have_zstd():
+        raise ValueError("The zstd compression requires Python 3.14+")
+    suffix = COMPRESSION_SUFFIXES[compress]
+    if filename != '-' and not filename.endswith(suffix):
+        filename += suffix
+    return filename, compress
+
+
+def _have_zstd():
+    try:
+        # pylint: disable=unused-import
+        from compression import zstd  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _open_compressor(fileobj, compress):
+    """
+    Return a binary stream compressing everything into FILEOBJ.  Closing the
+    returned stream doesn't close the FILEOBJ.
+    """
+    if compress == 'gzip':
+        import gzip
+        # No file name, and a fixed timestamp in the header to keep the
+        # output reproducible.
+        return gzip.GzipFile(filename="", mode="wb", fileobj=fileobj,
+                             mtime=get_source_date_epoch(0))
+    if compress == 'xz':
+        import lzma
+        return lzma.LZMAFile(fileobj, "wb")
+    if compress == 'zstd':
+        from compression import zstd
+        return zstd.ZstdFile(fileobj, "wb")
+    raise ValueError("Unknown compression method: {0}".format(compress))
+
+
+@contextmanager
+def _text_stream(binary, compress):
+    """
+    Wrap the BINARY stream by text stream, optionally compressed by the
+    COMPRESS method.  The BINARY stream is not closed.
+    """
+    if compress:
+        binary = _open_compressor(binary, compress)
+    stream = io.TextIOWrapper(binary)
+    yield stream
+    stream.detach()
+    if compress:
+        # writes the compression trailer
+        binary.close()
+
+
+@contextmanager
+def open_output(filename, compress=None):
+    """
+    Open FILENAME for writing (text), pre-create the parent directory if it
+    doesn't exist yet.  Everything is written into a temporary file first,
+    and then atomically moved to FILENAME, so (parallel) readers never see
+    partially written files.  When the content doesn't change, the existing
+    file is left untouched (including its mtime).  The output is compressed
+    when COMPRESS (see COMPRESSION_SUFFIXES) is specified.
+    """
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        try:
             os.makedirs(dirname)
-        with open(filename, 'w') as stream:
-            stream.write(text)
+        except OSError:
+            # created by a parallel writer
+            if not os.path.isdir(dirname):
+                raise
+
+    import tempfile
+    fd, tmpname = tempfile.mkstemp(
+        dir=dirname or ".", prefix="." + os.path.basename(filename) + ".",
+        suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as binary:
+            with _text_stream(binary, compress) as stream:
+                yield stream
+        if _same_content(tmpname, filename):
+            os.unlink(tmpname)
+            return
+        os.chmod(tmpname, _new_file_mode(filename))
+        os.replace(tmpname, filename)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+
+@contextmanager
+def _open_stdout(compress=None):
+    if not compress:
+        yield sys.stdout
+        return
+    sys.stdout.flush()
+    with _text_stream(sys.stdout.buffer, compress) as stream:
+        yield stream
+    sys.stdout.buffer.flush()
+
+
+def write_to_filename(text, filename, compress=None):
+    """
+    Write given text into a filename at once (see open_output()).  Print to
+    stdout if filename == '-'.
+    """
+    with timed("write"):
+        if filename == '-':
+            with _open_stdout(compress) as stream:
+                stream.write(text)
+        else:
+            with open_output(filename, compress) as stream:
+                stream.write(text)
+
+
+def write_manpage_to_filename(manpage, filename, compress=None):
+    """
+    Same as write_to_filename(), but stream the rendered MANPAGE (a Manpage
+    instance) directly into the file, without building the whole page in
+    memory first.  With COMPRESS, the page is compressed while rendering.
+    """
+    with timed("write"):
+        if filename == '-':
+            with _open_stdout(compress) as stream:
+                manpage.write(stream)
+        else:
+            with open_output(filename, compress) as stream:
+                manpage.write(stream)
+
+
+def parse_manpages_spec(string):
+    """
+    Parse the list of manual page specifications (one per line), e.g.
+    'man/foo.1:object=parser:pyfile=bin/foo.py', into a dictionary
+    {'man/foo.1': {'objtype': 'object', ...}, ...}.
+    """
+    manpages_data = {}
+    for spec in string.strip().split('\n'):
+        manpagedata = {}
+        output = True
+
+        basename = None
+        for option in spec.split(':'):
+            if output:
+                outputfile = option
+                output = False
+                continue
+
+            oname, ovalue = option.split('=')
+
+            if oname == 'function' or oname == 'object':
+                assert(not 'objtype' in manpagedata)
+                manpagedata['objtype'] = oname
+                manpagedata['objname'] = ovalue
+
+            elif oname == 'pyfile' or oname == 'module':
+                assert(not 'import_type' in manpagedata)
+                manpagedata['import_type'] = oname
+                manpagedata['import_from'] = ovalue
+                if oname == 'pyfile':
+                    basename = os.path.basename(ovalue)
+
+            elif oname in ('format', 'compress', 'stub_imports',
+                           'split_subcommands'):
+                assert(not oname in manpagedata)
+                manpagedata[oname] = ovalue
+
+            elif oname == 'extract':
+                assert(not oname in manpagedata)
+                if ovalue not in EXTRACT_METHODS:
+                    raise ValueError("Unknown extract method: {}".format(ovalue))
+                manpagedata[oname] = ovalue
+
+            elif oname == 'width':
+                assert(not oname in manpagedata)
+                if not ovalue.isdigit() or int(ovalue) <= 0:
+                    raise ValueError("Invalid width: {}".format(ovalue))
+                manpagedata[oname] = int(ovalue)
+
+            elif oname == 'synopsis':
+                assert(not oname in manpagedata)
+                if ovalue not in SYNOPSIS_METHODS:
+                    raise ValueError("Unknown synopsis method: {}".format(ovalue))
+                manpagedata[oname] = ovalue
+
+            elif oname == 'wrap':
+                assert(not oname in manpagedata)
+                if ovalue not in WRAP_METHODS:
+                    raise ValueError("Unknown wrap method: {}".format(ovalue))
+                manpagedata[oname] = ovalue
+
+            elif oname == 'shared_options':
+                assert(not oname in manpagedata)
+                if ovalue not in SHARED_OPTIONS_METHODS:
+                    raise ValueError("Unknown shared options method: {}".format(ovalue))
+                manpagedata[oname] = ovalue
+
+            elif oname == 'author':
+                manpagedata.setdefault("authors", []).append(ovalue)
+
+            elif oname in MANPAGE_DATA_ATTRS and oname != "authors":
+                assert(not oname in manpagedata)
+                manpagedata[oname] = ovalue
+
+            else:
+                raise ValueError("Unknown manpage configuration option: {}".format(oname))
+
+        if "prog" not in manpagedata and basename:
+            manpagedata["prog"] = basename
+
+        manpages_data[outputfile] = manpagedata
+
+    return manpages_data
+
+
+def get_pyproject_table(filename="pyproject.toml"):
+    """
+    Return the [tool.build_manpages] table from the toml configuration file
+    (as a dict), or None.
+    """
+    content = load_toml(filename)
+    if content is None:
+        return None
+    try:
+        return content["tool"][SPEC_SECTION]
+    except KeyError:
+        return None
+
+
+def get_pyproject_settings(filename="pyproject.toml"):
+    """Parse and handle errors of a toml configuration file."""
+    table = get_pyproject_table(filename)
+    if table is None:
+        return None
+
+    try:
+        value = table["manpages"]
+        if isinstance(value, list):
+            value = "\n".join(value)
+        return str(value)
+    except KeyError:
+        return None
+
+
+def read_manpages_spec(filename):
+    """
+    Read the list of manual page specifications from FILENAME, and parse it
+    by parse_manpages_spec().  The FILENAME is either a 'pyproject.toml' file
+    (with the [tool.build_manpages] table), a 'setup.cfg' file (with the
+    [build_manpages] section), or a plain text file with one specification
+    per line (empty lines and lines starting with '#' are ignored).
+    """
+    if filename.endswith(".toml"):
+        spec = get_pyproject_settings(filename)
+    elif filename.endswith(".cfg"):
+        config = ConfigParser()
+        config.read(filename)
+        try:
+            spec = config.get(SPEC_SECTION, 'manpages')
+        except NoSectionError:
+            spec = None
+    else:
+        with open(filename) as fd:
+            spec = "\n".join(
+                line.strip() for line in fd
+                if line.strip() and not line.strip().startswith("#"))
+
+    if not spec:
+        raise ValueError("No manual page specification found in " + filename)
+    return parse_manpages_spec(spec)
+
+
+def write_manpage_from_spec(filename, data, cache=None):
+    """
+    Load the parser according to the DATA (one item returned from
+    parse_manpages_spec(), optionally filled with other MANPAGE_DATA_ATTRS)
+    and write its manual page into FILENAME.  When CACHE (SnapshotCache) is
+    specified, the parser snapshot is loaded through the cache.  The page is
+    compressed according to the 'compress' item in DATA, or according to the
+    FILENAME suffix (see get_compression()).  With the 'split_subcommands'
+    directory in DATA, the page is split by sub-commands (see
+    write_split_manpages()).  Return the list of files the manual page was
+    generated from (see get_page_inputs()).
+    """
+    args = (data['import_type'], data['import_from'], data['objname'],
+            data['objtype'])
+    kwargs = {
+        'prog': data.get('prog'),
+        'extract': data.get('extract', 'import'),
+        'stub_imports': data.get('stub_imports'),
+    }
+    with memory_stage("load"):
+        if cache is None:
+            parser, sources = get_parser_sources(*args, **kwargs)
+        else:
+            parser, sources = get_parser_snapshot(
+                *args, cache=cache,
+                synopsis=data.get('synopsis') or 'argparse',
+                width=data.get('width'),
+                wrap=data.get('wrap') or 'argparse', **kwargs)
+    with memory_stage("render"):
+        if data.get('split_subcommands'):
+            write_split_manpages(filename, data, parser)
+            return get_page_inputs(data, sources)
+        with timed("manpage"):
+            manpage = Manpage(parser, format=data.get('format', 'pretty'),
+                              _data=data)
+        filename, compress = get_compression(filename, data.get('compress'))
+        write_manpage_to_filename(manpage, filename, compress)
+    return get_page_inputs(data, sources)
+
+
+def _split_page_name(filename, compress=None):
+    """
+    Return the (filename, compress, name, suffix) tuple for the top-level
+    FILENAME of the split manual page, e.g. 'prog' and '.1' for 'prog.1.gz'
+    """
+    filename, compress = get_compression(filename, compress)
+    base = filename
+    if compress:
+        base = filename[:-len(COMPRESSION_SUFFIXES[compress])]
+    name, suffix = os.path.splitext(os.path.basename(base))
+    return filename, compress, name, suffix
+
+
+def _split_pages_list(directory, name, suffix):
+    """
+    Return the name of the file listing the sub-command pages of the NAME
+    top-level page (e.g. 'DIRECTORY/prog.1.pages' for 'prog.1')
+    """
+    return os.path.join(directory, name + suffix + ".pages")
+
+
+def _read_split_pages(pages_list):
+    """
+    Read the sub-command page names (relative to the directory) recorded in
+    the PAGES_LIST file, see write_split_manpages()
+    """
+    try:
+        with open(pages_list) as fd:
+            names = [line.strip() for line in fd]
+    except (IOError, OSError):
+        return []
+    # never point outside the directory
+    return [name for name in names
+            if name and name == os.path.basename(name)]
+
+
+def write_split_manpages(filename, data, parser):
+    """
+    Write the manual page of the PARSER (ArgumentParser or ParserSnapshot)
+    split by sub-commands, see iter_split_manpages().  The top-level page is
+    written into FILENAME (if None, into the 'split_subcommands' directory
+    from DATA, named after the parser's prog and the manual section), the
+    sub-command pages into the 'split_subcommands' directory, named after the
+    top-level page (e.g. 'prog-command.1' for 'prog.1').  Unchanged pages are
+    left untouched (see open_output()).  The list of the sub-command pages is
+    recorded in the 'prog.1.pages' file in the directory, and the pages
+    written the last time but not now (e.g. of a removed sub-command) are
+    removed.  Return the list of written files.
+    """
+    directory = data['split_subcommands']
+    compress = data.get('compress')
+    name, suffix = None, ".{0}".format(data.get('manual_section') or 1)
+    if filename is not None:
+        filename, compress, name, suffix = _split_page_name(filename, compress)
+
+    pages = []
+    for page, manpage in iter_split_manpages(
+            parser, _data=data, format=data.get('format', 'pretty'), name=name):
+        if name is None:
+            name = page
+        output, page_compress = filename, compress
+        if pages or filename is None:
+            output, page_compress = get_compression(
+                os.path.join(directory, page + suffix), compress)
+        write_manpage_to_filename(manpage, output, page_compress)
+        pages.append(output)
+
+    pages_list = _split_pages_list(directory, name, suffix)
+    written = [os.path.basename(page) for page in pages[1:]]
+    for stale in _read_split_pages(pages_list):
+        if stale not in written and os.path.exists(
+                os.path.join(directory, stale)):
+            os.unlink(os.path.join(directory, stale))
+    write_to_filename("".join(page + "\n" for page in written), pages_list)
+    return pages + [pages_list]
+
+
+def get_split_pages(filename, directory, compress=None):
+    """
+    Return the list of the sub-command pages in DIRECTORY, written the last
+    time for the top-level FILENAME page (see write_split_manpages())
+    """
+    _, compress, name, suffix = _split_page_name(filename, compress)
+    return [os.path.join(directory, page) for page in
+            _read_split_pages(_split_pages_list(directory, name, suffix))]
+
+
+def get_page_outputs(filename, data):
+    """
+    Return the list of files written for the FILENAME manual page according to
+    DATA (see write_manpage_from_spec()); the (compressed) page, and for the
+    page split by sub-commands also the sub-command pages and their list (see
+    write_split_manpages()).
+    """
+    filename, compress = get_compression(filename, data.get('compress'))
+    outputs = [filename]
+    directory = data.get('split_subcommands')
+    if directory:
+        _, _, name, suffix = _split_page_name(filename, compress)
+        outputs += get_split_pages(filename, directory, compress)
+        outputs.append(_split_pages_list(directory, name, suffix))
+    return outputs
+
+
+def get_page_inputs(data, sources):
+    """
+    Return the list of all files the manual page is generated from, the
+    parser SOURCES (see get_parser_sources()) and the include/manfile
+    files from the DATA (see write_manpage_from_spec()).
+    """
+    inputs = list(sources)
+    for attr in ("include", "manfile"):
+        if data.get(attr):
+            inputs.append(os.path.abspath(data[attr]))
+    return inputs
+
+
+def _escape_make(filename):
+    return filename.replace(" ", "\\ ").replace("#", "\\#").replace("$", "$$")
+
+
+def write_depfile(filename, pages):
+    """
+    Write a Makefile-syntax dependency file (as understood by Make, Ninja or
+    Meson) into FILENAME.  PAGES is a list of (page, inputs) pairs, where
+    INPUTS is the list of files the page was generated from (see
+    get_page_inputs()).  The page is either a file name, or the list of all
+    the files generated together (see get_page_outputs()).
+    """
+    lines = []
+    for page, inputs in pages:
+        if not isinstance(page, list):
+            page = [page]
+        line = " ".join(_escape_make(target) for target in page) + ":"
+        for source in inputs:
+            line += " \\\n  " + _escape_make(source)
+        lines.append(line + "\n")
+    write_to_filename("".join(lines), filename)
@@ -0,0 +1,76 @@
+"""
+Re-generating the manual pages when their input files change (--watch).
+
+The input files (Python modules imported while loading the parser, and the
+include/manfile files) are periodically polled, and compared by mtime and
+size, so no platform-specific file notification API is needed.
+"""
+
+import os
+import sys
+import time
+import traceback
+
+from argparse_manpage.tooling import unload_changed_modules
+
+DEFAULT_INTERVAL = 1.0
+
+
+def _stamp(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _stamps(filenames):
+    return dict((filename, _stamp(filename)) for filename in filenames)
+
+
+def watch(inputs, build, after=None, interval=DEFAULT_INTERVAL):
+    """
+    Watch the INPUTS files, a {page: [input files]} dictionary, and call
+    BUILD(page) for every page with changed inputs.  BUILD re-generates the
+    page, and returns the new list of its input files.  If specified,
+    AFTER(inputs) is called after each round of page re-generation.  The
+    changed modules are unloaded before BUILD is called, so they are imported
+    again.  Run until interrupted.
+    """
+    stamps = dict((page, _stamps(files)) for page, files in inputs.items())
+    print("watching {0} manual page(s) for changes".format(len(stamps)))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(interval)
+            changed_pages = []
+            changed_files = set()
+            for page, page_stamps in stamps.items():
+                changed = [filename for filename, stamp in page_stamps.items()
+                           if _stamp(filename) != stamp]
+                if changed:
+                    changed_pages.append(page)
+                    changed_files.update(changed)
+            if not changed_pages:
+                continue
+
+            for page in changed_pages:
+                unload_changed_modules(inputs[page], changed_files)
+            for page in changed_pages:
+                print("regenerating " + page)
+                # stamp before the build, not to miss the changes made
+                # meanwhile
+                previous = _stamps(inputs[page])
+                try:
+                    inputs[page] = build(page)
+                except Exception:  # pylint: disable=broad-except
+                    # e.g. a syntax error, wait for the next change
+                    traceback.print_exc()
+                stamps[page] = _stamps(inputs[page])
+                stamps[page].update((filename, stamp)
+                                    for filename, stamp in previous.items()
+                                    if filename in stamps[page])
+            if after is not None:
+                after(inputs)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,140 @@
+#! /usr/bin/env python3
+"""
+Measure the manual page rendering time, and the peak memory, for synthetic
+parser trees (see synthetic.py).  The results are printed as JSON, e.g.:
+
+    $ python benchmarks/bench_render.py --subcommands 8 --depth 3 -o new.json
+
+For each format, the Manpage object construction ('init', collecting the
+parser snapshot) and the __str__() call ('str') are timed separately; the
+minimum and median of the --repeat runs are reported.  The peak memory is
+measured by tracemalloc in an extra (not timed) run.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# pylint: disable=wrong-import-position
+from argparse_manpage.manpage import Manpage
+from argparse_manpage.snapshot import SYNOPSIS_METHODS, WRAP_METHODS
+from synthetic import PARAMETERS, build_parser, count_parsers
+
+FORMATS = ("pretty", "single-commands-section")
+
+# fixed date, so the output doesn't depend on the current time
+_DATA = {"date": "2000-01-01"}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR,
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _render(parser, fmt, data):
+    start = time.perf_counter()
+    manpage = Manpage(parser, format=fmt, _data=dict(data))
+    middle = time.perf_counter()
+    text = str(manpage)
+    return middle - start, time.perf_counter() - middle, text
+
+
+def _peak_memory(parser, fmt, data):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        str(Manpage(parser, format=fmt, _data=dict(data)))
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _summary(values):
+    return {"min": min(values), "median": statistics.median(values)}
+
+
+def benchmark(params, formats=FORMATS, repeat=5, synopsis="argparse",
+              wrap="argparse"):
+    """
+    Benchmark the rendering of the build_parser(**PARAMS) parser in the
+    FORMATS, with the SYNOPSIS and WRAP methods, return the result dict
+    """
+    parser = build_parser(**params)
+    data = dict(_DATA, synopsis=synopsis, wrap=wrap)
+    results = {}
+    for fmt in formats:
+        init_times, str_times = [], []
+        for _ in range(repeat):
+            init_time, str_time, text = _render(parser, fmt, data)
+            init_times.append(init_time)
+            str_times.append(str_time)
+        results[fmt] = {
+            "init_seconds": _summary(init_times),
+            "str_seconds": _summary(str_times),
+            "peak_memory_bytes": _peak_memory(parser, fmt, data),
+            "output_lines": text.count("\n"),
+        }
+    return {
+        "parameters": dict(PARAMETERS, **params),
+        "parsers": count_parsers(params),
+        "repeat": repeat,
+        "synopsis": synopsis,
+        "wrap": wrap,
+        "python": platform.python_version(),
+        "commit": _git_commit(),
+        "results": results,
+    }
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark rendering of synthetic parser trees.")
+    for name, default in PARAMETERS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=int,
+                            default=default, metavar="N",
+                            help="default: {0}".format(default))
+    parser.add_argument("--format", action="append", choices=FORMATS,
+                        help="benchmark only this format (can be repeated)")
+    parser.add_argument("--synopsis", choices=SYNOPSIS_METHODS,
+                        default="argparse",
+                        help="synopsis method (default: %(default)s)")
+    parser.add_argument("--wrap", choices=WRAP_METHODS, default="argparse",
+                        help="wrap method (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, metavar="N",
+                        help="number of timed runs (default: %(default)s)")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="write the JSON results to FILE, not stdout")
+    return parser
+
+
+def main():
+    """ Command-line entry point """
+    args = _get_parser().parse_args()
+    params = dict((name, getattr(args, name)) for name in PARAMETERS)
+    result = benchmark(params, formats=args.format or FORMATS,
+                       repeat=args.repeat, synopsis=args.synopsis,
+                       wrap=args.wrap)
+    text = json.dumps(result, indent=2, sort_keys=True) + "\n"
+    if args.output:
+        with open(args.output, "w") as fd:
+            fd.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Generator of synthetic ArgumentParser trees for the benchmarks.
+
+The generated parsers are deterministic (the same parameters produce the same
+parser), so the results are comparable across commits.
+"""
+
+import argparse
+
+# Parameters of build_parser(), with the defaults
+PARAMETERS = {
+    "options": 10,      # options per group
+    "groups": 3,        # argument groups per parser
+    "subcommands": 4,   # subcommands per parser
+    "depth": 2,         # nesting level of the subcommands
+    "aliases": 1,       # aliases per subcommand
+    "help_length": 20,  # words per help text
+}
+
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+          "eiusmod tempor incididunt ut labore et dolore magna aliqua").split()
+
+
+def help_text(length, seed=0):
+    """ Return a help text of LENGTH words """
+    return " ".join(_WORDS[(seed + i) % len(_WORDS)] for i in range(length))
+
+
+def _fill_parser(parser, params, level, name):
+    for group_index in range(params["groups"]):
+        group = parser.add_argument_group(
+            "{0} group {1}".format(name, group_index),
+            help_text(params["help_length"], group_index))
+        for option_index in range(params["options"]):
+            seed = group_index * params["options"] + option_index
+            option = "--{0}-g{1}-o{2}".format(name, group_index, option_index)
+            if option_index % 3 == 0:
+                group.add_argument(option, action="store_true",
+                                   help=help_text(params["help_length"], seed))
+            elif option_index % 3 == 1:
+                group.add_argument(option, metavar="VALUE", default="x",
+                                   help=help_text(params["help_length"], seed))
+            else:
+                group.add_argument(option, choices=["a", "b", "c"],
+                                   help=help_text(params["help_length"], seed))
+
+    if level >= params["depth"] or not params["subcommands"]:
+        return
+
+    subparsers = parser.add_subparsers(
+        title="{0} commands".format(name),
+        help=help_text(params["help_length"]))
+    for index in range(params["subcommands"]):
+        subname = "{0}{1}".format(name, index)
+        aliases = ["{0}a{1}".format(subname, alias)
+                   for alias in range(params["aliases"])]
+        subparser = subparsers.add_parser(
+            subname, aliases=aliases,
+            help=help_text(params["help_length"], index),
+            description=help_text(2 * params["help_length"], index))
+        _fill_parser(subparser, params, level + 1, subname)
+
+
+def build_parser(**kwargs):
+    """
+    Build the synthetic parser tree, the keyword arguments override the
+    PARAMETERS defaults
+    """
+    unknown = set(kwargs) - set(PARAMETERS)
+    if unknown:
+        raise TypeError("unknown parameters: " + ", ".join(sorted(unknown)))
+    params = dict(PARAMETERS, **kwargs)
+    parser = argparse.ArgumentParser(
+        prog="synthetic",
+        description=help_text(4 * params["help_length"]),
+        epilog=help_text(params["help_length"]))
+    _fill_parser(parser, params, 0, "c")
+    return parser
+
+
+def count_parsers(params):
+    """ Return the number of (sub)parsers build_parser(**PARAMS) creates """
+    params = dict(PARAMETERS, **params)
+    total = level_count = 1
+    for _ in range(params["depth"]):
+        level_count *= params["subcommands"]
+        total += level_count
+    return total
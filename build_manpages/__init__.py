@@ -1,9 +1,55 @@
 """
 Export some useful methods in top-level.
+
+The exports are loaded on first access, so e.g. 'from build_manpages import
+__version__' doesn't import setuptools.
 """
 
+import importlib
+import sys
+import types
+
 from argparse_manpage import __version__
-from .build_manpages import build_manpages, get_build_py_cmd, get_install_cmd
 
-install = get_install_cmd()
-build_py = get_build_py_cmd()
+_EXPORTS = ("build_manpages", "get_build_py_cmd", "get_install_cmd",
+            "install", "build_py")
+
+
+def _load(name):
+    module = importlib.import_module(__name__ + ".build_manpages")
+    if name == "install":
+        value = module.get_install_cmd()
+    elif name == "build_py":
+        value = module.get_build_py_cmd()
+    else:
+        value = getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return _load(name)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(
+        __name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        if name == "build_manpages" and isinstance(value, types.ModuleType):
+            # Importing the 'build_manpages.build_manpages' sub-module binds
+            # it here, but 'build_manpages' is the exported command class.
+            value = value.build_manpages
+        types.ModuleType.__setattr__(self, name, value)
+
+
+sys.modules[__name__].__class__ = _Package
+
+if sys.version_info < (3, 7):
+    # no module __getattr__ (PEP 562), load eagerly
+    for _name in _EXPORTS:
+        _load(_name)
@@ -1,29 +1,16 @@
 """
 build_manpages command -- generate set of manual pages by the setup()
 command.
+
+This module is imported by every 'setup.py' invocation (even by 'setup.py
+--version'), so only the setuptools command classes are imported at the
+module level.  The rest of argparse-manpage (and the TOML parser,
+multiprocessing, etc.) is imported once the commands actually run.
 """
 
-import os
-import shutil
+# pylint: disable=import-outside-toplevel
 
-try:
-    import tomllib
-    from tomllib import TOMLDecodeError
-except ImportError:
-    try:
-        import tomli as tomllib
-        from tomli import TOMLDecodeError
-    except ImportError:
-        import toml as tomllib
-        from toml import TomlDecodeError as TOMLDecodeError
-
-from argparse_manpage.compat import ConfigParser, NoSectionError
-from argparse_manpage.tooling import get_parser, write_to_filename
-from argparse_manpage.manpage import (
-    Manpage,
-    MANPAGE_DATA_ATTRS,
-    get_manpage_data_from_distribution,
-)
+import os
 
 from .compat import (
     build_py,
@@ -34,109 +21,220 @@ from .compat import (
 
 DEFAULT_CMD_NAME = 'build_manpages'
 
-def parse_manpages_spec(string):
-    manpages_data = {}
-    for spec in string.strip().split('\n'):
-        manpagedata = {}
-        output = True
-
-        basename = None
-        for option in spec.split(':'):
-            if output:
-                outputfile = option
-                output = False
-                continue
-
-            oname, ovalue = option.split('=')
 
-            if oname == 'function' or oname == 'object':
-                assert(not 'objtype' in manpagedata)
-                manpagedata['objtype'] = oname
-                manpagedata['objname'] = ovalue
-
-            elif oname == 'pyfile' or oname == 'module':
-                assert(not 'import_type' in manpagedata)
-                manpagedata['import_type'] = oname
-                manpagedata['import_from'] = ovalue
-                if oname == 'pyfile':
-                    basename = os.path.basename(ovalue)
-
-            elif oname == 'format':
-                assert(not 'format' in manpagedata)
-                manpagedata[oname] = ovalue
-
-            elif oname == 'author':
-                manpagedata.setdefault("authors", []).append(ovalue)
-
-            elif oname in MANPAGE_DATA_ATTRS and oname != "authors":
-                assert(not oname in manpagedata)
-                manpagedata[oname] = ovalue
-
-            else:
-                raise ValueError("Unknown manpage configuration option: {}".format(oname))
-
-        if "prog" not in manpagedata and basename:
-            manpagedata["prog"] = basename
+def parse_manpages_spec(string):
+    """
+    Kept for backward compatibility, see
+    argparse_manpage.tooling.parse_manpages_spec()
+    """
+    from argparse_manpage.tooling import parse_manpages_spec as _parse
+    return _parse(string)
 
-        manpages_data[outputfile] = manpagedata
 
-    return manpages_data
+def build_manpage(page, data):
+    """
+    Generate one manual PAGE according to DATA (see parse_manpages_spec()).
+    Return the list of files the page was generated from.
+    """
+    from argparse_manpage.tooling import (
+        get_page_inputs,
+        get_parser_sources,
+        write_manpage_from_spec,
+    )
+    format = data.get('format', 'pretty')
+    if format in ('pretty', 'single-commands-section'):
+        return write_manpage_from_spec(page, data)
+    if format == 'old':
+        if data.get('compress'):
+            raise ValueError("The 'old' format doesn't support compression")
+        if data.get('split_subcommands'):
+            raise ValueError("The 'old' format doesn't support split pages")
+        parser, sources = get_parser_sources(data['import_type'], data['import_from'], data['objname'], data['objtype'], data.get('prog', None),
+                                             extract=data.get('extract', 'import'),
+                                             stub_imports=data.get('stub_imports'))
+        # TODO: drop the "old" format support, and stop depending on ManPageWriter
+        # pylint: disable=import-outside-toplevel
+        from .build_manpage import ManPageWriter
+        mw = ManPageWriter(parser, data)
+        mw.write(page)
+        return get_page_inputs(data, sources)
+    raise ValueError("Unknown format: {}".format(format))
+
+
+def _build_manpage_job(args):
+    # multiprocessing.Pool.imap() passes only one argument
+    return build_manpage(*args)
+
+
+def _get_pool(jobs):
+    """
+    Return a process pool for parallel build, or None if not available.  Only
+    the 'fork' start method is usable, others would re-execute the setup.py
+    script in workers.
+    """
+    import multiprocessing
+    import sys
+    import warnings
 
-def get_pyproject_settings():
-    """Parse and handle errors of a toml configuration file."""
     try:
-        with open("pyproject.toml", mode="r") as fp:
-            content = tomllib.loads(fp.read())
-    except TOMLDecodeError:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        warnings.warn("Parallel build_manpages is not supported on this "
+                      "platform, building serially")
         return None
+    # Don't duplicate the buffered output in workers
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return context.Pool(jobs, maxtasksperchild=1)
 
-    try:
-        value = content["tool"][DEFAULT_CMD_NAME]["manpages"]
-        if isinstance(value, list):
-            value = "\n".join(value)
-        return str(value)
-    except KeyError:
-        return None
 
 class build_manpages(Command):
     description = 'Generate set of man pages from setup().'
     user_options = [
         ('manpages=', 'O', 'list man pages specifications'),
+        ('jobs=', 'j', 'number of man pages generated in parallel, '
+                       '0 means the number of CPUs'),
+        ('force', 'f', 'regenerate all the man pages, even the up-to-date '
+                       'ones'),
+        ('watch', 'w', 'keep watching the files the man pages are generated '
+                       'from, and regenerate the affected pages on change'),
+        ('profile-output=', None, 'profile the man pages generation by '
+                                  'cProfile, and save the statistics into '
+                                  'the given file (implies serial build)'),
     ]
+    boolean_options = ['force', 'watch']
 
     def initialize_options(self):
         self.manpages = None
+        self.jobs = None
+        self.force = None
+        self.watch = None
+        self.profile_output = None
+        self.build_base = None
 
 
     def finalize_options(self):
+        import multiprocessing
+        from argparse_manpage.manpage import get_manpage_data_from_distribution
+        from argparse_manpage.tooling import (
+            get_pyproject_settings,
+            get_pyproject_table,
+        )
+
+        pyproject = None
+        if os.path.exists("pyproject.toml"):
+            pyproject = get_pyproject_table()
         manpages = self.manpages or get_pyproject_settings()
         if not manpages:
             raise DistutilsOptionError('\'manpages\' option is required')
         self.manpages_data = parse_manpages_spec(manpages)
 
+        if self.jobs is None and pyproject:
+            self.jobs = pyproject.get("jobs")
+        if self.jobs is None:
+            self.jobs = 1
+        try:
+            self.jobs = int(self.jobs)
+        except ValueError:
+            raise DistutilsOptionError('\'jobs\' option must be a number')
+        if self.jobs <= 0:
+            self.jobs = multiprocessing.cpu_count()
+
+        self.set_undefined_options('build', ('build_base', 'build_base'),
+                                   ('force', 'force'))
+
         # if a value wasn't set in setup.cfg, use the value from setup.py
         for page, data in self.manpages_data.items():
             get_manpage_data_from_distribution(self.distribution, data)
 
     def run(self):
+        from contextlib import ExitStack
+        from argparse_manpage.compat import get_reproducible_date
+        from argparse_manpage.profiling import cpu_profile
+        from argparse_manpage.stamps import PageStamps
+        from argparse_manpage.tooling import get_page_outputs
+
+        # The files each page was generated from, pages are only re-generated
+        # if some of them changed.
+        stamps = PageStamps(os.path.join(self.build_base,
+                                         DEFAULT_CMD_NAME + ".json"))
+        # All the pages are generated at the same time
+        date = get_reproducible_date()
+        jobs = []
         for page, data in self.manpages_data.items():
             if data.get('manfile'):
                 print ("using pre-written " + page)
-                return
+                continue
+            if not self.force and stamps.is_up_to_date(page, data):
+                print ("skipping up-to-date " + page)
+                continue
             print ("generating " + page)
-            parser = get_parser(data['import_type'], data['import_from'], data['objname'], data['objtype'], data.get('prog', None))
-            format = data.get('format', 'pretty')
-            if format in ('pretty', 'single-commands-section'):
-                manpage = Manpage(parser, format=format, _data=data)
-                write_to_filename(str(manpage), page)
-            elif format == 'old':
-                # TODO: drop the "old" format support, and stop depending on ManPageWriter
-                # pylint: disable=import-outside-toplevel
-                from .build_manpage import ManPageWriter
-                mw = ManPageWriter(parser, data)
-                mw.write(page)
-            else:
-                raise ValueError("Unknown format: {}".format(format))
+            jobs.append((page, data))
+
+        with ExitStack() as stack:
+            if self.profile_output:
+                stack.enter_context(cpu_profile(self.profile_output))
+            for page, data, inputs in self._build(jobs, date):
+                stamps.update(page, data, inputs, get_page_outputs(page, data))
+        if jobs:
+            stamps.save()
+
+        if self.watch:
+            self._watch(stamps, date)
+
+    def _watch(self, stamps, date):
+        """
+        Re-generate the pages when the files they were generated from change
+        """
+        from argparse_manpage.tooling import get_page_outputs
+        from argparse_manpage.watch import watch
+
+        inputs = {}
+        for page, data in self.manpages_data.items():
+            if not data.get('manfile') and page in stamps.pages:
+                inputs[page] = [stamp[0] for stamp in stamps.pages[page]["sources"]]
+
+        def _rebuild(page):
+            data = self.manpages_data[page]
+            page_data = dict(data)
+            page_data.setdefault('date', date)
+            page_inputs = build_manpage(page, page_data)
+            stamps.update(page, data, page_inputs,
+                          get_page_outputs(page, data))
+            stamps.save()
+            return page_inputs
+
+        watch(inputs, _rebuild)
+
+    def _build(self, jobs, date):
+        """
+        Generate the pages from the list of (page, data) JOBS, and generate
+        the (page, data, inputs) triples.
+        """
+        job_args = []
+        for page, data in jobs:
+            data = dict(data)
+            data.setdefault('date', date)
+            job_args.append((page, data))
+
+        pool = None
+        # the forked workers would not be profiled
+        if self.jobs > 1 and len(jobs) > 1 and not self.profile_output:
+            pool = _get_pool(min(self.jobs, len(jobs)))
+
+        if pool is None:
+            for (page, data), args in zip(jobs, job_args):
+                yield page, data, _build_manpage_job(args)
+            return
+
+        # Each page is generated in a separate (forked) process, so the parser
+        # imports (and the sys.argv and os.environ hacks) don't affect each
+        # other.  The pages are processed in order, so the first failure is
+        # reported the same way as in the serial mode.
+        with pool:
+            results = pool.imap(_build_manpage_job, job_args)
+            for (page, data), inputs in zip(jobs, results):
+                yield page, data, inputs
 
 
 def get_build_py_cmd(command=build_py):
@@ -167,6 +265,14 @@ def get_install_cmd(command=install):
             """
             Additional logic for installing the generated manual pages
             """
+            import shutil
+            from argparse_manpage.compat import ConfigParser, NoSectionError
+            from argparse_manpage.tooling import (
+                get_compression,
+                get_pyproject_settings,
+                get_split_pages,
+            )
+
             config = ConfigParser()
             config.read('setup.cfg')
             try:
@@ -181,9 +287,16 @@ def get_install_cmd(command=install):
             mandir = os.path.join(self.install_data, 'share/man/man1')
             if not os.path.exists(mandir):
                 os.makedirs(mandir)
-            for key, _ in data.items():
-                print ('installing {0}'.format(key))
-                shutil.copy(key, mandir)
+            for key, page_data in data.items():
+                key, _ = get_compression(key, page_data.get('compress'))
+                pages = [key]
+                if page_data.get('split_subcommands'):
+                    pages += get_split_pages(key,
+                                             page_data['split_subcommands'],
+                                             page_data.get('compress'))
+                for page in pages:
+                    print ('installing {0}'.format(page))
+                    shutil.copy(page, mandir)
 
         def run(self):
             command.run(self)
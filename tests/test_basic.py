@@ -1,13 +1,56 @@
 import unittest
+import io
 import os.path
 import sys
 import argparse
+import json
+import pickle
+import shutil
+import subprocess
+import tempfile
+import types
 
 sys.path = [os.path.join(os.path.dirname(os.path.realpath(__file__)),'..')]+sys.path
 
 from argparse_testlib import skip_on_python_older_than
 
 from build_manpages.manpage import Manpage
+from argparse_manpage.bytecode import compile_file, run_path
+from argparse_manpage.manpage import ActionCache, iter_split_manpages
+from argparse_manpage.snapshot import ParserSnapshot
+from argparse_manpage.static import StaticExtractionError, get_parser_from_source
+from argparse_manpage.stubs import _Stub
+from argparse_manpage.timings import collect_timings
+from argparse_manpage.tooling import get_parser_from_file
+
+# Modules 'setup.py' shouldn't import before the man pages are generated
+HEAVY_MODULES = ["argparse_manpage.tooling", "configparser", "multiprocessing",
+                 "runpy", "toml", "tomli", "tomllib", "zipfile"]
+
+
+def imported_modules(statement):
+    """
+    Run the STATEMENT in a fresh interpreter, and return the {module:
+    cumulative import time in microseconds} dict, see 'python -X importtime'
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')] +
+        ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            env=env, stderr=subprocess.PIPE, check=True,
+                            universal_newlines=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            modules[fields[2].strip()] = int(fields[1])
+        except ValueError:
+            # the header
+            continue
+    return modules
 
 
 
@@ -50,6 +93,499 @@ class Tests(unittest.TestCase):
         assert not_exp_line not in manpage_lines
         assert 1 == sum([1 if "COMMAND" in line else 0 for line in manpage_lines])
 
+    def test_streaming(self):
+        parser = argparse.ArgumentParser('streamed', epilog="epilog text")
+        subparsers = parser.add_subparsers(title="actions")
+        for name in ["first", "second"]:
+            sub = subparsers.add_parser(name, help=name + " command")
+            sub.add_argument("--opt", help="option for " + name)
+        man = Manpage(parser)
+        stream = io.StringIO()
+        man.write(stream)
+        assert stream.getvalue() == str(man)
+        assert not stream.getvalue().endswith("\n\n")
+        lines = list(man.iter_lines())
+        assert lines[0].startswith(".TH STREAMED")
+        assert ".SH COMMAND \\fI\\,'streamed second'\\/\\fR" in lines
+
+    def test_include_patterns(self):
+        parser = argparse.ArgumentParser('incl')
+        parser.add_argument("--first", help="first option")
+        parser.add_argument("--second", help="second option")
+        with tempfile.NamedTemporaryFile("w", suffix=".man") as include:
+            include.write("/first option/\nAFTER FIRST\n"
+                          "/(?i)SECOND/\nAFTER SECOND\n"
+                          "/(opt)ion$/\nAFTER OPTION\n")
+            include.flush()
+            lines = str(Manpage(parser, _data={"include": include.name})).split("\n")
+        index = lines.index("first option")
+        assert lines[index + 1:index + 3] == ["AFTER FIRST", "AFTER OPTION"]
+        index = lines.index("\\fB\\-\\-second\\fR \\fI\\,SECOND\\/\\fR")
+        assert lines[index + 1] == "AFTER SECOND"
+        index = lines.index("second option")
+        assert lines[index + 1:index + 3] == ["AFTER SECOND", "AFTER OPTION"]
+
+    def test_snapshot(self):
+        common = argparse.ArgumentParser(add_help=False)
+        common.add_argument("--common", help="shared by %(prog)s commands")
+        parser = argparse.ArgumentParser('snap', epilog="the epilog")
+        parser.add_argument("--hidden", help=argparse.SUPPRESS)
+        subparsers = parser.add_subparsers(title="actions")
+        subparsers.add_parser("first", aliases=["1st"], parents=[common], help="first")
+        subparsers.add_parser("second", parents=[common], help="second")
+
+        snapshot = ParserSnapshot.from_parser(parser)
+        commands = snapshot.groups[-1].subparsers.commands
+        assert [cmd.name for cmd in commands] == ["first", "second"]
+        assert commands[0].aliases == ["1st"]
+        first_action = commands[0].parser.groups[-1].actions[0]
+        assert first_action is commands[1].parser.groups[-1].actions[0]
+        assert first_action.help == "shared by snap commands"
+
+        data = {"date": "2000-01-01"}
+        for fmt in ["pretty", "single-commands-section"]:
+            loaded = pickle.loads(pickle.dumps(snapshot))
+            expected = str(Manpage(parser, format=fmt, _data=data))
+            assert str(Manpage(loaded, format=fmt, _data=data)) == expected
+            assert "hidden" not in expected
+
+    def test_native_synopsis(self):
+        parser = argparse.ArgumentParser('prog')
+        parser.add_argument("--foo", required=True)
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument("-a", action="store_true")
+        group.add_argument("-b", nargs="+", metavar="B")
+        parser.add_argument("--hidden", help=argparse.SUPPRESS)
+        parser.add_argument("pos")
+        subparser = parser.add_subparsers().add_parser("sub")
+        subparser.add_argument("--x", choices=["1", "2"])
+
+        def fail():
+            raise AssertionError("argparse usage formatted")
+        parser.format_usage = fail
+        subparser.format_usage = fail
+
+        lines = str(Manpage(parser, _data={"synopsis": "native"})).split("\n")
+        start = lines.index(".SH SYNOPSIS") + 1
+        assert lines[start:start + 7] == [
+            ".B prog",
+            "[\\fB\\-h\\fR]",
+            "\\fB\\-\\-foo\\fR \\fI\\,FOO\\/\\fR",
+            "[\\fB\\-a\\fR | \\fB\\-b\\fR \\fI\\,B [B ...]\\/\\fR]",
+            "\\fI\\,pos\\/\\fR",
+            "\\fI\\,{sub} ...\\/\\fR",
+            "",
+        ]
+        start = lines.index(".B prog pos sub")
+        assert lines[start + 1:start + 3] == [
+            "[\\fB\\-h\\fR]",
+            "[\\fB\\-\\-x\\fR \\fI\\,{1,2}\\/\\fR]",
+        ]
+
+        # custom usage is kept
+        parser = argparse.ArgumentParser('prog', usage="%(prog)s [options]")
+        snapshot = ParserSnapshot.from_parser(parser, synopsis="native")
+        assert snapshot.synopsis is None
+        assert snapshot.usage == "usage: prog [options]\n"
+
+    def test_fixed_width(self):
+        parser = argparse.ArgumentParser('prog')
+        parser.add_argument("--foo", help=" ".join(["word"] * 30))
+        subparser = parser.add_subparsers().add_parser("sub")
+        subparser.add_argument("--bar-" + "x" * 30, metavar="VALUE" * 5)
+        subparser.add_argument("--baz-" + "x" * 30, metavar="VALUE" * 5)
+
+        def probe(*args, **kwargs):
+            raise AssertionError("terminal size probed")
+
+        terminal_size = shutil.get_terminal_size
+        columns = os.environ.get("COLUMNS")
+        shutil.get_terminal_size = probe
+        try:
+            os.environ["COLUMNS"] = "200"
+            default = str(Manpage(parser))
+            narrow = str(Manpage(parser, _data={"width": 40}))
+            os.environ["COLUMNS"] = "40"
+            assert str(Manpage(parser)) == default
+        finally:
+            shutil.get_terminal_size = terminal_size
+            if columns is None:
+                del os.environ["COLUMNS"]
+            else:
+                os.environ["COLUMNS"] = columns
+
+        assert max(len(line) for line in narrow.split("\n")
+                   if line.startswith("word")) <= 40
+        assert narrow != default
+
+    def test_no_wrap(self):
+        parser = argparse.ArgumentParser(
+            'prog', description="first  line\n.second line",
+            epilog="the\n  epilog",
+            formatter_class=argparse.RawTextHelpFormatter)
+        parser.add_argument("--foo", help="foo of\n%(prog)s")
+        parser.add_argument("--bar", help=" ".join(["word"] * 30))
+        raw = str(Manpage(parser, _data={"wrap": "none"}))
+        assert ".nf\nfirst  line\n\\&.second line\n.fi\n" in raw
+        assert ".nf\nfoo of\nprog\n.fi\n" in raw
+        assert ".nf\nthe\n  epilog\n.fi\n" in raw
+        assert ".nf\n" + " ".join(["word"] * 30) + "\n.fi\n" in raw
+
+        parser.formatter_class = argparse.HelpFormatter
+        filled = str(Manpage(parser, _data={"wrap": "none"}))
+        assert ".nf" not in filled
+        assert "\nfoo of prog\n" in filled
+        assert "\nthe epilog\n" in filled
+        assert "\n" + " ".join(["word"] * 30) + "\n" in filled
+        assert filled != str(Manpage(parser))
+
+    def test_shared_actions(self):
+        common = argparse.ArgumentParser(add_help=False)
+        common.add_argument("--verbose", action="store_true", help="be verbose")
+        common.add_argument("--config", help="config file")
+        parser = argparse.ArgumentParser("prog", parents=[common])
+        subparsers = parser.add_subparsers()
+        for name in ["first", "second", "third"]:
+            subparsers.add_parser(name, parents=[common])
+
+        cache = ActionCache()
+        with collect_timings() as timings:
+            page = str(Manpage(parser, action_cache=cache))
+        assert len(cache) == 2
+        assert cache.hits == 6
+        assert timings.counters == {"duplicate actions": 6}
+        assert page.count("\\fB\\-\\-config\\fR \\fI\\,CONFIG\\/\\fR\n") == 4
+        assert page == str(Manpage(parser))
+
+        # shared by a batch of pages
+        snapshot = ParserSnapshot.from_parser(parser)
+        cache = ActionCache()
+        str(Manpage(snapshot, action_cache=cache))
+        str(Manpage(snapshot, action_cache=cache))
+        assert len(cache) == 2
+        assert cache.hits == 14
+
+    def test_common_options(self):
+        common = argparse.ArgumentParser(add_help=False)
+        common.add_argument("--verbose", action="store_true", help="be verbose")
+        parser = argparse.ArgumentParser("prog", parents=[common])
+        subparsers = parser.add_subparsers()
+        for name in ["first", "second"]:
+            subparser = subparsers.add_parser(name, parents=[common])
+            subparser.add_argument("--" + name, help="own option")
+        subparsers.add_parser("third")
+
+        verbose = "\\fB\\-\\-verbose\\fR\nbe verbose\n"
+        reference = ("Common options: \\fB\\-\\-verbose\\fR "
+                     "(see \\fBCOMMON OPTIONS\\fR).\n")
+        for fmt in ["pretty", "single-commands-section"]:
+            inline = str(Manpage(parser, format=fmt))
+            assert inline.count(verbose) == 3
+            assert "COMMON OPTIONS" not in inline
+            page = str(Manpage(parser, format=fmt,
+                               _data={"shared_options": "common"}))
+            assert page.count(verbose) == 1
+            assert page.count(reference) == 3
+            assert page.index(".SH COMMON OPTIONS\n") < page.index(verbose)
+            assert page.index(verbose) < page.index("prog first")
+            assert "own option" in page
+
+        with self.assertRaises(ValueError):
+            Manpage(parser, _data={"shared_options": "unknown"})
+
+    def test_common_options_sets(self):
+        # the same-named positional arguments shared by different commands
+        builds = argparse.ArgumentParser(add_help=False)
+        builds.add_argument("project", help="project to build in")
+        packages = argparse.ArgumentParser(add_help=False)
+        packages.add_argument("project", help="project of the package")
+        packages.add_argument("--name", help="package name")
+        parser = argparse.ArgumentParser("prog")
+        subparsers = parser.add_subparsers()
+        for name, parent in [("build", builds), ("rebuild", builds),
+                             ("add", packages), ("edit", packages)]:
+            subparsers.add_parser(name, parents=[parent])
+
+        for fmt in ["pretty", "single-commands-section"]:
+            page = str(Manpage(parser, format=fmt,
+                               _data={"shared_options": "common"}))
+            section = page[page.index(".SH COMMON OPTIONS\n"):]
+            section = section[:section.index("\n.SH", 1)]
+            assert section.split("\n.SS ")[1:] == [
+                "\\fBprog build\\fR, \\fBprog rebuild\\fR\n"
+                ".TP\n\\fBproject\\fR\nproject to build in\n",
+                "\\fBprog add\\fR, \\fBprog edit\\fR\n"
+                ".TP\n\\fBproject\\fR\nproject of the package\n\n"
+                ".TP\n\\fB\\-\\-name\\fR \\fI\\,NAME\\/\\fR\n"
+                "package name\n",
+            ]
+            assert page.count("Common options: \\fBproject\\fR (see") == 2
+            assert page.count("Common options: \\fBproject\\fR, "
+                              "\\fB\\-\\-name\\fR (see") == 2
+
+    def test_split_subcommands(self):
+        parser = argparse.ArgumentParser("prog", description="The program.")
+        parser.add_argument("--top", help="top-level option")
+        subparsers = parser.add_subparsers()
+        first = subparsers.add_parser("first", help="first command",
+                                      description="The first command.")
+        first.add_argument("--own", help="first option")
+        first.add_subparsers().add_parser("nested", help="nested command")
+        subparsers.add_parser("second", help="second command")
+
+        for fmt in ["pretty", "single-commands-section"]:
+            pages = dict(iter_split_manpages(
+                parser, format=fmt, _data={"description": "the project"}))
+            assert list(pages) == ["prog", "prog-first", "prog-first-nested",
+                                   "prog-second"]
+            top = str(pages["prog"])
+            assert "prog \\- the project\n" in top
+            assert "top\\-level option" in top
+            assert "first option" not in top
+            assert "\\fBprog\\fR \\fI\\,first\\/\\fR\nfirst command\n" in top
+            assert top.endswith(".SH SEE ALSO\n.BR prog\\-first (1),\n"
+                                ".BR prog\\-second (1)\n")
+
+            first = str(pages["prog-first"])
+            assert first.startswith('.TH PROG\\-FIRST "1"')
+            assert "\nprog\\-first \\- first command\n" in first
+            assert "The first command." in first
+            assert "first option" in first
+            assert "top\\-level option" not in first
+            assert first.endswith(".SH SEE ALSO\n.BR prog (1),\n"
+                                  ".BR prog\\-first\\-nested (1)\n")
+            assert str(pages["prog-second"]).endswith(
+                ".SH SEE ALSO\n.BR prog (1)\n")
+
+    def test_static_extraction(self):
+        source = "\n".join([
+            "import argparse",
+            "from missing_dependency import helper",
+            "DESCRIPTION = 'Static ' + 'parser'",
+            "def common(parser, name='common'):",
+            "    parser.add_argument('--' + name, help='%(prog)s option')",
+            "def get_parser():",
+            "    parser = argparse.ArgumentParser(prog='static', description=DESCRIPTION)",
+            "    common(parser)",
+            "    parser.add_argument('--version', action='version', version=helper())",
+            "    sub = parser.add_subparsers(dest='command')",
+            "    for name in ['first', 'second']:",
+            "        cmd = sub.add_parser(name, help=f'the {name} command')",
+            "        common(cmd, name=name)",
+            "        cmd.set_defaults(func=helper)",
+            "    return parser",
+            "def get_dynamic_parser():",
+            "    parser = get_parser()",
+            "    parser.add_argument('--dynamic', default=helper())",
+            "    return parser",
+            "parser = get_parser()",
+            "",
+        ])
+        with tempfile.NamedTemporaryFile("w", suffix=".py") as fd:
+            fd.write(source)
+            fd.flush()
+
+            missing = types.ModuleType("missing_dependency")
+            missing.helper = lambda: "1.0"
+            sys.modules["missing_dependency"] = missing
+            try:
+                namespace = {}
+                exec(compile(source, fd.name, "exec"), namespace)
+            finally:
+                del sys.modules["missing_dependency"]
+
+            data = {"date": "2000-01-01"}
+            expected = str(Manpage(namespace["get_parser"](), _data=data))
+            for objname, objtype in [("get_parser", "function"),
+                                     ("parser", "object")]:
+                parser = get_parser_from_source(fd.name, objname, objtype)
+                assert str(Manpage(parser, _data=data)) == expected
+            assert "missing_dependency" not in sys.modules
+
+            with self.assertRaises(StaticExtractionError):
+                get_parser_from_source(fd.name, "get_dynamic_parser", "function")
+
+    def test_static_extraction_unknown_changes(self):
+        """
+        The statically extracted parser is either the same as the imported
+        one, or the extraction fails; the module-level statements failing to
+        modify some parser must not give an incomplete page.
+        """
+        sources = [
+            # the top-level parser is not referenced by the failed statement
+            [
+                "import argparse",
+                "import third_party",
+                "parser = argparse.ArgumentParser(prog='static')",
+                "sub = parser.add_subparsers(dest='command')",
+                "p = sub.add_parser('first')",
+                "third_party.add_common(p)",
+            ],
+            # the parser is partially modified before the failure
+            [
+                "import argparse",
+                "import third_party",
+                "parser = argparse.ArgumentParser(prog='static')",
+                "def setup():",
+                "    parser.add_argument('--first')",
+                "    parser.add_argument('--second', help=third_party.HELP)",
+                "setup()",
+            ],
+        ]
+        third_party = types.ModuleType("third_party")
+        third_party.add_common = lambda p: p.add_argument("--common")
+        third_party.HELP = "second option"
+        for source in sources:
+            source = "\n".join(source + [""])
+            with tempfile.NamedTemporaryFile("w", suffix=".py") as fd:
+                fd.write(source)
+                fd.flush()
+
+                sys.modules["third_party"] = third_party
+                try:
+                    namespace = {}
+                    exec(compile(source, fd.name, "exec"), namespace)
+                finally:
+                    del sys.modules["third_party"]
+
+                data = {"date": "2000-01-01"}
+                expected = str(Manpage(namespace["parser"], _data=data))
+                try:
+                    parser = get_parser_from_source(fd.name, "parser")
+                except StaticExtractionError:
+                    continue
+                assert str(Manpage(parser, _data=data)) == expected, source
+
+    def test_stub_imports(self):
+        workdir = tempfile.mkdtemp()
+        with open(os.path.join(workdir, "heavy_package.py"), "w") as fd:
+            fd.write("raise RuntimeError('heavy package imported')\n")
+        script = os.path.join(workdir, "script")
+        with open(script, "w") as fd:
+            fd.write("\n".join([
+                "import argparse",
+                "import heavy_package",
+                "from missing_package.sub import Base, decorator",
+                "class Command(Base):",
+                "    pass",
+                "@decorator('name')",
+                "def get_parser():",
+                "    parser = argparse.ArgumentParser()",
+                "    parser.add_argument('--opt', help=Command.__name__)",
+                "    return parser",
+                "",
+            ]))
+
+        sys.path.insert(0, workdir)
+        try:
+            with self.assertRaises(RuntimeError):
+                get_parser_from_file(script, "get_parser", "function",
+                                     stub_imports="*")
+            with self.assertRaises(ImportError):
+                get_parser_from_file(script, "get_parser", "function",
+                                     stub_imports="heavy_package")
+            with self.assertRaises(ImportError):
+                get_parser_from_file(script, "get_parser", "function",
+                                     stub_imports="heavy_package,*,!missing_package")
+            parser = get_parser_from_file(script, "get_parser", "function",
+                                          stub_imports="heavy_package,*")
+        finally:
+            sys.path.remove(workdir)
+            sys.modules.pop("heavy_package", None)
+            shutil.rmtree(workdir)
+
+        assert "--opt" in parser.format_help()
+        assert "Command" in parser.format_help()
+        for name in ["heavy_package", "missing_package", "missing_package.sub"]:
+            assert name not in sys.modules
+
+        # Python < 3.7 calls the stub type as the metaclass of the subclass
+        stub = _Stub("missing_package.Base")
+        command = type(stub)("Command", (stub,), {"attr": 1})
+        assert command.__name__ == "Command"
+        assert command.__bases__ == (object,)
+        assert command().attr == 1
+
+    def test_bytecode_cache(self):
+        workdir = tempfile.mkdtemp()
+        cache_dir = os.path.join(workdir, "cache")
+        script = os.path.join(workdir, "script")
+        with open(script, "w") as fd:
+            fd.write("import sys\nPROG = sys.argv[0]\n")
+
+        dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+        try:
+            code = compile_file(script, cache_dir)
+            entries = os.listdir(cache_dir)
+            assert len(entries) == 1
+            cached = os.path.join(cache_dir, entries[0])
+            os.utime(cached, (0, 0))
+            assert compile_file(script, cache_dir) == code
+            # the cache entry was used
+            assert os.stat(cached).st_mtime != 0
+
+            argv = sys.argv
+            sys.argv = ["prog", "arg"]
+            namespace = run_path(script, cache_dir)
+            assert sys.argv == ["prog", "arg"]
+            sys.argv = argv
+            assert namespace["PROG"] == script
+            assert namespace["__name__"] == "<run_path>"
+            assert len(os.listdir(cache_dir)) == 1
+
+            # changed source is compiled again
+            with open(script, "a") as fd:
+                fd.write("CHANGED = True\n")
+            assert run_path(script, cache_dir)["CHANGED"]
+            assert len(os.listdir(cache_dir)) == 2
+        finally:
+            sys.dont_write_bytecode = dont_write_bytecode
+            shutil.rmtree(workdir)
+
+    def test_import_time(self):
+        skip_on_python_older_than("3.7", "-X importtime, lazy imports")
+        for statement in ["import argparse_manpage.compat",
+                          "from build_manpages import __version__"]:
+            modules = imported_modules(statement)
+            assert "argparse_manpage" in modules
+            for module in HEAVY_MODULES + ["setuptools"]:
+                assert module not in modules, (statement, module)
+
+        # setup.py imports setuptools anyway, but nothing else
+        modules = set(imported_modules(
+            "from build_manpages import build_manpages"))
+        assert "setuptools" in modules
+        modules -= set(imported_modules("import setuptools"))
+        for module in HEAVY_MODULES:
+            assert module not in modules, module
+
+        # the script needs the tooling, but not the modules used only by
+        # some of the options; argparse itself imports e.g. shutil (-> lzma)
+        modules = set(imported_modules("import argparse_manpage.cli"))
+        assert "argparse_manpage.tooling" in modules
+        modules -= set(imported_modules(
+            "import argparse; argparse.ArgumentParser()"))
+        for module in ["argparse_manpage.cache", "argparse_manpage.server",
+                       "argparse_manpage.static", "argparse_manpage.stubs",
+                       "argparse_manpage.watch", "ast", "cProfile", "gzip",
+                       "lzma", "socket", "socketserver", "tracemalloc"]:
+            assert module not in modules, module
+
+    def test_benchmark(self):
+        script = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                              '..', 'benchmarks', 'bench_render.py')
+        output = subprocess.check_output([
+            sys.executable, script, "--options", "2", "--groups", "1",
+            "--subcommands", "2", "--depth", "2", "--repeat", "1"])
+        result = json.loads(output.decode("utf-8"))
+        assert result["parsers"] == 7
+        assert sorted(result["results"]) == ["pretty", "single-commands-section"]
+        for fmt_result in result["results"].values():
+            assert fmt_result["peak_memory_bytes"] > 0
+            assert fmt_result["str_seconds"]["min"] > 0
+            assert fmt_result["output_lines"] > 100
+
 
 if __name__ == "__main__":
     unittest.main()
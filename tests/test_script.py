@@ -2,18 +2,25 @@
 Tests for the 'argparse-manpage' script.
 """
 
+import gzip
+import json
+import lzma
 import os
+import pstats
 import shutil
+import signal
+import struct
 import sys
 import subprocess
 import tempfile
+import time
 import warnings
 
 from packaging import version
 
 import setuptools
 
-from test_examples import run_setup_py
+from test_examples import _mandir, run_setup_py
 from argparse_testlib import pushd
 from argparse_manpage.compat import get_reproducible_date
 
@@ -173,6 +180,566 @@ class TestsArgparseManpageScript:
         assert output == FULL_OUTPUT.format(name=name, NAME=name.upper(),
                                             DATE=DATE)
 
+    def test_cache_dir(self):
+        """
+        Test that --cache-dir avoids importing the unchanged file.
+        """
+        name = "cached-file"
+        expname = r"cached\-file"
+        tested_executable = os.path.join(self.workdir, name)
+        marker = os.path.join(self.workdir, "imported")
+        contents = SIMPLE_FILE_CONTENTS.format(ap_arguments="")
+        contents = "open({0!r}, 'a').write('x')\n".format(marker) + contents
+        with open(tested_executable, "w+") as script_fd:
+            script_fd.write(contents)
+
+        cmd = [
+            self._get_am_executable(),
+            "--pyfile", tested_executable,
+            "--function", "get_parser",
+            "--cache-dir", os.path.join(self.workdir, "cache"),
+        ]
+        expected = SIMPLE_OUTPUT.format(name=expname, version="",
+                                        NAME=expname.upper(), DATE=DATE)
+        env = dict(os.environ, XDG_CACHE_HOME=os.path.join(self.workdir, "xdg"))
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        for _ in range(2):
+            output = subprocess.check_output(cmd, env=env).decode("utf-8")
+            assert output == expected
+        with open(marker) as marker_fd:
+            assert marker_fd.read() == "x"
+        # the compiled script is cached only within the --cache-dir
+        assert os.listdir(os.path.join(self.workdir, "cache", "bytecode"))
+        subprocess.check_output(cmd[:-2], env=env)
+        assert not os.path.exists(os.path.join(self.workdir, "xdg"))
+        with open(marker) as marker_fd:
+            assert marker_fd.read() == "xx"
+
+        with open(tested_executable, "w+") as script_fd:
+            script_fd.write(contents.replace('"test"', '"changed"'))
+        output = subprocess.check_output(cmd).decode("utf-8")
+        assert "changed" in output
+        with open(marker) as marker_fd:
+            assert marker_fd.read() == "xxx"
+
+    def test_batch(self):
+        """
+        Test --batch with both plain spec file and pyproject.toml.
+        """
+        with pushd(self.workdir):
+            for name in ["first", "second"]:
+                with open(name, "w+") as script_fd:
+                    script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments=""))
+            with open("pages.spec", "w+") as spec_fd:
+                spec_fd.write("# comment\n"
+                              "man/first.1:pyfile=first:function=get_parser\n"
+                              "\n"
+                              "man/second.1:pyfile=second:function=get_parser\n")
+            with open("pyproject.toml", "w+") as spec_fd:
+                spec_fd.write('[tool.build_manpages]\nmanpages = [\n'
+                              '  "toml/first.1:pyfile=first:function=get_parser",\n'
+                              ']\n')
+
+            for spec, pages in [("pages.spec", ["man/first.1", "man/second.1"]),
+                                ("pyproject.toml", ["toml/first.1"])]:
+                subprocess.check_call([self._get_am_executable(), "--batch",
+                                       spec, "--version", "1.0"])
+                for page in pages:
+                    name = os.path.basename(page)[:-2]
+                    with open(page) as page_fd:
+                        assert page_fd.read() == SIMPLE_OUTPUT.format(
+                            name=name, version=" 1.0", NAME=name.upper(),
+                            DATE=DATE)
+
+    def test_parallel_build(self):
+        """
+        Test that 'build_manpages --jobs' gives the same pages as serial build.
+        """
+        with pushd(self.workdir):
+            with open("setup.py", "w+") as script_fd:
+                # explicit name, don't let setuptools discover it
+                script_fd.write(SETUP_PY_FILE_CONTENTS.replace(
+                    "setup(", "setup(\n    name='proj', py_modules=[],"))
+            specs = []
+            for i in range(4):
+                name = "prog{0}".format(i)
+                with open(name, "w+") as script_fd:
+                    script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments=""))
+                specs.append('"{{dir}}/{0}.1:pyfile={0}:function=get_parser",'.format(name))
+            pages = {}
+            for directory, jobs in [("serial", "1"), ("parallel", "3")]:
+                with open("pyproject.toml", "w+") as script_fd:
+                    script_fd.write("[tool.build_manpages]\nmanpages = [\n{0}\n]\n"
+                                    "jobs = {1}\n".format("\n".join(specs), jobs)
+                                    .format(dir=directory))
+                assert 0 == run_setup_py(["build_manpages"])
+                pages[directory] = {}
+                for name in sorted(os.listdir(directory)):
+                    with open(os.path.join(directory, name)) as page_fd:
+                        pages[directory][name] = page_fd.read()
+            assert len(pages["parallel"]) == 4
+            assert pages["serial"] == pages["parallel"]
+
+    def test_incremental_build(self):
+        """
+        Test that 'build_manpages' re-generates only the outdated pages.
+        """
+        with pushd(self.workdir):
+            with open("setup.py", "w+") as script_fd:
+                script_fd.write(SETUP_PY_FILE_CONTENTS.replace(
+                    "setup(", "setup(\n    name='proj', py_modules=[],"))
+            with open("pyproject.toml", "w+") as script_fd:
+                script_fd.write("[tool.build_manpages]\nmanpages = [\n"
+                                '"first.1:pyfile=first:function=get_parser",\n'
+                                '"second.1:pyfile=second:function=get_parser",\n'
+                                "]\n")
+            for name in ["first", "second"]:
+                with open(name, "w+") as script_fd:
+                    script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments=""))
+
+            def _mtimes():
+                return [os.stat(name).st_mtime_ns for name in ["first.1", "second.1"]]
+
+            assert 0 == run_setup_py(["build_manpages"])
+            generated = _mtimes()
+            assert 0 == run_setup_py(["build_manpages"])
+            assert _mtimes() == generated
+
+            with open("second", "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments="")
+                                .replace('"test"', '"changed"'))
+            assert 0 == run_setup_py(["build_manpages"])
+            regenerated = _mtimes()
+            assert regenerated[0] == generated[0]
+            assert regenerated[1] != generated[1]
+            with open("second.1") as page_fd:
+                assert "changed" in page_fd.read()
+
+            # the SOURCE_DATE_EPOCH change makes the pages outdated, but the
+            # same value doesn't
+            os.environ["SOURCE_DATE_EPOCH"] = "0"
+            try:
+                assert 0 == run_setup_py(["build_manpages"])
+                dated = _mtimes()
+                assert dated[0] != regenerated[0]
+                assert dated[1] != regenerated[1]
+                with open("first.1") as page_fd:
+                    assert "1970\\-01\\-01" in page_fd.read()
+                assert 0 == run_setup_py(["build_manpages"])
+                assert _mtimes() == dated
+                os.environ["SOURCE_DATE_EPOCH"] = str(24 * 3600)
+                assert 0 == run_setup_py(["build_manpages"])
+                with open("first.1") as page_fd:
+                    assert "1970\\-01\\-02" in page_fd.read()
+            finally:
+                del os.environ["SOURCE_DATE_EPOCH"]
+
+            # without SOURCE_DATE_EPOCH, the date alone doesn't make the
+            # page outdated
+            assert 0 == run_setup_py(["build_manpages"])
+            dated = _mtimes()
+            assert 0 == run_setup_py(["build_manpages"])
+            assert _mtimes() == dated
+            assert 0 == run_setup_py(["build_manpages", "--force"])
+
+    def test_incremental_build_preimported(self):
+        """
+        Test that the modules imported by setup.py before the parser is loaded
+        are tracked as the page sources, too.
+        """
+        with pushd(self.workdir):
+            os.mkdir("mypkg")
+            with open(os.path.join("mypkg", "__init__.py"), "w+"):
+                pass
+            with open(os.path.join("mypkg", "options.py"), "w+") as script_fd:
+                script_fd.write('VERSION = "1.0"\nHELP = "first help"\n')
+            with open(os.path.join("mypkg", "cli.py"), "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments="")
+                                .replace("import argparse",
+                                         "import argparse\nimport mypkg.options")
+                                .replace('"test"', '"test", help=mypkg.options.HELP'))
+            with open("setup.py", "w+") as script_fd:
+                script_fd.write("import mypkg.options\n" + SETUP_PY_FILE_CONTENTS.replace(
+                    "setup(", "setup(\n    name='proj', py_modules=[],\n"
+                    "    version=mypkg.options.VERSION,"))
+            with open("pyproject.toml", "w+") as script_fd:
+                script_fd.write("[tool.build_manpages]\nmanpages = [\n"
+                                '"mypkg.1:module=mypkg.cli:function=get_parser",\n'
+                                "]\n")
+
+            assert 0 == run_setup_py(["build_manpages"])
+            with open("mypkg.1") as page_fd:
+                assert "first help" in page_fd.read()
+
+            with open(os.path.join("mypkg", "options.py"), "w+") as script_fd:
+                script_fd.write('VERSION = "1.0"\nHELP = "second help"\n')
+            assert 0 == run_setup_py(["build_manpages"])
+            with open("mypkg.1") as page_fd:
+                assert "second help" in page_fd.read()
+
+    def test_depfile(self):
+        """
+        Test that --depfile lists the loaded python files and the include file.
+        """
+        with pushd(self.workdir):
+            os.mkdir("helper")
+            with open(os.path.join("helper", "__init__.py"), "w+") as helper_fd:
+                helper_fd.write("HELP = 'the test'\n")
+            with open("some file", "w+") as script_fd:
+                script_fd.write("from helper import HELP\n" + SIMPLE_FILE_CONTENTS
+                                .format(ap_arguments="").replace('"test"', '"test", help=HELP'))
+            include = os.path.join(os.path.dirname(__file__), "extra.man")
+            environ = dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd(), os.environ["PYTHONPATH"]]))
+            subprocess.check_call([
+                self._get_am_executable(),
+                "--pyfile", "some file",
+                "--function", "get_parser",
+                "--include", include,
+                "--output", "man/some-file.1",
+                "--depfile", "man/some-file.1.d",
+            ], env=environ)
+            with open("man/some-file.1.d") as depfile:
+                assert depfile.read() == "man/some-file.1: \\\n  {0} \\\n  {1} \\\n  {2}\n".format(
+                    os.path.join(os.getcwd(), "helper", "__init__.py"),
+                    os.path.join(os.getcwd(), "some\\ file"),
+                    os.path.abspath(include),
+                )
+
+    def test_unchanged_output(self):
+        """
+        Test that unchanged manual page file is not re-written.
+        """
+        with pushd(self.workdir):
+            with open("some-file", "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments=""))
+            cmd = [self._get_am_executable(), "--pyfile", "some-file",
+                   "--function", "get_parser", "--output", "some-file.1"]
+            subprocess.check_call(cmd)
+            os.utime("some-file.1", (0, 0))
+            subprocess.check_call(cmd)
+            assert os.stat("some-file.1").st_mtime == 0
+            # no temporary files left behind
+            assert sorted(os.listdir(".")) == ["some-file", "some-file.1"]
+
+            with open("some-file", "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments="")
+                                .replace('"test"', '"changed"'))
+            subprocess.check_call(cmd)
+            assert os.stat("some-file.1").st_mtime != 0
+            with open("some-file.1") as page_fd:
+                assert "changed" in page_fd.read()
+
+    def test_compressed_output(self):
+        """
+        Test that the gzip-compressed manual page is reproducible.
+        """
+        with pushd(self.workdir):
+            with open("some-file", "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments=""))
+            env = dict(os.environ)
+            env["SOURCE_DATE_EPOCH"] = "1000000000"
+            cmd = [self._get_am_executable(), "--pyfile", "some-file",
+                   "--function", "get_parser"]
+            expected = subprocess.check_output(cmd, env=env)
+
+            subprocess.check_call(cmd + ["--output", "some-file.1.gz"], env=env)
+            with gzip.open("some-file.1.gz") as page_fd:
+                assert page_fd.read() == expected
+            with open("some-file.1.gz", "rb") as page_fd:
+                first = page_fd.read()
+            # the timestamp in gzip header is taken from SOURCE_DATE_EPOCH
+            assert struct.unpack("<I", first[4:8])[0] == 1000000000
+
+            # the suffix is appended to the --output file name
+            subprocess.check_call(cmd + ["--output", "other.1", "--compress",
+                                         "gzip"], env=env)
+            with open("other.1.gz", "rb") as page_fd:
+                assert page_fd.read() == first
+
+            subprocess.check_call(cmd + ["--output", "some-file.1.xz"], env=env)
+            with lzma.open("some-file.1.xz") as page_fd:
+                assert page_fd.read() == expected
+
+            assert sorted(os.listdir(".")) == ["other.1.gz", "some-file",
+                                               "some-file.1.gz",
+                                               "some-file.1.xz"]
+
+    def test_extract_static(self):
+        """
+        Test that --extract=static falls back to import when needed.
+        """
+        with pushd(self.workdir):
+            with open("some-file", "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments=""))
+            with open("dynamic-file", "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(
+                    ap_arguments="prog=os.path.basename('/dynamic')").replace(
+                        "import argparse", "import argparse, os"))
+            for name in ["some-file", "dynamic-file"]:
+                cmd = [self._get_am_executable(), "--pyfile", name,
+                       "--function", "get_parser"]
+                imported = subprocess.check_output(cmd)
+                extracted = subprocess.check_output(cmd + ["--extract", "static"])
+                assert imported == extracted
+
+    def test_split_subcommands(self):
+        """
+        Test the --split-subcommands option, and the skipped writes of the
+        unchanged pages.
+        """
+        with pushd(self.workdir):
+            with open("some-file", "w+") as script_fd:
+                script_fd.write("\n".join([
+                    "import argparse",
+                    "def get_parser():",
+                    "    parser = argparse.ArgumentParser('some-file')",
+                    "    subparsers = parser.add_subparsers()",
+                    "    sub = subparsers.add_parser('sub', help='sub help')",
+                    "    sub.add_subparsers().add_parser('nested')",
+                    "    return parser",
+                    ""]))
+            cmd = [self._get_am_executable(), "--pyfile", "some-file",
+                   "--function", "get_parser", "--split-subcommands", "man"]
+            subprocess.check_call(cmd)
+            assert sorted(os.listdir("man")) == [
+                "some-file-sub-nested.1", "some-file-sub.1", "some-file.1",
+                "some-file.1.pages"]
+            with open(os.path.join("man", "some-file-sub.1")) as fd:
+                content = fd.read()
+            assert "some\\-file\\-sub \\- sub help" in content
+            assert ".BR some\\-file (1),\n" in content
+
+            mtime = os.stat(os.path.join("man", "some-file-sub.1")).st_mtime_ns
+            subprocess.check_call(cmd + ["--output", "top.1.gz"])
+            assert os.path.exists("top.1.gz")
+            assert os.path.exists(os.path.join("man", "top-sub.1.gz"))
+            subprocess.check_call(cmd)
+            assert mtime == os.stat(os.path.join("man", "some-file-sub.1")).st_mtime_ns
+
+            # the pages of the removed sub-commands are removed, but not the
+            # pages of other programs
+            with open(os.path.join("man", "some-file-other.1"), "w"):
+                pass
+            with open("some-file") as script_fd:
+                script = script_fd.read()
+            with open("some-file", "w") as script_fd:
+                script_fd.write(script.replace(
+                    "    sub.add_subparsers().add_parser('nested')\n", ""))
+            subprocess.check_call(cmd)
+            assert sorted(os.listdir("man")) == [
+                "some-file-other.1", "some-file-sub.1", "some-file.1",
+                "some-file.1.pages", "top-sub-nested.1.gz", "top-sub.1.gz",
+                "top.1.pages"]
+
+            # all the pages depend on the sources
+            subprocess.check_call(cmd + ["--output", "man/some-file.1",
+                                         "--depfile", "some-file.d"])
+            with open("some-file.d") as depfile:
+                assert depfile.read() == (
+                    "man/some-file.1 man/some-file-sub.1 man/some-file.1.pages: "
+                    "\\\n  {0}\n".format(os.path.abspath("some-file")))
+
+    def test_split_subcommands_build(self):
+        """
+        Test that build_manpages tracks, and install installs, exactly the
+        pages of the split page.
+        """
+        with pushd(self.workdir):
+            with open("setup.py", "w+") as script_fd:
+                script_fd.write(SETUP_PY_FILE_CONTENTS.replace(
+                    "setup(", "setup(\n    name='proj', py_modules=[],"))
+            with open("pyproject.toml", "w+") as script_fd:
+                script_fd.write("[tool.build_manpages]\nmanpages = [\n"
+                                '"man/prog.1:pyfile=prog:function=get_parser'
+                                ':split_subcommands=man",\n'
+                                "]\n")
+            with open("prog", "w+") as script_fd:
+                script_fd.write("\n".join([
+                    "import argparse",
+                    "def get_parser():",
+                    "    parser = argparse.ArgumentParser('prog')",
+                    "    subparsers = parser.add_subparsers()",
+                    "    subparsers.add_parser('first')",
+                    "    subparsers.add_parser('second')",
+                    "    return parser",
+                    ""]))
+            os.mkdir("man")
+            # some other program's page
+            with open(os.path.join("man", "prog-other.1"), "w"):
+                pass
+
+            assert 0 == run_setup_py(["build_manpages"])
+            os.unlink(os.path.join("man", "prog-second.1"))
+            # the removed sub-page makes the page outdated
+            assert 0 == run_setup_py(["build_manpages"])
+            assert os.path.exists(os.path.join("man", "prog-second.1"))
+
+            with open("prog") as script_fd:
+                script = script_fd.read()
+            with open("prog", "w") as script_fd:
+                script_fd.write(script.replace("second", "third"))
+            assert 0 == run_setup_py(["build_manpages"])
+            assert sorted(os.listdir("man")) == [
+                "prog-first.1", "prog-other.1", "prog-third.1", "prog.1",
+                "prog.1.pages"]
+
+            idir = os.path.join(self.workdir, "install_dir")
+            assert 0 == run_setup_py(["install", "--root", idir,
+                                      "--prefix", "/usr"])
+            mandir = os.path.join(idir, _mandir("usr/"))
+            assert sorted(os.listdir(mandir)) == [
+                "prog-first.1", "prog-third.1", "prog.1"]
+
+    def test_timings(self):
+        """
+        Test the --timings=json report.
+        """
+        with pushd(self.workdir):
+            with open("some-file", "w+") as script_fd:
+                script_fd.write("\n".join([
+                    "import argparse",
+                    "def get_parser():",
+                    "    parser = argparse.ArgumentParser('some-file')",
+                    "    subparsers = parser.add_subparsers()",
+                    "    sub = subparsers.add_parser('sub')",
+                    "    sub.add_subparsers().add_parser('nested')",
+                    "    return parser",
+                    ""]))
+            cmd = [self._get_am_executable(), "--pyfile", "some-file",
+                   "--function", "get_parser", "--output", "some-file.1"]
+            subprocess.check_call(cmd)
+            with open("some-file.1") as fd:
+                expected = fd.read()
+            result = subprocess.run(cmd + ["--timings=json"], check=True,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            assert result.stdout == b""
+            with open("some-file.1") as fd:
+                assert fd.read() == expected
+
+            # skip the "running from git" warning
+            stderr = result.stderr.decode("utf-8")
+            report = json.loads(stderr[stderr.index("{"):])
+            for stage in ["import", "factory", "snapshot", "render", "write"]:
+                assert report["stages"][stage]["calls"] == 1
+                assert report["stages"][stage]["seconds"] >= 0
+            assert report["stages"]["usage"]["calls"] == 3
+            assert report["counters"] == {}
+            assert list(report["subcommands"]) == ["some-file sub",
+                                                   "some-file sub nested"]
+
+    def test_profiling(self):
+        """
+        Test the --profile-output and --memory-profile options.
+        """
+        with pushd(self.workdir):
+            with open("some-file", "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments=""))
+            cmd = [self._get_am_executable(), "--pyfile", "some-file",
+                   "--function", "get_parser"]
+            expected = subprocess.check_output(cmd)
+            result = subprocess.run(
+                cmd + ["--profile-output", "profile.pstats", "--memory-profile"],
+                check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            assert result.stdout == expected
+            report = result.stderr.decode("utf-8").splitlines()
+            assert any(line.startswith("load: ") for line in report)
+            assert any(line.startswith("render: ") for line in report)
+            assert report[-1].startswith("peak: ")
+
+            stats = pstats.Stats("profile.pstats")
+            functions = [function for _, _, function in stats.stats]
+            assert "write_manpage_from_spec" in functions
+
+    def test_serve(self):
+        """
+        Test the --serve and --connect modes.
+        """
+        with pushd(self.workdir):
+            with open("some-file", "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments=""))
+            server = subprocess.Popen([self._get_am_executable(), "--serve",
+                                       "socket"])
+            try:
+                for _ in range(100):
+                    if os.path.exists("socket"):
+                        break
+                    time.sleep(0.1)
+                # only the owner can connect
+                assert os.stat("socket").st_mode & 0o777 == 0o600
+                args = ["--pyfile", "some-file", "--function", "get_parser"]
+                client = [self._get_am_executable(), "--connect", "socket"]
+                expected = subprocess.check_output(
+                    [self._get_am_executable()] + args)
+                assert subprocess.check_output(client + args) == expected
+
+                with open("some-file", "w+") as script_fd:
+                    script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments="")
+                                    .replace('"test"', '"changed"'))
+                assert b"changed" in subprocess.check_output(client + args)
+
+                assert subprocess.call(client + ["--pyfile", "missing-file",
+                                                 "--function", "get_parser"]) == 1
+
+                # the pre-written page is passed through, and it is the only
+                # dependency
+                with open("some-file.1", "w+") as page_fd:
+                    page_fd.write(".TH PRE-WRITTEN 1\n")
+                subprocess.check_call(client + args + [
+                    "--manfile", "some-file.1", "--output", "out.1",
+                    "--depfile", "out.1.d"])
+                with open("out.1") as page_fd:
+                    assert page_fd.read() == ".TH PRE-WRITTEN 1\n"
+                with open("out.1.d") as depfile:
+                    assert depfile.read() == "out.1: \\\n  {0}\n".format(
+                        os.path.abspath("some-file.1"))
+            finally:
+                server.terminate()
+                server.wait()
+
+    def test_watch(self):
+        """
+        Test that --watch re-generates the page when its sources change.
+        """
+        with pushd(self.workdir):
+            os.mkdir("helper")
+            with open(os.path.join("helper", "__init__.py"), "w") as helper_fd:
+                helper_fd.write("ARG = 'first'\n")
+            with open("some-file", "w+") as script_fd:
+                script_fd.write(SIMPLE_FILE_CONTENTS.format(ap_arguments="")
+                                .replace('"test"', 'helper.ARG')
+                                .replace("import argparse",
+                                         "import argparse, helper"))
+            env = dict(os.environ)
+            env["PYTHONPATH"] = os.pathsep.join([self.workdir, os.getcwd()])
+
+            def _wait_for(text):
+                for _ in range(100):
+                    if os.path.exists("some-file.1"):
+                        with open("some-file.1") as page_fd:
+                            if text in page_fd.read():
+                                return True
+                    time.sleep(0.1)
+                return False
+
+            watcher = subprocess.Popen(
+                [self._get_am_executable(), "--pyfile", "some-file",
+                 "--function", "get_parser", "--output", "some-file.1",
+                 "--watch"], env=env, stdout=subprocess.PIPE,
+                universal_newlines=True)
+            try:
+                assert _wait_for("first")
+                # the sources are stamped after the first page is written
+                for line in watcher.stdout:
+                    if "watching" in line:
+                        break
+                with open(os.path.join("helper", "__init__.py"), "w") as helper_fd:
+                    helper_fd.write("ARG = 'second'\n")
+                assert _wait_for("second")
+            finally:
+                watcher.send_signal(signal.SIGINT)
+                assert watcher.wait() == 0
+
     def test_pyproject_toml(self):
         """
         Test that we can read information from pyproject.toml.